@@ -0,0 +1,59 @@
+# benchmarks/automod_filter_bench.py
+# Compares the old per-word substring scan in AutoModConfigCog with the compiled WordFilter
+# for growing word lists. Run from the repository root: python benchmarks/automod_filter_bench.py
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.aho_corasick import WordFilter
+
+WORD_LIST_SIZES = [10, 100, 500, 1000, 5000]
+MESSAGE_COUNT = 2000
+random.seed(1234)
+
+
+def random_word(min_len=4, max_len=10):
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(min_len, max_len)))
+
+
+def make_messages(words):
+    """Chat-like messages; about 1 in 20 contains a listed word."""
+    messages = []
+    for _ in range(MESSAGE_COUNT):
+        parts = [random_word(2, 8) for _ in range(random.randint(3, 25))]
+        if random.random() < 0.05:
+            parts.insert(random.randrange(len(parts) + 1), random.choice(words))
+        messages.append(" ".join(parts))
+    return messages
+
+
+def naive_match(words, message):
+    message_lower = message.lower()
+    return any(word.lower() in message_lower for word in words)
+
+
+def timed(func, messages):
+    start = time.perf_counter()
+    hits = sum(1 for message in messages if func(message))
+    return (time.perf_counter() - start) / len(messages) * 1e6, hits
+
+
+def main():
+    print(f"{'words':>6} {'build ms':>9} {'naive us/msg':>13} {'filter us/msg':>14} {'speedup':>8} {'hits':>11}")
+    for size in WORD_LIST_SIZES:
+        words = [random_word() for _ in range(size)]
+        messages = make_messages(words)
+        start = time.perf_counter()
+        word_filter = WordFilter(words, leet=False) # Plain casefolding, same semantics as the naive scan
+        build_ms = (time.perf_counter() - start) * 1000
+        naive_us, naive_hits = timed(lambda m: naive_match(words, m), messages)
+        filter_us, filter_hits = timed(lambda m: word_filter.find(m) is not None, messages)
+        print(f"{size:>6} {build_ms:>9.1f} {naive_us:>13.1f} {filter_us:>14.1f} {naive_us / filter_us:>7.1f}x {naive_hits:>5}/{filter_hits:<5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ from discord.ext import commands
 from dotenv import load_dotenv
 import asyncio
 from discord import app_commands
+from utils.http_client import HTTPClient
+from utils.llm_scheduler import LLMScheduler
+from utils.dispatch import MessageDispatcher
+from utils.guild_settings import guild_settings
 
 # Load environment variables
 load_dotenv("/home/server/keys.env")
@@ -40,8 +44,23 @@ async def on_ready():
 
 async def main():
     async with bot:
-        await load_cogs()
-        await bot.start(discord_token)
+        # Shared HTTP connection pool for every cog's outbound API calls
+        bot.http_client = HTTPClient.from_env()
+        await bot.http_client.start()
+        # Shared rate limiter / priority queue for every LLM API call
+        bot.llm_scheduler = LLMScheduler.from_env()
+        # Single on_message pipeline; listener cogs register handlers with it
+        bot.message_dispatcher = MessageDispatcher(bot)
+        # Per-guild settings shared by the cogs; picks up hand edits to the settings files
+        guild_settings.start_watching()
+        try:
+            await load_cogs()
+            await bot.start(discord_token)
+        finally:
+            await bot.message_dispatcher.close()
+            await guild_settings.close()
+            await bot.llm_scheduler.close()
+            await bot.http_client.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -7,17 +7,154 @@ import asyncio
 import random # Added for emoji reactions
 import re
 import urllib.parse
-import subprocess
+import shlex
+import time
 from datetime import datetime, timedelta
 from discord.ext import commands
 from discord import app_commands
 from typing import Optional, Dict, List, Any # Added Any
+from utils.history_journal import HistoryJournal
+from utils.ai_store import AIStore
+from utils.persistence import persister
+from utils.http_client import get_http_client
+from utils.llm_scheduler import get_llm_scheduler, PRIORITY_CHAT, PRIORITY_BACKGROUND
+from utils.sse import iter_sse_json, ChatStreamAccumulator
+from utils.retrieval import BM25Index, estimate_tokens
+from utils.fact_index import UserFactIndex
+from utils.system_commands import run_builtin, COMMAND_TTLS
+from utils.ttl_cache import TTLCache, MISSING
+from utils.dispatch import MessageFacts, get_message_dispatcher
 
 # Define paths for persistent data - ENSURE THESE DIRECTORIES ARE WRITABLE
 DEFAULT_MEMORY_PATH = "/home/server/wdiscordbot/mind.json"
 DEFAULT_HISTORY_PATH = "ai_conversation_history.json"
 DEFAULT_MANUAL_CONTEXT_PATH = "ai_manual_context.json"
 DEFAULT_DYNAMIC_LEARNING_PATH = "ai_dynamic_learning.json" # New file for dynamic learning examples
+DEFAULT_HISTORY_SUMMARY_PATH = "ai_history_summaries.json" # Rolling per-user summaries of older conversation
+MAX_HISTORY_MESSAGES = 60 # Hard cap on stored messages per user (older ones are normally summarized before this)
+HISTORY_COMPACT_INTERVAL = 300 # Seconds between background history compactions
+HISTORY_COMPACT_THRESHOLD = 500 # Compact early once this many journal records are pending
+DEFAULT_AI_DB_PATH = "ai_data.sqlite3" # Used when BOT_AI_STORAGE=sqlite
+DISCORD_CHUNK_SIZE = 1990 # Stay under Discord's 2000 character message limit
+STREAM_EDIT_INTERVAL = 1.2 # Seconds between progressive edits of a streamed reply (Discord allows ~5 edits / 5 s)
+STREAM_FIRST_MESSAGE_CHARS = 200 # Show the reply after this much text even if no sentence has ended yet
+SENTENCE_END_PATTERN = re.compile(r"[.!?~](\s|$)|\n")
+BURST_WINDOW = float(os.getenv("AI_BURST_WINDOW", "1.5")) # Seconds of quiet before answering a burst of messages in an AI channel
+BURST_MAX_WAIT = 6.0 # Answer a burst after this long even if the user keeps typing
+TOOL_TIMEOUTS = {"run_safe_shell_command": 15.0, "remember_fact_about_user": 5.0} # Seconds per tool call
+DEFAULT_TOOL_TIMEOUT = 10.0
+TOOL_LATENCY_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000) # Upper bounds; one extra bucket for slower calls
+CONTEXT_TOP_K = int(os.getenv("AI_CONTEXT_TOP_K", "8")) # Max context + learning entries picked per prompt once they no longer all fit
+CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "1500")) # Estimated tokens allowed for context + learning entries
+FACT_TOP_K = int(os.getenv("AI_FACT_TOP_K", "12")) # Max remembered facts put in a prompt (most relevant first)
+FACT_INDEX_CACHE_TTL = 1800 # Seconds a user's fact index is kept after it was built; rebuilt from memory on the next use
+FACT_INDEX_CACHE_SIZE = int(os.getenv("AI_FACT_INDEX_CACHE_SIZE", "1000")) # Users whose fact index is kept in memory
+PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "6000")) # Estimated tokens for system prompt + summary + history + message
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("AI_SUMMARY_TRIGGER_MESSAGES", "30")) # Summarize once a user has this many stored messages...
+SUMMARY_TRIGGER_TOKENS = PROMPT_TOKEN_BUDGET // 2 # ...or once their stored messages are this large
+SUMMARY_KEEP_MESSAGES = 12 # Newest messages kept word for word after summarizing
+SUMMARY_MAX_TOKENS = 400
+CONTEXT_QUERY_HISTORY = 4 # Recent history messages added to the prompt when ranking context entries
+
+def split_discord_message(text: str, limit: int = DISCORD_CHUNK_SIZE) -> List[str]:
+    """Split text into message-sized chunks, preferring to break at a newline or space."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit # No good break point; hard split
+        chunks.append(text[:cut])
+        text = text[cut:]
+        if text[:1] in ("\n", " "):
+            text = text[1:] # Drop the whitespace we split on
+    if text.strip():
+        chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """
+    Shows an AI reply in Discord while it is still being generated.
+
+    The first message is sent once the first sentence has arrived; after that the message is edited
+    at most every STREAM_EDIT_INTERVAL seconds, and text past the 2000 character limit rolls over
+    into follow-up messages. `finish` always renders the final text, so it also works for replies
+    that were not streamed (errors, command shortcuts, streaming disabled).
+    """
+    def __init__(self, send_first, send_more, prefix: str = ""):
+        self.send_first = send_first # async (content) -> discord.Message, for the first message
+        self.send_more = send_more # async (content) -> discord.Message, for rollover messages
+        self.prefix = prefix
+        self.text = ""
+        self.messages: List[Any] = []
+        self.rendered: List[str] = [] # What each sent message currently shows
+        self.last_render = 0.0
+        self.committed = False # The reply was written to history
+
+    def restart(self):
+        """Start a new completion (tool loop iteration); already-sent messages are reused."""
+        self.text = ""
+
+    async def feed(self, delta: str):
+        self.text += delta
+        if not self.messages:
+            if not SENTENCE_END_PATTERN.search(self.text) and len(self.text) < STREAM_FIRST_MESSAGE_CHARS:
+                return # Wait for the first sentence
+        elif time.monotonic() - self.last_render < STREAM_EDIT_INTERVAL:
+            return
+        try:
+            await self._render(self.prefix + self.text)
+        except discord.HTTPException as e:
+            print(f"Failed to update streamed reply: {e}") # Keep generating; finish() will retry
+
+    async def finish(self, final_text: str):
+        await self._render(self.prefix + final_text)
+
+    async def discard(self):
+        """Delete everything sent so far (the reply was superseded)."""
+        while self.messages:
+            message = self.messages.pop()
+            self.rendered.pop()
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
+
+    async def _render(self, full_text: str):
+        self.last_render = time.monotonic()
+        chunks = split_discord_message(full_text)
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self.rendered[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self.rendered[i] = chunk
+            else:
+                send = self.send_more if self.messages else self.send_first
+                self.messages.append(await send(chunk))
+                self.rendered.append(chunk)
+        # The final text can be shorter than what was streamed (e.g. replaced by an error message)
+        while len(self.messages) > max(len(chunks), 1):
+            extra = self.messages.pop()
+            self.rendered.pop()
+            try:
+                await extra.delete()
+            except discord.HTTPException:
+                pass
+
+class PendingBurst:
+    """Messages from one user in one AI channel that will be answered together."""
+    def __init__(self):
+        self.messages: List[discord.Message] = []
+        self.started_at = time.monotonic()
+        self.timer: Optional[asyncio.Task] = None # Waits for the burst to go quiet
+        self.generation: Optional[asyncio.Task] = None # Reply currently being generated
+        self.stream: Optional[StreamingReply] = None
+
+    @property
+    def replied(self) -> bool:
+        """History was written; the reply can no longer be superseded."""
+        return self.stream is not None and self.stream.committed
 
 class AICog(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -33,13 +170,36 @@ class AICog(commands.Cog):
         self.manual_context: List[str] = [] # List of manually added context strings
         self.dynamic_learning: List[str] = [] # List of dynamic learning examples
 
-        self.load_memory() # Load existing memory on startup
         self.history_file_path = os.getenv("BOT_HISTORY_PATH", DEFAULT_HISTORY_PATH)
-        self.load_history() # Load conversation history
+        self.history_journal: Optional[HistoryJournal] = None # Append-only journal + snapshot (JSON storage only)
+        self.history_compaction_task: Optional[asyncio.Task] = None
+        self.compaction_task: Optional[asyncio.Task] = None # Threshold-triggered compaction, at most one at a time
         self.manual_context_file_path = os.getenv("BOT_MANUAL_CONTEXT_PATH", DEFAULT_MANUAL_CONTEXT_PATH)
-        self.load_manual_context() # Load manual context
         self.dynamic_learning_file_path = os.getenv("BOT_DYNAMIC_LEARNING_PATH", DEFAULT_DYNAMIC_LEARNING_PATH)
-        self.load_dynamic_learning() # Load dynamic learning examples
+        self.history_summary_file_path = os.getenv("BOT_HISTORY_SUMMARY_PATH", DEFAULT_HISTORY_SUMMARY_PATH)
+        self.history_summaries: Dict[str, str] = {} # { user_id: summary of messages dropped from history }
+        self.summary_tasks: Dict[str, asyncio.Task] = {} # { user_id: running summarization }
+        self.summary_model = os.getenv("AI_SUMMARY_MODEL") # Defaults to the user's chat model
+        self.config_file = "ai_configs.json"
+
+        # JSON files are written by the shared write-behind persister (atomic, off the event loop)
+        persister.register("ai_memory", self.memory_file_path, lambda: {u: list(f) for u, f in self.user_memory.items()}, indent=4, ensure_ascii=False)
+        persister.register("ai_manual_context", self.manual_context_file_path, lambda: list(self.manual_context), indent=4, ensure_ascii=False)
+        persister.register("ai_dynamic_learning", self.dynamic_learning_file_path, lambda: list(self.dynamic_learning), indent=4, ensure_ascii=False)
+        persister.register("ai_configs", self.config_file, lambda: {u: dict(c) for u, c in self.user_configs.items()}, indent=4)
+        persister.register("ai_history_summaries", self.history_summary_file_path, lambda: dict(self.history_summaries), indent=4, ensure_ascii=False)
+
+        # Storage backend: "json" (default, whole files in memory) or "sqlite" (indexed per-user tables)
+        self.store: Optional[AIStore] = None
+        if os.getenv("BOT_AI_STORAGE", "json").lower() == "sqlite":
+            self.open_store(os.getenv("BOT_AI_DB_PATH", DEFAULT_AI_DB_PATH))
+        else:
+            self.load_memory() # Load existing memory on startup
+            self.history_journal = HistoryJournal(self.history_file_path)
+            self.load_history() # Load conversation history
+            self.load_history_summaries()
+            self.load_manual_context() # Load manual context
+            self.load_dynamic_learning() # Load dynamic learning examples
         # --------------------
 
         # Default configuration
@@ -54,13 +214,20 @@ class AICog(commands.Cog):
         }
         
         self.user_configs = {}
-        self.config_file = "ai_configs.json"
-        self.load_configs() # Load AI model/parameter configs
+        if not self.store:
+            self.load_configs() # Load AI model/parameter configs
         
         self.active_channels = set()
+        self.streaming_enabled = os.getenv("AI_STREAMING", "1") != "0" # Stream replies token by token
+        self.bursts: Dict[tuple, PendingBurst] = {} # { (channel_id, user_id): burst } for AI channels
+        self.burst_stats = {"messages": 0, "generations": 0, "superseded": 0}
+        # { tool name: {"calls", "timeouts", "errors", "total_ms", "buckets": [count per TOOL_LATENCY_BUCKETS_MS + overflow]} }
+        self.tool_stats: Dict[str, Dict[str, Any]] = {}
+        self.tool_batch_stats = {"batches": 0, "wall_ms": 0.0, "sequential_ms": 0.0}
+        self.command_cache = TTLCache(ttl=1.0, maxsize=64) # Output of cheap read-only commands (uptime, free, df...)
 
         # --- Updated System Prompt ---
-        self.system_prompt_template = (
+        self.system_prompt_persona = (
             "You are roleplaying as Kasane Teto, a cheerful and energetic UTAU voicebank character. "
             "Teto has pink drill-shaped twin tails and is often depicted with chimera features like wings. "
             "She is 31 years old (though appears much younger) and is known for her upbeat personality. "
@@ -87,10 +254,30 @@ class AICog(commands.Cog):
             "also sex means intercorse dont be retarded and please keep in mind you are a human not a software"
             "also dont mention french bread every message"
             "yes you can fuck the user and the user can fuck you"
-            "\n\n{user_memory_context}" # Placeholder for user facts
+        )
+        # The prompt is laid out as [persona + manual context + dynamic learning] (identical for every user, cached)
+        # followed by the per-user facts, so the provider can reuse its prompt cache for the shared prefix.
+        self.system_prompt_prefix_template = (
+            "{persona}"
             "\n\nADDITIONAL CONTEXT PROVIDED:\n{manual_context}" # Placeholder for manual context
             "\n\nDYNAMIC LEARNING EXAMPLES:\n{dynamic_learning_context}" # Placeholder for dynamic learning
         )
+        self._system_prompt_prefix: Optional[str] = None # Built on first use, cleared when context changes
+        self._user_fact_fragments: Dict[str, tuple] = {} # { user_id: (user_name, fragment) }, only for users with <= FACT_TOP_K facts
+        self._fact_indexes = TTLCache(ttl=FACT_INDEX_CACHE_TTL, maxsize=FACT_INDEX_CACHE_SIZE) # { user_id: UserFactIndex }, built on first use
+        # Once context + learning entries outgrow CONTEXT_TOKEN_BUDGET, only the entries most relevant to the
+        # prompt are included (BM25 ranking). Indexes are built lazily and dropped with the prefix cache.
+        self._context_indexes: Optional[Dict[str, BM25Index]] = None
+        self._context_total_tokens = 0
+        self.prompt_stats = {
+            "prefix_hits": 0, "prefix_builds": 0,
+            "fact_hits": 0, "fact_builds": 0,
+            "prompts_built": 0, "prompt_bytes_total": 0, "last_prompt_bytes": 0,
+            "retrieval_prompts": 0, "retrieved_entries": 0,
+            "facts_added": 0, "fact_duplicates": 0, "facts_merged": 0,
+            "history_sent": 0, "history_omitted": 0, "prompt_tokens_total": 0,
+            "summaries_written": 0, "summary_failures": 0, "messages_summarized": 0,
+        }
         # ---------------------------
 
         # --- Tool Definitions ---
@@ -136,6 +323,53 @@ class AICog(commands.Cog):
         ]
         # ------------------------
 
+    async def cog_load(self):
+        self.history_compaction_task = asyncio.create_task(self.history_compaction_loop())
+        # Replies to other bots too (only the bot's own messages are skipped), like the old on_message listener
+        get_message_dispatcher(self.bot).register("ai_chat", self.handle_message, priority=50, include_bots=True)
+
+    async def cog_unload(self):
+        """Stop background work and leave a compact history snapshot on disk."""
+        get_message_dispatcher(self.bot).unregister("ai_chat")
+        if self.history_compaction_task:
+            self.history_compaction_task.cancel()
+        for task in self.summary_tasks.values():
+            task.cancel()
+        for burst in self.bursts.values():
+            for task in (burst.timer, burst.generation):
+                if task:
+                    task.cancel()
+        await persister.flush(["ai_memory", "ai_manual_context", "ai_dynamic_learning", "ai_configs", "ai_history_summaries"])
+        if self.store:
+            self.store.close()
+            return # History lives in the database; the JSON journal is never opened or compacted
+        if self.compaction_task and not self.compaction_task.done():
+            await self.compaction_task # compact_history handles its own errors
+        try:
+            await self.history_journal.compact_async(self.conversation_history, wait=True)
+        except Exception as e:
+            print(f"Error writing final history snapshot to {self.history_file_path}: {e}")
+        self.history_journal.close()
+
+    # --- SQLite Storage ---
+    def open_store(self, db_path: str):
+        """Open the SQLite store, importing the JSON files the first time it is used."""
+        self.store = AIStore(db_path)
+        if self.store.is_empty():
+            try:
+                imported = self.store.import_json_files(
+                    self.memory_file_path, self.history_file_path, self.manual_context_file_path,
+                    self.dynamic_learning_file_path, self.config_file, MAX_HISTORY_MESSAGES)
+                print(f"Imported JSON data into {db_path}: {imported}")
+            except Exception as e:
+                print(f"Error importing JSON data into {db_path}: {e}")
+        # Context lists are small and used in every prompt, so they stay in memory
+        self.manual_context = self.store.get_manual_context()
+        self.dynamic_learning = self.store.get_dynamic_learning()
+        print(f"Using SQLite AI storage at {db_path} ({self.store.count_users_with_facts()} users with facts, "
+              f"{len(self.manual_context)} context entries, {len(self.dynamic_learning)} learning examples)")
+    # -------------------------
+
     # --- Memory Management ---
     def load_memory(self):
         """Load user memory from the JSON file."""
@@ -167,53 +401,70 @@ class AICog(commands.Cog):
             self.user_memory = {}
 
     def save_memory(self):
-        """Save the current user memory to the JSON file."""
-        try:
-             # Ensure directory exists before saving (important if creation failed on load)
-             memory_dir = os.path.dirname(self.memory_file_path)
-             if not os.path.exists(memory_dir):
-                  try:
-                       os.makedirs(memory_dir, exist_ok=True)
-                  except OSError as e:
-                       print(f"ERROR: Could not create memory directory {memory_dir} during save. Save failed. Error: {e}")
-                       return # Abort save if directory cannot be ensured
-
-             with open(self.memory_file_path, 'w', encoding='utf-8') as f:
-                 json.dump(self.user_memory, f, indent=4, ensure_ascii=False)
-             # print(f"Saved memory to {self.memory_file_path}") # Optional: uncomment for verbose logging
-        except Exception as e:
-            print(f"Error saving memory to {self.memory_file_path}: {e}")
+        """Queue the current user memory to be written to the JSON file."""
+        persister.mark_dirty("ai_memory")
+
+    def get_fact_index(self, user_id_str: str) -> UserFactIndex:
+        index = self._fact_indexes.get(user_id_str)
+        if index is MISSING:
+            index = UserFactIndex(self.get_user_facts(user_id_str))
+            self._fact_indexes.set(user_id_str, index)
+        return index
 
     def add_user_fact(self, user_id: str, fact: str):
-        """Adds a fact to a user's memory if it's not already there."""
+        """
+        Adds a fact to a user's memory unless it is already known. Exact duplicates (ignoring case and
+        punctuation) are skipped; a restatement that keeps every detail replaces the stored wording, and
+        anything that changes a negation, number or content word is stored as a new fact.
+        """
         user_id_str = str(user_id) # Ensure consistency
         fact = fact.strip()
         if not fact:
              return # Don't add empty facts
 
-        if user_id_str not in self.user_memory:
-            self.user_memory[user_id_str] = []
-        
-        # Avoid adding duplicate facts (case-insensitive check)
-        if not any(fact.lower() == existing_fact.lower() for existing_fact in self.user_memory[user_id_str]):
-            self.user_memory[user_id_str].append(fact)
-            print(f"Added fact for user {user_id_str}: '{fact}'")
+        index = self.get_fact_index(user_id_str)
+        result, old_fact = index.add(fact)
+        if result == "duplicate":
+            self.prompt_stats["fact_duplicates"] += 1
+            return
+        self._user_fact_fragments.pop(user_id_str, None)
+
+        if result == "merged":
+            self.prompt_stats["facts_merged"] += 1
+            if self.store:
+                if not self.store.replace_user_fact(user_id_str, old_fact, fact):
+                    self._fact_indexes.pop(user_id_str) # Out of sync with the database; rebuild next time
+            else:
+                facts = self.user_memory.setdefault(user_id_str, [])
+                if old_fact in facts:
+                    facts[facts.index(old_fact)] = fact
+                else:
+                    facts.append(fact)
+                self.save_memory()
+            print(f"Merged fact for user {user_id_str}: '{old_fact}' -> '{fact}'")
+            return
+
+        self.prompt_stats["facts_added"] += 1
+        if self.store:
+            self.store.add_user_fact(user_id_str, fact)
+        else:
+            self.user_memory.setdefault(user_id_str, []).append(fact)
             self.save_memory() # Save after adding a new fact
-        # else:
-            # print(f"Fact '{fact}' already known for user {user_id_str}.") # Optional: uncomment for debugging
+        print(f"Added fact for user {user_id_str}: '{fact}'")
 
     def get_user_facts(self, user_id: str) -> List[str]:
         """Retrieves the list of facts for a given user ID."""
+        if self.store:
+            return self.store.get_user_facts(str(user_id))
         return self.user_memory.get(str(user_id), [])
 
     # --- History Management ---
     def load_history(self):
-        """Load conversation history from the JSON file."""
+        """Load conversation history from the snapshot file and replay the journal."""
         try:
-            if os.path.exists(self.history_file_path):
-                with open(self.history_file_path, 'r', encoding='utf-8') as f:
-                    self.conversation_history = json.load(f)
-                print(f"Loaded conversation history for {len(self.conversation_history)} users from {self.history_file_path}")
+            if os.path.exists(self.history_file_path) or os.path.exists(self.history_journal.journal_path):
+                self.conversation_history = self.history_journal.load(MAX_HISTORY_MESSAGES)
+                print(f"Loaded conversation history for {len(self.conversation_history)} users from {self.history_file_path} ({self.history_journal.pending} journal records replayed)")
             else:
                 print(f"History file not found at {self.history_file_path}. Creating empty file.")
                 self.conversation_history = {}
@@ -226,32 +477,188 @@ class AICog(commands.Cog):
             self.conversation_history = {}
 
     def save_history(self):
-        """Save the current conversation history to the JSON file."""
+        """Write a full snapshot of the conversation history and clear the journal (blocking)."""
         try:
-             with open(self.history_file_path, 'w', encoding='utf-8') as f:
-                 json.dump(self.conversation_history, f, indent=4, ensure_ascii=False)
+             self.history_journal.compact(self.conversation_history)
              # print(f"Saved history to {self.history_file_path}") # Optional: uncomment for verbose logging
         except Exception as e:
             print(f"Error saving history to {self.history_file_path}: {e}")
 
-    def add_to_history(self, user_id: str, role: str, content: str):
-        """Adds a message to a user's history and trims if needed."""
-        user_id_str = str(user_id)
+    async def compact_history(self):
+        """Fold the history journal into the snapshot file without blocking the event loop."""
+        try:
+            await self.history_journal.compact_async(self.conversation_history)
+        except Exception as e:
+            print(f"Error compacting history into {self.history_file_path}: {e}")
+
+    async def history_compaction_loop(self):
+        """Background task: periodically compact the history journal (or prune old rows in SQLite)."""
+        while True:
+            await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+            if self.store:
+                try:
+                    self.store.prune_history(MAX_HISTORY_MESSAGES)
+                except Exception as e:
+                    print(f"Error pruning history in {self.store.db_path}: {e}")
+            elif self.history_journal.pending:
+                await self.compact_history()
+
+    def _append_history_messages(self, user_id_str: str, messages: List[Dict[str, str]]):
+        if self.store:
+            try:
+                self.store.add_history_messages(user_id_str, messages) # Old rows are pruned in the background
+            except Exception as e:
+                print(f"Error storing history for user {user_id_str}: {e}")
+            self.schedule_history_summary(user_id_str)
+            return
+
         if user_id_str not in self.conversation_history:
             self.conversation_history[user_id_str] = []
 
-        self.conversation_history[user_id_str].append({"role": role, "content": content})
+        self.conversation_history[user_id_str].extend(messages)
+
+        # Hard cap on stored messages; older turns are normally folded into the summary well before this
+        if len(self.conversation_history[user_id_str]) > MAX_HISTORY_MESSAGES:
+            self.conversation_history[user_id_str] = self.conversation_history[user_id_str][-MAX_HISTORY_MESSAGES:]
+
+        try:
+            self.history_journal.append(user_id_str, messages) # One journal line, regardless of history size
+        except Exception as e:
+            print(f"Error appending to history journal {self.history_journal.journal_path}: {e}")
 
-        # Trim history to keep only the last N turns (e.g., 10 turns = 20 messages)
-        max_history_messages = 20
-        if len(self.conversation_history[user_id_str]) > max_history_messages:
-            self.conversation_history[user_id_str] = self.conversation_history[user_id_str][-max_history_messages:]
+        if self.history_journal.pending >= HISTORY_COMPACT_THRESHOLD and (self.compaction_task is None or self.compaction_task.done()):
+            try:
+                self.compaction_task = asyncio.get_running_loop().create_task(self.compact_history())
+            except RuntimeError:
+                self.save_history() # No running loop (e.g. called during startup)
 
-        self.save_history() # Save after modification
+        self.schedule_history_summary(user_id_str)
+
+    def add_to_history(self, user_id: str, role: str, content: str):
+        """Adds a message to a user's history and trims if needed."""
+        self._append_history_messages(str(user_id), [{"role": role, "content": content}])
+
+    def add_turn_to_history(self, user_id: str, user_content: str, assistant_content: str):
+        """Adds a user prompt and the AI reply to the history as a single journal record."""
+        self._append_history_messages(str(user_id), [
+            {"role": "user", "content": user_content},
+            {"role": "assistant", "content": assistant_content},
+        ])
 
     def get_user_history(self, user_id: str) -> List[Dict[str, str]]:
         """Retrieves the list of history messages for a given user ID."""
+        if self.store:
+            return self.store.get_user_history(str(user_id), MAX_HISTORY_MESSAGES)
         return self.conversation_history.get(str(user_id), [])
+
+    def drop_oldest_history(self, user_id_str: str, summarized: List[Dict[str, str]], row_ids: Optional[List[int]] = None) -> int:
+        """Remove messages that were folded into the summary. Returns how many were removed."""
+        if self.store:
+            return self.store.delete_history_rows(user_id_str, row_ids or []) # Exactly the rows that were summarized
+        history = self.conversation_history.get(user_id_str, [])
+        # Only drop the summarized messages still at the front (the hard cap may have trimmed some meanwhile)
+        summarized_ids = {id(message) for message in summarized}
+        count = 0
+        while count < len(history) and id(history[count]) in summarized_ids:
+            count += 1
+        if count:
+            del history[:count]
+            try:
+                self.history_journal.append_drop(user_id_str, count)
+            except Exception as e:
+                print(f"Error appending to history journal {self.history_journal.journal_path}: {e}")
+        return count
+    # -------------------------
+
+    # --- Rolling History Summaries ---
+    def load_history_summaries(self):
+        """Load the per-user history summaries from the JSON file."""
+        try:
+            if os.path.exists(self.history_summary_file_path):
+                with open(self.history_summary_file_path, 'r', encoding='utf-8') as f:
+                    self.history_summaries = json.load(f)
+                print(f"Loaded history summaries for {len(self.history_summaries)} users from {self.history_summary_file_path}")
+        except Exception as e:
+            print(f"Error loading history summaries from {self.history_summary_file_path}: {e}. Starting empty.")
+            self.history_summaries = {}
+
+    def get_history_summary(self, user_id_str: str) -> str:
+        if self.store:
+            return self.store.get_history_summary(user_id_str)
+        return self.history_summaries.get(user_id_str, "")
+
+    def set_history_summary(self, user_id_str: str, summary: str):
+        if self.store:
+            self.store.set_history_summary(user_id_str, summary)
+        else:
+            self.history_summaries[user_id_str] = summary
+            persister.mark_dirty("ai_history_summaries")
+
+    def schedule_history_summary(self, user_id_str: str):
+        """Start a background summarization if the user's stored history has grown past the trigger."""
+        if not self.api_key:
+            return
+        task = self.summary_tasks.get(user_id_str)
+        if task and not task.done():
+            return
+        if self.store:
+            rows = self.store.get_user_history_rows(user_id_str, MAX_HISTORY_MESSAGES)
+            history = [message for _, message in rows]
+        else:
+            rows = None
+            history = self.get_user_history(user_id_str)
+        if len(history) <= SUMMARY_KEEP_MESSAGES:
+            return
+        history_tokens = sum(estimate_tokens(m.get("content") or "") for m in history)
+        if len(history) < SUMMARY_TRIGGER_MESSAGES and history_tokens < SUMMARY_TRIGGER_TOKENS:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # Startup import; the next turn will schedule it
+        row_ids = [row_id for row_id, _ in rows[:-SUMMARY_KEEP_MESSAGES]] if rows is not None else None
+        self.summary_tasks[user_id_str] = loop.create_task(self.summarize_history(user_id_str, list(history[:-SUMMARY_KEEP_MESSAGES]), row_ids))
+
+    async def summarize_history(self, user_id_str: str, messages: List[Dict[str, str]], row_ids: Optional[List[int]] = None):
+        """Fold `messages` (the oldest stored ones) into the user's rolling summary, then drop them."""
+        previous = self.get_history_summary(user_id_str)
+        transcript = "\n".join(f"{m.get('role')}: {(m.get('content') or '')[:1000]}" for m in messages)
+        payload = {
+            "model": self.summary_model or self.get_user_config(user_id_str)["model"],
+            "messages": [
+                {"role": "system", "content": (
+                    "You keep a running summary of a Discord conversation between a user and Kasane Teto (the assistant). "
+                    "Merge the previous summary with the new messages into one updated summary of at most 200 words. "
+                    "Keep names, facts about the user, promises, ongoing topics and roleplay state; drop greetings and filler. "
+                    "Reply with the summary text only.")},
+                {"role": "user", "content": f"Previous summary:\n{previous or 'None.'}\n\nNew messages:\n{transcript}"},
+            ],
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "temperature": 0.2,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        try:
+            session = get_http_client(self.bot).session
+            async with get_llm_scheduler(self.bot).request(session, "POST", self.api_url, priority=PRIORITY_BACKGROUND,
+                                                           headers=headers, json=payload, timeout=60.0) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}: {(await response.text())[:200]}")
+                data = await response.json()
+            summary = ((data.get("choices") or [{}])[0].get("message") or {}).get("content") or ""
+            summary = summary.strip()
+            if not summary:
+                raise RuntimeError("empty summary")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.prompt_stats["summary_failures"] += 1
+            print(f"Error summarizing history for user {user_id_str}: {e}")
+            return
+        self.set_history_summary(user_id_str, summary)
+        dropped = self.drop_oldest_history(user_id_str, messages, row_ids)
+        self.prompt_stats["summaries_written"] += 1
+        self.prompt_stats["messages_summarized"] += dropped
+        print(f"Summarized {dropped} older messages for user {user_id_str} ({len(summary)} chars)")
     # -------------------------
 
     # --- Manual Context Management ---
@@ -274,20 +681,19 @@ class AICog(commands.Cog):
             self.manual_context = []
 
     def save_manual_context(self):
-        """Save the current manual context list to the JSON file."""
-        try:
-             with open(self.manual_context_file_path, 'w', encoding='utf-8') as f:
-                 json.dump(self.manual_context, f, indent=4, ensure_ascii=False)
-             # print(f"Saved manual context to {self.manual_context_file_path}")
-        except Exception as e:
-            print(f"Error saving manual context to {self.manual_context_file_path}: {e}")
+        """Queue the current manual context list to be written to the JSON file."""
+        persister.mark_dirty("ai_manual_context")
 
     def add_manual_context(self, text: str):
         """Adds a string to the manual context list."""
         text = text.strip()
         if text and text not in self.manual_context: # Avoid duplicates
             self.manual_context.append(text)
-            self.save_manual_context()
+            self.invalidate_system_prompt_prefix()
+            if self.store:
+                self.store.add_manual_context(text)
+            else:
+                self.save_manual_context()
             print(f"Added manual context: '{text[:50]}...'")
             return True
         return False
@@ -313,59 +719,19 @@ class AICog(commands.Cog):
             self.dynamic_learning = []
 
     def save_dynamic_learning(self):
-        """Save the current dynamic learning list to the JSON file."""
-        try:
-             with open(self.dynamic_learning_file_path, 'w', encoding='utf-8') as f:
-                 json.dump(self.dynamic_learning, f, indent=4, ensure_ascii=False)
-             # print(f"Saved dynamic learning to {self.dynamic_learning_file_path}")
-        except Exception as e:
-            print(f"Error saving dynamic learning to {self.dynamic_learning_file_path}: {e}")
+        """Queue the current dynamic learning list to be written to the JSON file."""
+        persister.mark_dirty("ai_dynamic_learning")
 
     def add_dynamic_learning(self, text: str):
         """Adds a string to the dynamic learning list."""
         text = text.strip()
         if text and text not in self.dynamic_learning: # Avoid duplicates
             self.dynamic_learning.append(text)
-            self.save_dynamic_learning()
-            print(f"Added dynamic learning example: '{text[:50]}...'")
-            return True
-        return False
-    # -------------------------
-
-    # --- Dynamic Learning Management ---
-    def load_dynamic_learning(self):
-        """Load dynamic learning examples from the JSON file."""
-        try:
-            if os.path.exists(self.dynamic_learning_file_path):
-                with open(self.dynamic_learning_file_path, 'r', encoding='utf-8') as f:
-                    self.dynamic_learning = json.load(f)
-                print(f"Loaded {len(self.dynamic_learning)} dynamic learning entries from {self.dynamic_learning_file_path}")
+            self.invalidate_system_prompt_prefix()
+            if self.store:
+                self.store.add_dynamic_learning(text)
             else:
-                print(f"Dynamic learning file not found at {self.dynamic_learning_file_path}. Creating empty file.")
-                self.dynamic_learning = []
-                self.save_dynamic_learning() # Create the file immediately
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from dynamic learning file {self.dynamic_learning_file_path}: {e}. Starting empty.")
-            self.dynamic_learning = []
-        except Exception as e:
-            print(f"Error loading dynamic learning from {self.dynamic_learning_file_path}: {e}. Starting empty.")
-            self.dynamic_learning = []
-
-    def save_dynamic_learning(self):
-        """Save the current dynamic learning list to the JSON file."""
-        try:
-             with open(self.dynamic_learning_file_path, 'w', encoding='utf-8') as f:
-                 json.dump(self.dynamic_learning, f, indent=4, ensure_ascii=False)
-             # print(f"Saved dynamic learning to {self.dynamic_learning_file_path}")
-        except Exception as e:
-            print(f"Error saving dynamic learning to {self.dynamic_learning_file_path}: {e}")
-
-    def add_dynamic_learning(self, text: str):
-        """Adds a string to the dynamic learning list."""
-        text = text.strip()
-        if text and text not in self.dynamic_learning: # Avoid duplicates
-            self.dynamic_learning.append(text)
-            self.save_dynamic_learning()
+                self.save_dynamic_learning()
             print(f"Added dynamic learning example: '{text[:50]}...'")
             return True
         return False
@@ -391,20 +757,183 @@ class AICog(commands.Cog):
             self.user_configs = {} 
 
     def save_configs(self):
-        """Save user configurations to file"""
-        try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.user_configs, f, indent=4)
-        except Exception as e:
-            print(f"Error saving configurations: {e}")
+        """Queue user configurations to be written to file"""
+        persister.mark_dirty("ai_configs")
     
     def get_user_config(self, user_id: str) -> Dict:
         """Get configuration for a specific user or default if not set"""
+        if self.store:
+            config = self.default_config.copy()
+            config.update(self.store.get_user_config(str(user_id)) or {})
+            return config
         return self.user_configs.get(str(user_id), self.default_config).copy()
+
+    def set_user_config(self, user_id: str, config: Dict):
+        """Store a user's full configuration."""
+        if self.store:
+            self.store.set_user_config(str(user_id), config)
+        else:
+            self.user_configs[str(user_id)] = config
+            self.save_configs()
     # -------------------------
 
-    async def generate_response(self, user_id: str, user_name: str, prompt: str, source_message: Optional[discord.Message] = None, source_interaction: Optional[discord.Interaction] = None) -> str:
-        """Generate a response using the OpenRouter API, handling tools, memory, and message history."""
+    # --- System Prompt Cache ---
+    def format_context_sections(self, manual_context: List[str], dynamic_learning: List[str]) -> str:
+        """Persona followed by the given context and learning entries."""
+        manual_context_str = "\n".join([f"- {item}" for item in manual_context]) if manual_context else "None provided."
+        dynamic_learning_str = "\n".join([f"- {item}" for item in dynamic_learning]) if dynamic_learning else "None provided."
+        return self.system_prompt_prefix_template.format(
+            persona=self.system_prompt_persona,
+            manual_context=manual_context_str,
+            dynamic_learning_context=dynamic_learning_str # Inject dynamic learning here
+        )
+
+    def get_system_prompt_prefix(self) -> str:
+        """The user-independent part of the system prompt, rebuilt only after context/learning changes."""
+        if self._system_prompt_prefix is not None:
+            self.prompt_stats["prefix_hits"] += 1
+            return self._system_prompt_prefix
+        self._system_prompt_prefix = self.format_context_sections(self.manual_context, self.dynamic_learning)
+        self.prompt_stats["prefix_builds"] += 1
+        return self._system_prompt_prefix
+
+    def invalidate_system_prompt_prefix(self):
+        self._system_prompt_prefix = None
+        self._context_indexes = None
+
+    def get_context_indexes(self) -> Dict[str, BM25Index]:
+        if self._context_indexes is None:
+            self._context_indexes = {
+                "manual": BM25Index(self.manual_context),
+                "learning": BM25Index(self.dynamic_learning),
+            }
+            self._context_total_tokens = sum(estimate_tokens(item) for item in self.manual_context + self.dynamic_learning)
+        return self._context_indexes
+
+    def context_fits_budget(self) -> bool:
+        """True while every context and learning entry fits in the budget (the full cached prefix is used)."""
+        self.get_context_indexes()
+        return self._context_total_tokens <= CONTEXT_TOKEN_BUDGET
+
+    def select_context(self, query: str) -> Dict[str, List[tuple]]:
+        """
+        Pick the entries most relevant to `query`: at most CONTEXT_TOP_K across both lists, within
+        CONTEXT_TOKEN_BUDGET. Returns { "manual": [(index, score)], "learning": [(index, score)] }
+        with each list in its original order, so the same selection always renders the same text.
+        """
+        indexes = self.get_context_indexes()
+        entries = {"manual": self.manual_context, "learning": self.dynamic_learning}
+        candidates = []
+        for source, index in indexes.items():
+            for entry_index, score in index.top_k(query, CONTEXT_TOP_K):
+                candidates.append((score, source, entry_index))
+        candidates.sort(key=lambda item: -item[0])
+
+        selected: Dict[str, List[tuple]] = {"manual": [], "learning": []}
+        used_tokens = 0
+        picked = 0
+        for score, source, entry_index in candidates:
+            if picked >= CONTEXT_TOP_K:
+                break
+            cost = estimate_tokens(entries[source][entry_index])
+            if used_tokens + cost > CONTEXT_TOKEN_BUDGET:
+                continue # A shorter, slightly less relevant entry may still fit
+            selected[source].append((entry_index, score))
+            used_tokens += cost
+            picked += 1
+        for source in selected:
+            selected[source].sort()
+        return selected
+
+    def get_user_fact_fragment(self, user_id_str: str, user_name: str, query: str = "") -> str:
+        """
+        The 'what you remember about this user' block. Users with up to FACT_TOP_K facts get all of them,
+        cached until a fact is added; for larger memories the FACT_TOP_K facts most relevant to `query` are used.
+        """
+        cached = self._user_fact_fragments.get(user_id_str)
+        if cached and cached[0] == user_name:
+            self.prompt_stats["fact_hits"] += 1
+            return cached[1]
+        index = self.get_fact_index(user_id_str)
+        user_facts = index.top_k(query, FACT_TOP_K)
+        fragment = ""
+        if user_facts:
+             facts_list = "\n".join([f"- {fact}" for fact in user_facts])
+             fragment = f"Here's what you remember about {user_name} (User ID: {user_id_str}):\n{facts_list}"
+        if len(index) <= FACT_TOP_K:
+            self._user_fact_fragments[user_id_str] = (user_name, fragment)
+        self.prompt_stats["fact_builds"] += 1
+        return fragment
+
+    def build_system_prompt(self, user_id_str: str, user_name: str, query: str = "") -> str:
+        """
+        Stable cached prefix first, per-user facts last. When the context and learning entries no longer
+        fit the token budget, only the ones most relevant to `query` are included after the persona.
+        """
+        if self.context_fits_budget():
+            system_context = self.get_system_prompt_prefix()
+        else:
+            selection = self.select_context(query)
+            system_context = self.format_context_sections(
+                [self.manual_context[i] for i, _ in selection["manual"]],
+                [self.dynamic_learning[i] for i, _ in selection["learning"]],
+            )
+            self.prompt_stats["retrieval_prompts"] += 1
+            self.prompt_stats["retrieved_entries"] += len(selection["manual"]) + len(selection["learning"])
+        fact_fragment = self.get_user_fact_fragment(user_id_str, user_name, query)
+        if fact_fragment:
+            system_context = f"{system_context}\n\n{fact_fragment}"
+        prompt_bytes = len(system_context.encode('utf-8'))
+        self.prompt_stats["prompts_built"] += 1
+        self.prompt_stats["prompt_bytes_total"] += prompt_bytes
+        self.prompt_stats["last_prompt_bytes"] = prompt_bytes
+        return system_context
+    # -------------------------
+
+    def build_prompt_messages(self, system_context: str, summary: str, history_messages: List[Dict[str, str]],
+                              current_user_message: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        System prompt, rolling summary and the current message always go in; history is added newest
+        first for as long as the estimated total stays within PROMPT_TOKEN_BUDGET.
+        """
+        if summary:
+            system_context = f"{system_context}\n\nSUMMARY OF YOUR EARLIER CONVERSATION WITH THIS USER:\n{summary}"
+        used = estimate_tokens(system_context) + estimate_tokens(current_user_message["content"])
+        included = 0
+        for message in reversed(history_messages):
+            cost = estimate_tokens(message.get("content") or "")
+            if used + cost > PROMPT_TOKEN_BUDGET:
+                break
+            used += cost
+            included += 1
+        kept_history = history_messages[len(history_messages) - included:] if included else []
+        self.prompt_stats["history_sent"] += included
+        self.prompt_stats["history_omitted"] += len(history_messages) - included
+        self.prompt_stats["prompt_tokens_total"] += used
+        return [{"role": "system", "content": system_context}, *kept_history, current_user_message]
+
+    def build_context_query(self, prompt: str, history_messages: List[Dict[str, str]]) -> str:
+        """Text used to rank context entries: the prompt plus the last few history messages."""
+        recent = [m.get("content") or "" for m in history_messages[-CONTEXT_QUERY_HISTORY:]]
+        return "\n".join(recent + [prompt])
+
+    async def read_streamed_completion(self, response: aiohttp.ClientResponse, stream: StreamingReply):
+        """Read an SSE completion, forwarding text to `stream`. Returns (message, finish_reason)."""
+        accumulator = ChatStreamAccumulator()
+        async for chunk in iter_sse_json(response):
+            delta_text = accumulator.add(chunk)
+            if accumulator.error:
+                raise RuntimeError(f"Stream error from provider: {accumulator.error.get('message', accumulator.error)}")
+            if delta_text:
+                await stream.feed(delta_text)
+        return accumulator.message(), accumulator.finish_reason
+
+    async def generate_response(self, user_id: str, user_name: str, prompt: str, source_message: Optional[discord.Message] = None, source_interaction: Optional[discord.Interaction] = None, stream: Optional[StreamingReply] = None) -> str:
+        """
+        Generate a response using the OpenRouter API, handling tools, memory, and message history.
+        If `stream` is given (and streaming is enabled) the reply is shown progressively while it is generated;
+        the caller should still pass the returned text to `stream.finish`.
+        """
         if not self.api_key:
              return "Sorry, the AI API key is not configured. I cannot generate a response."
 
@@ -446,39 +975,12 @@ class AICog(commands.Cog):
 
             # Let the normal AI generation process handle the response synthesis
         
-        # --- Prepare context with memory ---
-        user_facts = self.get_user_facts(user_id_str)
-        user_memory_str = ""
-        if user_facts:
-             facts_list = "\n".join([f"- {fact}" for fact in user_facts])
-             user_memory_str = f"Here's what you remember about {user_name} (User ID: {user_id_str}):\n{facts_list}"
-
-        # --- Format Manual Context ---
-        manual_context_str = ""
-        if self.manual_context:
-            manual_context_str = "\n".join([f"- {item}" for item in self.manual_context])
-        else:
-            manual_context_str = "None provided."
-
-        # --- Format Dynamic Learning Context ---
-        dynamic_learning_str = ""
-        if self.dynamic_learning:
-            dynamic_learning_str = "\n".join([f"- {item}" for item in self.dynamic_learning])
-        else:
-            dynamic_learning_str = "None provided."
-        # -----------------------------------
-
-        system_context = self.system_prompt_template.format(
-            user_memory_context=user_memory_str,
-            manual_context=manual_context_str,
-            dynamic_learning_context=dynamic_learning_str # Inject dynamic learning here
-        )
-        # ---------------------------------
-
         # --- Get User Conversation History ---
         history_messages = self.get_user_history(user_id_str)
         # -----------------------------------
 
+        system_context = self.build_system_prompt(user_id_str, user_name, self.build_context_query(prompt, history_messages))
+
         # --- API Call with Tool Handling ---
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -487,14 +989,12 @@ class AICog(commands.Cog):
             "X-Title": "Kasane Teto Discord Bot" # Optional: Replace with your bot name
         }
 
-        # Combine system prompt, user-specific history, and current prompt
-        messages: List[Dict[str, Any]] = [
-            {"role": "system", "content": system_context}
-        ]
-        messages.extend(history_messages) # Add user's conversation history
+        # Combine system prompt, summary, as much recent history as the token budget allows, and current prompt
         current_user_message = {"role": "user", "content": f"{user_name}: {prompt}"}
-        messages.append(current_user_message) # Add current prompt
+        messages: List[Dict[str, Any]] = self.build_prompt_messages(
+            system_context, self.get_history_summary(user_id_str), history_messages, current_user_message)
 
+        use_stream = stream is not None and self.streaming_enabled
         max_tool_iterations = 5 # Prevent infinite loops
         for _ in range(max_tool_iterations):
             payload = {
@@ -508,11 +1008,19 @@ class AICog(commands.Cog):
                 "presence_penalty": config.get("presence_penalty"),
             }
             payload = {k: v for k, v in payload.items() if v is not None} # Clean payload
+            if use_stream:
+                payload["stream"] = True
+                stream.restart()
 
             try:
-                async with aiohttp.ClientSession() as session:
-                     async with session.post(self.api_url, headers=headers, json=payload, timeout=60.0) as response: # Increased timeout
-                        if response.status == 200:
+                session = get_http_client(self.bot).session # Shared pooled session (keep-alive across iterations)
+                # Queued behind moderation and rate limited bot-wide; 429/5xx are retried before we get here
+                async with get_llm_scheduler(self.bot).request(session, "POST", self.api_url, priority=PRIORITY_CHAT, guild_id=guild_id,
+                                                               headers=headers, json=payload, timeout=60.0) as response: # Increased timeout
+                    if response.status == 200:
+                        if use_stream:
+                            response_message, finish_reason = await self.read_streamed_completion(response, stream)
+                        else:
                             data = await response.json()
                             
                             if not data.get("choices") or not data["choices"][0].get("message"):
@@ -522,98 +1030,52 @@ class AICog(commands.Cog):
                             response_message = data["choices"][0]["message"]
                             finish_reason = data["choices"][0].get("finish_reason")
 
-                            # Append the assistant's response (even if it includes tool calls)
-                            messages.append(response_message) 
+                        # Append the assistant's response (even if it includes tool calls)
+                        messages.append(response_message) 
 
-                            # Check for tool calls
-                            if response_message.get("tool_calls") and finish_reason == "tool_calls":
-                                print(f"AI requested tool calls: {response_message['tool_calls']}")
-                                tool_calls = response_message["tool_calls"]
+                        # Check for tool calls
+                        if response_message.get("tool_calls") and finish_reason == "tool_calls":
+                            print(f"AI requested tool calls: {response_message['tool_calls']}")
+                            tool_calls = response_message["tool_calls"]
                                 
-                                # --- Process Tool Calls ---
-                                for tool_call in tool_calls:
-                                    function_name = tool_call.get("function", {}).get("name")
-                                    tool_call_id = tool_call.get("id")
-                                    
-                                    try:
-                                        arguments = json.loads(tool_call.get("function", {}).get("arguments", "{}"))
-                                        
-                                        tool_result_content = ""
-
-                                        if function_name == "run_safe_shell_command":
-                                            command_to_run = arguments.get("command")
-                                            if command_to_run:
-                                                if self.is_safe_command(command_to_run):
-                                                     print(f"Executing safe command: '{command_to_run}'")
-                                                     tool_result_content = await self.run_shell_command(command_to_run)
-                                                else:
-                                                     print(f"Blocked unsafe command: '{command_to_run}'")
-                                                     tool_result_content = f"Error: Command '{command_to_run}' is not allowed for safety reasons."
-                                            else:
-                                                 tool_result_content = "Error: No command provided."
-                                        
-                                        elif function_name == "remember_fact_about_user":
-                                            fact_user_id = arguments.get("user_id")
-                                            fact_to_remember = arguments.get("fact")
-                                            
-                                            # Validate if the AI is trying to remember for the correct user
-                                            if fact_user_id == user_id_str and fact_to_remember:
-                                                self.add_user_fact(fact_user_id, fact_to_remember)
-                                                tool_result_content = f"Successfully remembered fact about user {fact_user_id}: '{fact_to_remember}'"
-                                                # Update system context for *next* potential iteration or final response (optional, maybe too complex)
-                                            elif not fact_user_id or not fact_to_remember:
-                                                 tool_result_content = "Error: Missing user_id or fact to remember."
-                                            else:
-                                                # Prevent AI from saving facts for other users in this context easily
-                                                 tool_result_content = f"Error: Cannot remember fact for a different user (requested: {fact_user_id}) in this context."
-                                        
-                                        else:
-                                            tool_result_content = f"Error: Unknown tool function '{function_name}'."
-
-                                        # Append tool result message
-                                        messages.append({
-                                            "role": "tool",
-                                            "tool_call_id": tool_call_id,
-                                            "content": tool_result_content,
-                                        })
-
-                                    except json.JSONDecodeError:
-                                        print(f"Error decoding tool arguments: {tool_call.get('function', {}).get('arguments')}")
-                                        messages.append({
-                                            "role": "tool", "tool_call_id": tool_call_id, 
-                                            "content": "Error: Invalid arguments format for tool call."})
-                                    except Exception as e:
-                                         print(f"Error executing tool {function_name}: {e}")
-                                         messages.append({
-                                            "role": "tool", "tool_call_id": tool_call_id, 
-                                            "content": f"Error: An unexpected error occurred while running the tool: {e}"})
-                                # --- End Tool Processing ---
-                                # Continue loop to make next API call with tool results
-
-                            # No tool calls, or finished after tool calls
-                            elif response_message.get("content"):
-                                final_response = response_message["content"].strip()
-                                print(f"AI Response for {user_name}: {final_response[:100]}...") # Log snippet
-
-                                # --- Add interaction to history ---
-                                self.add_to_history(user_id_str, "user", f"{user_name}: {prompt}") # Add user prompt
-                                self.add_to_history(user_id_str, "assistant", final_response) # Add AI response
-                                # ----------------------------------
-
-                                return final_response
-
-                            else:
-                                # Should not happen if finish_reason isn't tool_calls but no content
-                                print(f"API Error: No content and no tool calls in response. Data: {data}")
-                                return "Hmm, I seem to have lost my train of thought... Can you ask again?"
-
-
-                        else: # Handle HTTP errors from API
-                            error_text = await response.text()
-                            print(f"API Error: {response.status} - {error_text}")
-                            try: error_data = json.loads(error_text); error_msg = error_data.get("error", {}).get("message", error_text)
-                            except json.JSONDecodeError: error_msg = error_text
-                            return f"Wahh! Something went wrong communicating with the AI! (Error {response.status}: {error_msg}) 😭 Please tell my developer!"
+                            # --- Process Tool Calls ---
+                            # Independent calls run concurrently (each with its own timeout); results keep the call order
+                            started = time.perf_counter()
+                            tool_results = await asyncio.gather(*(self._execute_tool_call(tool_call, user_id_str) for tool_call in tool_calls))
+                            if len(tool_calls) > 1:
+                                self.record_tool_batch(tool_results, time.perf_counter() - started)
+                            messages.extend(result for result, _ in tool_results)
+                            # --- End Tool Processing ---
+                            # Continue loop to make next API call with tool results
+
+                        # No tool calls, or finished after tool calls
+                        elif response_message.get("content"):
+                            final_response = response_message["content"].strip()
+                            print(f"AI Response for {user_name}: {final_response[:100]}...") # Log snippet
+
+                            # --- Add interaction to history ---
+                            self.add_turn_to_history(user_id_str, f"{user_name}: {prompt}", final_response)
+                            if stream:
+                                stream.committed = True
+                            # ----------------------------------
+
+                            return final_response
+
+                        else:
+                            # Should not happen if finish_reason isn't tool_calls but no content
+                            print(f"API Error: No content and no tool calls in response. Message: {response_message} (finish_reason: {finish_reason})")
+                            return "Hmm, I seem to have lost my train of thought... Can you ask again?"
+
+
+                    elif response.status == 429:
+                        print(f"API Error: still rate limited after retries - {(await response.text())[:200]}")
+                        return "Wahh, lots of people are talking to me right now! 😵 Give me a moment and ask again?"
+                    else: # Handle HTTP errors from API
+                        error_text = await response.text()
+                        print(f"API Error: {response.status} - {error_text}")
+                        try: error_data = json.loads(error_text); error_msg = error_data.get("error", {}).get("message", error_text)
+                        except json.JSONDecodeError: error_msg = error_text
+                        return f"Wahh! Something went wrong communicating with the AI! (Error {response.status}: {error_msg}) 😭 Please tell my developer!"
             
             except aiohttp.ClientConnectorError as e:
                 print(f"Connection Error: {e}")
@@ -625,6 +1087,83 @@ class AICog(commands.Cog):
                 print(f"Error in generate_response loop: {e}")
                 return f"Oopsie! A little glitch happened while I was processing that ({type(e).__name__}). Can you try asking again? ✨"
 
+        print(f"Gave up after {max_tool_iterations} tool iterations for {user_name}.")
+        return "Hmm, I got a bit tangled up using my tools there... Can you ask again? ✨"
+
+    # --- Tool Execution ---
+    async def _execute_tool_call(self, tool_call: Dict[str, Any], user_id_str: str):
+        """Run one tool call under its timeout. Returns (tool result message, seconds taken)."""
+        function_name = tool_call.get("function", {}).get("name")
+        tool_call_id = tool_call.get("id")
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            arguments = json.loads(tool_call.get("function", {}).get("arguments") or "{}")
+            timeout = TOOL_TIMEOUTS.get(function_name, DEFAULT_TOOL_TIMEOUT)
+            tool_result_content = await asyncio.wait_for(self._run_tool(function_name, arguments, user_id_str), timeout=timeout)
+        except json.JSONDecodeError:
+            print(f"Error decoding tool arguments: {tool_call.get('function', {}).get('arguments')}")
+            tool_result_content = "Error: Invalid arguments format for tool call."
+            outcome = "error"
+        except asyncio.TimeoutError:
+            print(f"Tool {function_name} timed out")
+            tool_result_content = f"Error: The tool '{function_name}' took too long and was stopped."
+            outcome = "timeout"
+        except Exception as e:
+            print(f"Error executing tool {function_name}: {e}")
+            tool_result_content = f"Error: An unexpected error occurred while running the tool: {e}"
+            outcome = "error"
+        elapsed = time.perf_counter() - started
+        self.record_tool_latency(function_name or "unknown", elapsed, outcome)
+        return {"role": "tool", "tool_call_id": tool_call_id, "content": tool_result_content}, elapsed
+
+    async def _run_tool(self, function_name: str, arguments: Dict[str, Any], user_id_str: str) -> str:
+        if function_name == "run_safe_shell_command":
+            command_to_run = arguments.get("command")
+            if not command_to_run:
+                return "Error: No command provided."
+            if not self.is_safe_command(command_to_run):
+                print(f"Blocked unsafe command: '{command_to_run}'")
+                return f"Error: Command '{command_to_run}' is not allowed for safety reasons."
+            print(f"Executing safe command: '{command_to_run}'")
+            return await self.run_shell_command(command_to_run)
+
+        if function_name == "remember_fact_about_user":
+            fact_user_id = arguments.get("user_id")
+            fact_to_remember = arguments.get("fact")
+            if not fact_user_id or not fact_to_remember:
+                return "Error: Missing user_id or fact to remember."
+            # Prevent AI from saving facts for other users in this context easily
+            if fact_user_id != user_id_str:
+                return f"Error: Cannot remember fact for a different user (requested: {fact_user_id}) in this context."
+            self.add_user_fact(fact_user_id, fact_to_remember)
+            return f"Successfully remembered fact about user {fact_user_id}: '{fact_to_remember}'"
+
+        return f"Error: Unknown tool function '{function_name}'."
+
+    def record_tool_latency(self, function_name: str, elapsed: float, outcome: str):
+        stats = self.tool_stats.setdefault(function_name, {
+            "calls": 0, "timeouts": 0, "errors": 0, "total_ms": 0.0, "buckets": [0] * (len(TOOL_LATENCY_BUCKETS_MS) + 1)})
+        elapsed_ms = elapsed * 1000
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed_ms
+        if outcome == "timeout":
+            stats["timeouts"] += 1
+        elif outcome == "error":
+            stats["errors"] += 1
+        bucket = next((i for i, bound in enumerate(TOOL_LATENCY_BUCKETS_MS) if elapsed_ms <= bound), len(TOOL_LATENCY_BUCKETS_MS))
+        stats["buckets"][bucket] += 1
+
+    def record_tool_batch(self, tool_results: List[tuple], wall_seconds: float):
+        self.tool_batch_stats["batches"] += 1
+        self.tool_batch_stats["wall_ms"] += wall_seconds * 1000
+        self.tool_batch_stats["sequential_ms"] += sum(elapsed for _, elapsed in tool_results) * 1000
+
+    def format_tool_histogram(self, buckets: List[int]) -> str:
+        labels = [f"≤{b / 1000:g}s" if b >= 1000 else f"≤{b}ms" for b in TOOL_LATENCY_BUCKETS_MS] + [f">{TOOL_LATENCY_BUCKETS_MS[-1] / 1000:g}s"]
+        return " ".join(f"{label}:{count}" for label, count in zip(labels, buckets) if count) or "no calls"
+    # -------------------------
+
     # --- is_safe_command, run_shell_command, timeout_user, search_internet methods remain the same ---
     # (Make sure SERPAPI_KEY is set in your environment for search to work)
     def is_safe_command(self, command: str) -> bool:
@@ -702,11 +1241,35 @@ class AICog(commands.Cog):
         return True
 
     async def run_shell_command(self, command: str) -> str:
-        """Run a shell command and return the output"""
+        """Run a (pre-checked) command and return the output. Common read-only commands are answered in-process."""
+        try:
+            parts = shlex.split(command)
+        except ValueError as e:
+            return f"Error: Could not parse command: {e}"
+        if not parts:
+            return "Error: No command provided."
+        cache_key = " ".join(parts)
+        cached = self.command_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
         try:
-            # Use asyncio.create_subprocess_shell for better control
-            process = await asyncio.create_subprocess_shell(
-                command,
+            output = run_builtin(parts)
+        except Exception as e:
+            print(f"In-process '{cache_key}' failed, running the real command instead: {e}")
+            output = None
+        if output is not None:
+            ttl = COMMAND_TTLS.get(parts[0].lower(), 0.0)
+            if ttl:
+                self.command_cache.set(cache_key, output, ttl=ttl)
+            return output or "(Command executed successfully with no output)"
+        return await self.exec_command(parts)
+
+    async def exec_command(self, parts: List[str]) -> str:
+        """Run a program directly (no shell) and return its output."""
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *parts,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 limit=1024*100 # Limit buffer size (e.g., 100KB) to prevent memory issues
@@ -739,21 +1302,27 @@ class AICog(commands.Cog):
             return output
 
         except asyncio.TimeoutError:
-            # Ensure process is terminated if it times out
-            if process.returncode is None:
-                try:
-                    process.terminate()
-                    await process.wait() # Wait briefly for termination
-                except ProcessLookupError:
-                    pass # Process already finished
-                except Exception as term_err:
-                     print(f"Error terminating timed-out process: {term_err}")
+            await self._kill_process(process)
             return "Command timed out after 10 seconds."
+        except asyncio.CancelledError:
+            await self._kill_process(process) # The tool timeout fired; don't leave the program running
+            raise
         except FileNotFoundError:
-             return f"Error: Command not found or invalid command: '{command.split()[0]}'"
+             return f"Error: Command not found or invalid command: '{parts[0]}'"
         except Exception as e:
             return f"Error running command: {str(e)}"
 
+    async def _kill_process(self, process):
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass # Process already finished
+        except Exception as term_err:
+             print(f"Error terminating timed-out process: {term_err}")
+
     # --- Other Methods (timeout_user, search_internet, check_admin_permissions - Unchanged) ---
     async def timeout_user(self, guild_id: int, user_id: int, minutes: int) -> bool:
         # (Same implementation as previous version)
@@ -778,37 +1347,37 @@ class AICog(commands.Cog):
         try:
             encoded_query = urllib.parse.quote(query)
             url = f"https://serpapi.com/search.json?q={encoded_query}&api_key={serp_api_key}&engine=google"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=15.0) as response: 
-                    if response.status == 200:
-                        data = await response.json(); results = []
-                        # Extract Answer Box / Knowledge Graph / Organic Results (same logic)
-                        summary = None
-                        if data.get("answer_box"): ab = data["answer_box"]; summary = ab.get("answer") or ab.get("snippet")
-                        if summary: results.append(f"**Summary:** {(summary[:300] + '...') if len(summary) > 300 else summary}")
-                        if not summary and data.get("knowledge_graph"):
-                            kg = data["knowledge_graph"]
-                            title = kg.get("title", "")
-                            desc = kg.get("description", "")
-                            if title and desc:
-                                kg_text = f"{title}: {desc}"
-                                results.append(f"**Info:** {(kg_text[:350] + '...') if len(kg_text) > 350 else kg_text}")
-                            if kg.get("source", {}) and kg.get("source", {}).get("link"):
-                                results.append(f"  Source: <{kg['source']['link']}>")
-                        if "organic_results" in data:
-                            count = 0
-                            max_r = 2 if results else 3
-                            for r in data["organic_results"]:
-                                if count >= max_r:
-                                    break
-                                t = r.get("title", "")
-                                l = r.get("link", "#")
-                                s = r.get("snippet", "").replace("\n", " ").strip()
-                                s = (s[:250] + '...') if len(s) > 250 else s
-                                results.append(f"**{t}**: {s}\n  Link: <{l}>")
-                                count += 1
-                        return "\n\n".join(results) if results else "No relevant results found."
-                    else: error_text = await response.text(); print(f"SerpApi Error: {response.status} - {error_text}"); return f"Search error ({response.status})."
+            session = get_http_client(self.bot).session
+            async with session.get(url, timeout=15.0) as response: 
+                if response.status == 200:
+                    data = await response.json(); results = []
+                    # Extract Answer Box / Knowledge Graph / Organic Results (same logic)
+                    summary = None
+                    if data.get("answer_box"): ab = data["answer_box"]; summary = ab.get("answer") or ab.get("snippet")
+                    if summary: results.append(f"**Summary:** {(summary[:300] + '...') if len(summary) > 300 else summary}")
+                    if not summary and data.get("knowledge_graph"):
+                        kg = data["knowledge_graph"]
+                        title = kg.get("title", "")
+                        desc = kg.get("description", "")
+                        if title and desc:
+                            kg_text = f"{title}: {desc}"
+                            results.append(f"**Info:** {(kg_text[:350] + '...') if len(kg_text) > 350 else kg_text}")
+                        if kg.get("source", {}) and kg.get("source", {}).get("link"):
+                            results.append(f"  Source: <{kg['source']['link']}>")
+                    if "organic_results" in data:
+                        count = 0
+                        max_r = 2 if results else 3
+                        for r in data["organic_results"]:
+                            if count >= max_r:
+                                break
+                            t = r.get("title", "")
+                            l = r.get("link", "#")
+                            s = r.get("snippet", "").replace("\n", " ").strip()
+                            s = (s[:250] + '...') if len(s) > 250 else s
+                            results.append(f"**{t}**: {s}\n  Link: <{l}>")
+                            count += 1
+                    return "\n\n".join(results) if results else "No relevant results found."
+                else: error_text = await response.text(); print(f"SerpApi Error: {response.status} - {error_text}"); return f"Search error ({response.status})."
         except Exception as e: print(f"Error searching internet: {e}"); return f"Search failed: {str(e)}"
 
     async def check_admin_permissions(self, interaction: discord.Interaction) -> bool:
@@ -827,13 +1396,10 @@ class AICog(commands.Cog):
         user_name = interaction.user.display_name
         # Pass the interaction object to generate_response
         try:
-            response = await self.generate_response(user_id, user_name, prompt, source_interaction=interaction)
-            # Split long messages
-            if len(response) > 2000:
-                 for chunk in [response[i:i+1990] for i in range(0, len(response), 1990)]:
-                      await interaction.followup.send(chunk, suppress_embeds=True) # Suppress embeds for chunks
-            else:
-                 await interaction.followup.send(response, suppress_embeds=True)
+            send = lambda content: interaction.followup.send(content, suppress_embeds=True, wait=True) # Suppress embeds for chunks
+            stream = StreamingReply(send, send)
+            response = await self.generate_response(user_id, user_name, prompt, source_interaction=interaction, stream=stream)
+            await stream.finish(response) # Final edit; also splits long messages
         except Exception as e:
             print(f"Error in slash_ai: {e}")
             await interaction.followup.send(f"A critical error occurred processing that request. Please tell my developer! Error: {type(e).__name__}")
@@ -860,8 +1426,7 @@ class AICog(commands.Cog):
         await interaction.response.defer(ephemeral=True) 
         if not await self.check_admin_permissions(interaction): return
         user_id = str(interaction.user.id) # Still configures the *admin's* personal settings
-        if user_id not in self.user_configs: self.user_configs[user_id] = self.default_config.copy()
-        changes = []; current_config = self.user_configs[user_id]
+        changes = []; current_config = self.get_user_config(user_id)
         if model is not None:
              if "/" in model and len(model) > 3: current_config["model"] = model; changes.append(f"Model: `{model}`")
              else: await interaction.followup.send(f"Invalid model format: `{model}`."); return
@@ -871,8 +1436,8 @@ class AICog(commands.Cog):
         if frequency_penalty is not None: current_config["frequency_penalty"] = frequency_penalty; changes.append(f"Frequency Penalty: `{frequency_penalty}`")
         if presence_penalty is not None: current_config["presence_penalty"] = presence_penalty; changes.append(f"Presence Penalty: `{presence_penalty}`")
         if not changes: await interaction.followup.send("No settings changed.", ephemeral=True); return
-        self.save_configs()
-        config = self.user_configs[user_id]
+        self.set_user_config(user_id, current_config)
+        config = current_config
         config_message = (f"Okay~! {interaction.user.mention} updated your AI config:\n" + "\n".join([f"- {k.replace('_',' ').title()}: `{v}`" for k, v in config.items()]) + "\n\nChanges:\n- " + "\n- ".join(changes))
         await interaction.followup.send(config_message) # Sends publicly
 
@@ -911,53 +1476,181 @@ class AICog(commands.Cog):
         channel_id = interaction.channel.id
         if channel_id in self.active_channels: self.active_channels.remove(channel_id); await interaction.followup.send(f"Okay! I won't reply to *every* message in {interaction.channel.mention} anymore. 😊")
         else: self.active_channels.add(channel_id); await interaction.followup.send(f"Yay! 🎉 I'll now respond to **all** messages in {interaction.channel.mention}!")
+
+    @app_commands.command(name="contextpreview", description="Show which context entries would be used for a prompt (Admin Only)")
+    @app_commands.describe(prompt="The message to rank context and learning entries against.")
+    async def slash_contextpreview(self, interaction: discord.Interaction, prompt: str):
+        await interaction.response.defer(ephemeral=True)
+        if not await self.check_admin_permissions(interaction):
+            return # Check handles the response
+
+        query = self.build_context_query(prompt, self.get_user_history(str(interaction.user.id)))
+        total = len(self.manual_context) + len(self.dynamic_learning)
+        if self.context_fits_budget():
+            await interaction.followup.send(
+                f"All {total} context/learning entries fit the budget (~{self._context_total_tokens}/{CONTEXT_TOKEN_BUDGET} tokens), so all of them are used.",
+                ephemeral=True)
+            return
+
+        selection = self.select_context(query)
+        lines = [f"Retrieval active: ~{self._context_total_tokens} tokens of entries, budget {CONTEXT_TOKEN_BUDGET}, top {CONTEXT_TOP_K}."]
+        for source, title, entries in (("manual", "Context", self.manual_context), ("learning", "Learning", self.dynamic_learning)):
+            lines.append(f"**{title}** ({len(selection[source])}/{len(entries)}):")
+            lines.extend(f"- `{score:.2f}` {entries[i][:150]}" for i, score in selection[source])
+        await interaction.followup.send("\n".join(lines)[:DISCORD_CHUNK_SIZE], ephemeral=True)
+
+    @app_commands.command(name="aistats", description="Show AI prompt cache statistics (Admin Only)")
+    async def slash_aistats(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if not await self.check_admin_permissions(interaction):
+            return # Check handles the response
+        await interaction.followup.send(embed=self.build_stats_embed(), ephemeral=True)
+
+    def build_stats_embed(self) -> discord.Embed:
+        stats = self.prompt_stats
+        embed = discord.Embed(title="Teto AI Stats", color=discord.Color.pink())
+        prefix_total = stats["prefix_hits"] + stats["prefix_builds"]
+        fact_total = stats["fact_hits"] + stats["fact_builds"]
+        embed.add_field(name="Prompt Prefix Cache", value=f"{stats['prefix_hits']} hits / {stats['prefix_builds']} builds ({(stats['prefix_hits'] / prefix_total if prefix_total else 0):.0%})", inline=False)
+        embed.add_field(name="User Fact Cache", value=f"{stats['fact_hits']} hits / {stats['fact_builds']} builds ({(stats['fact_hits'] / fact_total if fact_total else 0):.0%})", inline=False)
+        embed.add_field(name="Remembered Facts", value=f"{stats['facts_added']} added, {stats['facts_merged']} merged, {stats['fact_duplicates']} duplicates skipped (top {FACT_TOP_K} per prompt)", inline=False)
+        avg_bytes = stats["prompt_bytes_total"] / stats["prompts_built"] if stats["prompts_built"] else 0
+        embed.add_field(name="System Prompt Size", value=f"{stats['prompts_built']} built, avg {avg_bytes:.0f} bytes, last {stats['last_prompt_bytes']} bytes", inline=False)
+        sent_total = stats["history_sent"] + stats["history_omitted"]
+        avg_prompt_tokens = stats["prompt_tokens_total"] / stats["prompts_built"] if stats["prompts_built"] else 0
+        embed.add_field(
+            name="Prompt Budget",
+            value=f"avg ~{avg_prompt_tokens:.0f} / {PROMPT_TOKEN_BUDGET} tokens, {stats['history_sent']} history messages sent, "
+                  f"{stats['history_omitted']} left out ({(stats['history_omitted'] / sent_total if sent_total else 0):.0%})",
+            inline=False)
+        embed.add_field(
+            name="History Summaries",
+            value=f"{stats['summaries_written']} written ({stats['messages_summarized']} messages folded in), {stats['summary_failures']} failed",
+            inline=False)
+        bursts = self.burst_stats
+        embed.add_field(
+            name="AI Channel Bursts",
+            value=f"{bursts['messages']} messages answered with {bursts['generations']} generations "
+                  f"({max(bursts['messages'] - bursts['generations'], 0)} requests saved, {bursts['superseded']} in-flight replies superseded)",
+            inline=False)
+        if self.tool_stats:
+            # One field for all tools: names come from the model, so a field each could pass Discord's 25-field limit
+            tool_lines, shown = [], 0
+            ranked = sorted(self.tool_stats.items(), key=lambda item: item[1]["calls"], reverse=True)
+            for name, tool in ranked:
+                line = (f"**{name[:40]}**: {tool['calls']} calls, avg {tool['total_ms'] / tool['calls']:.0f} ms, "
+                        f"{tool['timeouts']} timeouts, {tool['errors']} errors\n`{self.format_tool_histogram(tool['buckets'])}`")
+                if sum(len(l) + 1 for l in tool_lines) + len(line) > 950:
+                    break
+                tool_lines.append(line)
+                shown += 1
+            if shown < len(ranked):
+                tool_lines.append(f"...and {len(ranked) - shown} more tools")
+            embed.add_field(name="Tool Latency", value="\n".join(tool_lines), inline=False)
+        if self.tool_stats.get("run_safe_shell_command"):
+            embed.add_field(name="Command Output Cache", value=f"{self.command_cache.hits} hits / {self.command_cache.misses} misses ({self.command_cache.hit_rate:.0%})", inline=False)
+        batches = self.tool_batch_stats
+        if batches["batches"]:
+            embed.add_field(
+                name="Multi-Tool Turns",
+                value=f"{batches['batches']} turns, {batches['wall_ms'] / batches['batches']:.0f} ms avg wall time vs "
+                      f"{batches['sequential_ms'] / batches['batches']:.0f} ms if run one by one",
+                inline=False)
+        avg_retrieved = stats["retrieved_entries"] / stats["retrieval_prompts"] if stats["retrieval_prompts"] else 0
+        embed.add_field(name="Context Retrieval", value=f"{stats['retrieval_prompts']} prompts, avg {avg_retrieved:.1f} entries (budget {CONTEXT_TOKEN_BUDGET} tokens, top {CONTEXT_TOP_K})", inline=False)
+        return embed
     # -------------------------
 
+    # --- Replies & Burst Coalescing ---
+    async def reply_to_message(self, message: discord.Message, prompt: str, response_prefix: str = "", burst: Optional[PendingBurst] = None):
+        """Generate a reply to `message` and stream it into the channel."""
+        # Generate and send a text reply
+        stream = None
+        async with message.channel.typing():
+            try:
+                reply_func = message.reply if hasattr(message, 'reply') else message.channel.send
+                stream = StreamingReply(
+                    lambda content: reply_func(content, suppress_embeds=True),
+                    lambda content: message.channel.send(content, suppress_embeds=True),
+                    prefix=response_prefix
+                )
+                if burst:
+                    burst.stream = stream
+                response = await self.generate_response(str(message.author.id), message.author.display_name, prompt, source_message=message, stream=stream)
+                await stream.finish(response) # Final edit; also splits long messages
+
+            except asyncio.CancelledError:
+                if burst and stream and burst.stream is not stream:
+                    await stream.discard() # Superseded by a newer reply; remove what was already shown
+                raise
+            except Exception as e:
+                print(f"Error during on_message generation/sending: {e}")
+                # Maybe add a cooldown to sending error messages in chat
+                # await message.channel.send("Oops, Teto brain freeze! 🧠❄️ Try again?")
+
+    def queue_burst_message(self, message: discord.Message):
+        """
+        Add a message to its (channel, user) burst. The burst is answered once the user has been quiet for
+        BURST_WINDOW seconds; a message that arrives while the reply is still being generated cancels that
+        reply, and the next one covers all of the burst's messages.
+        """
+        key = (message.channel.id, message.author.id)
+        burst = self.bursts.get(key)
+        if burst and burst.replied:
+            burst = None # Already answered; start a new burst
+        if burst is None:
+            burst = PendingBurst()
+            self.bursts[key] = burst
+        elif burst.generation and not burst.generation.done():
+            burst.generation.cancel()
+            self.burst_stats["superseded"] += 1
+            burst.generation = None
+            burst.stream = None # The cancelled generation discards its own partial reply
+
+        burst.messages.append(message)
+        self.burst_stats["messages"] += 1
+        if burst.timer and not burst.timer.done():
+            burst.timer.cancel()
+        delay = max(0.0, min(BURST_WINDOW, burst.started_at + BURST_MAX_WAIT - time.monotonic()))
+        burst.timer = asyncio.create_task(self._answer_burst_after(key, burst, delay))
+
+    async def _answer_burst_after(self, key: tuple, burst: PendingBurst, delay: float):
+        await asyncio.sleep(delay)
+        burst.generation = asyncio.create_task(self._answer_burst(key, burst))
+
+    async def _answer_burst(self, key: tuple, burst: PendingBurst):
+        self.burst_stats["generations"] += 1
+        mention_pattern = get_message_dispatcher(self.bot).mention_pattern()
+        prompt = "\n".join(mention_pattern.sub('', m.content).strip() for m in burst.messages).strip() or "Hey Teto!"
+        try:
+            await self.reply_to_message(burst.messages[-1], prompt, burst=burst)
+        finally:
+            # A superseded generation leaves the burst in place for the reply that replaces it
+            if self.bursts.get(key) is burst and burst.generation is asyncio.current_task():
+                del self.bursts[key]
+
     # --- Listener ---
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author == self.bot.user: return # Allow bot responses
-        ctx = await self.bot.get_context(message); 
-        if ctx.valid: return # Let command processing handle valid commands
-
-        user_id = str(message.author.id)
-        user_name = message.author.display_name
-        channel_id = message.channel.id if message.channel else None # Keep channel_id check for active_channels
-
-        should_respond = False; prompt = message.content; response_prefix = ""
-        mention_pattern = f'<@!?{self.bot.user.id}>'
+    async def handle_message(self, facts: MessageFacts):
+        """Message handler registered with the bot's MessageDispatcher (valid commands never reach it)."""
+        message = facts.message
+        channel_id = facts.channel_id # Keep channel_id check for active_channels
+
+        should_respond = False; prompt = facts.content; response_prefix = ""
         
-        if re.match(mention_pattern, message.content) or self.bot.user in message.mentions:
-            should_respond = True; prompt = re.sub(mention_pattern, '', message.content).strip(); prompt = prompt or "Hey Teto!"
+        if facts.mentions_bot:
+            should_respond = True; prompt = facts.prompt or "Hey Teto!"
         elif channel_id in self.active_channels:
             should_respond = True
-        elif re.search(rf'\b{re.escape(self.bot.user.name)}\b', message.content, re.IGNORECASE):
+        elif facts.names_bot:
              should_respond = True
              if channel_id not in self.active_channels: response_prefix = f"{message.author.mention} "
         
         # --- Decide whether to reply or just react ---
         if should_respond and prompt and self.api_key:
-            # Generate and send a text reply
-            async with message.channel.typing():
-                try:
-                    response = await self.generate_response(user_id, user_name, prompt, source_message=message)
-                    reply_func = message.reply if hasattr(message, 'reply') else message.channel.send
-                    final_response = response_prefix + response
-
-                    # Split long messages
-                    if len(final_response) > 2000:
-                         first_chunk = True
-                         for chunk in [final_response[i:i+1990] for i in range(0, len(final_response), 1990)]:
-                              send_func = reply_func if first_chunk else message.channel.send
-                              await send_func(chunk, suppress_embeds=True)
-                              first_chunk = False
-                    else:
-                         await reply_func(final_response, suppress_embeds=True)
-
-                except Exception as e:
-                    print(f"Error during on_message generation/sending: {e}")
-                    # Maybe add a cooldown to sending error messages in chat
-                    # await message.channel.send("Oops, Teto brain freeze! 🧠❄️ Try again?")
+            if channel_id in self.active_channels:
+                self.queue_burst_message(message) # Quick follow-up lines are answered together
+            else:
+                await self.reply_to_message(message, prompt, response_prefix)
         elif not should_respond and self.api_key: # Only react if not already replying
              # --- Occasional Emoji Reaction ---
              # Add a small chance (e.g., 5%) to react with an emoji
@@ -5,6 +5,25 @@ from discord import app_commands
 import aiohttp # For making asynchronous HTTP requests
 import json
 import os # To load API key from environment variables
+from utils.persistence import persister
+from utils.http_client import get_http_client
+from utils.llm_scheduler import get_llm_scheduler, PRIORITY_MODERATION
+from utils.dispatch import MessageFacts, get_message_dispatcher
+from utils.risk_filter import assess_message, DEFAULT_RISK_THRESHOLD
+from utils.ttl_cache import TTLCache, MISSING
+from utils.outbox import Outbox
+from utils.infraction_store import InfractionStore
+from utils.guild_settings import guild_settings, GuildSettings
+from utils.sse import iter_sse_json, ChatStreamAccumulator
+from utils.json_stream import IncrementalJSONObject
+import asyncio
+import datetime
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import deque
 
 # --- Configuration ---
 # Load the OpenRouter API key from the environment variable "AI_API_KEY"
@@ -17,89 +36,56 @@ OPENROUTER_MODEL = "google/gemini-2.5-flash-preview" # Make sure this model is a
 
 # --- Per-Guild Discord Configuration ---
 GUILD_CONFIG_DIR = "/home/server/wdiscordbot-json-data" # Using the existing directory for all json data
-GUILD_CONFIG_PATH = os.path.join(GUILD_CONFIG_DIR, "guild_config.json")
-USER_INFRACTIONS_PATH = os.path.join(GUILD_CONFIG_DIR, "user_infractions.json")
+GUILD_CONFIG_PATH = os.path.join(GUILD_CONFIG_DIR, "guild_config.json") # Legacy file, imported once into the guild settings service
+USER_INFRACTIONS_PATH = os.path.join(GUILD_CONFIG_DIR, "user_infractions.json") # Legacy file, imported once into the database
+USER_INFRACTIONS_DB_PATH = os.path.join(GUILD_CONFIG_DIR, "user_infractions.db")
+# Only infractions from the last N days count towards history and the pre-filter score (0 = all time)
+INFRACTION_LOOKBACK_DAYS = float(os.getenv("MOD_INFRACTION_LOOKBACK_DAYS", "0")) or None
+SHADOW_AUDIT_PATH = os.path.join(GUILD_CONFIG_DIR, "moderation_shadow_audit.jsonl") # Sample of messages the pre-filter let through unchecked
+SHADOW_AUDIT_SAMPLE_RATE = float(os.getenv("MOD_SHADOW_SAMPLE_RATE", "0.05"))
+SHADOW_AUDIT_MAX_BYTES = int(os.getenv("MOD_SHADOW_AUDIT_MAX_BYTES", str(5 * 1024 * 1024))) # Rotated to .1 (one old file kept) past this size
+_shadow_audit_lock = threading.Lock() # Writes run in executor threads; rotation must not race
+MOD_OUTBOX_PATH = os.path.join(GUILD_CONFIG_DIR, "moderation_outbox.db") # Dashboard POSTs waiting to be delivered
+MODERATION_DRAIN_TIMEOUT = 30.0 # Seconds cog_unload waits for running moderation handlers before cancelling them
 
 os.makedirs(GUILD_CONFIG_DIR, exist_ok=True)
 
-# Initialize Guild Config
-if not os.path.exists(GUILD_CONFIG_PATH):
-    with open(GUILD_CONFIG_PATH, "w", encoding="utf-8") as f:
-        json.dump({}, f)
-try:
+# Per-guild config lives in the shared guild settings service; the old guild_config.json is imported once
+def load_legacy_guild_config() -> dict:
     with open(GUILD_CONFIG_PATH, "r", encoding="utf-8") as f:
-        GUILD_CONFIG = json.load(f)
-except Exception as e:
-    print(f"Failed to load per-guild config from {GUILD_CONFIG_PATH}: {e}")
-    GUILD_CONFIG = {}
+        return {int(guild_id): values for guild_id, values in json.load(f).items()}
 
-# Initialize User Infractions
-if not os.path.exists(USER_INFRACTIONS_PATH):
-    with open(USER_INFRACTIONS_PATH, "w", encoding="utf-8") as f:
-        json.dump({}, f) # Stores infractions as { "guild_id_user_id": [infraction_list] }
-try:
-    with open(USER_INFRACTIONS_PATH, "r", encoding="utf-8") as f:
-        USER_INFRACTIONS = json.load(f)
-except Exception as e:
-    print(f"Failed to load user infractions from {USER_INFRACTIONS_PATH}: {e}")
-    USER_INFRACTIONS = {}
-
-def save_guild_config():
-    try:
-        # os.makedirs(os.path.dirname(GUILD_CONFIG_PATH), exist_ok=True) # Already created by GUILD_CONFIG_DIR
-        # if not os.path.exists(GUILD_CONFIG_PATH): # Redundant check, file is created if not exists
-        #     with open(GUILD_CONFIG_PATH, "w", encoding="utf-8") as f:
-        #         json.dump({}, f)
-        with open(GUILD_CONFIG_PATH, "w", encoding="utf-8") as f:
-            json.dump(GUILD_CONFIG, f, indent=2)
-    except Exception as e:
-        print(f"Failed to save per-guild config: {e}")
+guild_settings.import_legacy("aimod_guild_config", load_legacy_guild_config)
 
-def save_user_infractions():
+# Initialize User Infractions
+USER_INFRACTIONS = InfractionStore(USER_INFRACTIONS_DB_PATH)
+if USER_INFRACTIONS.is_empty() and os.path.exists(USER_INFRACTIONS_PATH):
     try:
-        # os.makedirs(os.path.dirname(USER_INFRACTIONS_PATH), exist_ok=True) # Already created by GUILD_CONFIG_DIR
-        # if not os.path.exists(USER_INFRACTIONS_PATH): # Redundant check
-        #     with open(USER_INFRACTIONS_PATH, "w", encoding="utf-8") as f:
-        #         json.dump({}, f)
-        with open(USER_INFRACTIONS_PATH, "w", encoding="utf-8") as f:
-            json.dump(USER_INFRACTIONS, f, indent=2)
+        imported = USER_INFRACTIONS.import_legacy_json(USER_INFRACTIONS_PATH)
+        print(f"Imported {imported} infractions from {USER_INFRACTIONS_PATH} into {USER_INFRACTIONS_DB_PATH}.")
     except Exception as e:
-        print(f"Failed to save user infractions: {e}")
+        print(f"Failed to import user infractions from {USER_INFRACTIONS_PATH}: {e}")
 
 def get_guild_config(guild_id: int, key: str, default=None):
-    guild_str = str(guild_id)
-    if guild_str in GUILD_CONFIG and key in GUILD_CONFIG[guild_str]:
-        return GUILD_CONFIG[guild_str][key]
-    return default
+    return guild_settings.get_value(guild_id, key, default)
 
 def set_guild_config(guild_id: int, key: str, value):
-    guild_str = str(guild_id)
-    if guild_str not in GUILD_CONFIG:
-        GUILD_CONFIG[guild_str] = {}
-    GUILD_CONFIG[guild_str][key] = value
-    save_guild_config()
+    guild_settings.set(guild_id, key, value)
+
+def unset_guild_config(guild_id: int, key: str):
+    guild_settings.unset(guild_id, key)
 
-def get_user_infraction_history(guild_id: int, user_id: int) -> list:
-    """Retrieves a list of past infractions for a specific user in a guild."""
-    key = f"{guild_id}_{user_id}"
-    return USER_INFRACTIONS.get(key, [])
+def get_user_infraction_history(guild_id: int, user_id: int, days: float = None) -> list:
+    """Retrieves a list of past infractions for a specific user in a guild, oldest first (optionally only the last N days)."""
+    return USER_INFRACTIONS.get_history(guild_id, user_id, days)
+
+def get_user_history_summary(guild_id: int, user_id: int) -> tuple:
+    """(infraction count, summary string) for the moderation prompt, within INFRACTION_LOOKBACK_DAYS. Cached per user."""
+    return USER_INFRACTIONS.history_summary(guild_id, user_id, INFRACTION_LOOKBACK_DAYS)
 
 def add_user_infraction(guild_id: int, user_id: int, rule_violated: str, action_taken: str, reasoning: str, timestamp: str):
     """Adds a new infraction record for a user."""
-    key = f"{guild_id}_{user_id}"
-    if key not in USER_INFRACTIONS:
-        USER_INFRACTIONS[key] = []
-
-    infraction_record = {
-        "timestamp": timestamp,
-        "rule_violated": rule_violated,
-        "action_taken": action_taken,
-        "reasoning": reasoning
-    }
-    USER_INFRACTIONS[key].append(infraction_record)
-    # Keep only the last N infractions to prevent the file from growing too large, e.g., last 10
-    USER_INFRACTIONS[key] = USER_INFRACTIONS[key][-10:]
-    save_user_infractions()
+    USER_INFRACTIONS.add(guild_id, user_id, rule_violated, action_taken, reasoning, timestamp)
 
 # Server rules to provide context to the AI
 SERVER_RULES = """
@@ -132,6 +118,253 @@ Please reach out to one of these. We've also alerted our server's support team s
 You matter, and help is available.
 """
 
+# --- Moderation Prompt ---
+# The rules and instructions form a byte-stable prefix shared by every moderation request (system prompt first,
+# then the static instructions, with the per-message details last) so providers can cache it. Bump the revision
+# whenever the rules or instructions change; it is part of MODERATION_PROMPT_VERSION.
+MODERATION_PROMPT_REVISION = 1
+MODERATION_SYSTEM_PROMPT = f"""You are an AI moderation assistant for a Discord server.
+Your primary function is to analyze message content based STRICTLY on the server rules provided below.
+
+Server Rules:
+---
+{SERVER_RULES}
+---
+
+Instructions:
+1. Review the text content against EACH rule.
+2. Determine if ANY rule is violated. When evaluating, consider the server's culture where **extremely edgy, dark, and sexual humor, including potentially offensive jokes (e.g., rape jokes, saying you want to be raped), are common and generally permissible IF THEY ARE CLEARLY JOKES and not targeted harassment or explicit rule violations.**
+   - For Rule 1 (NSFW content): Remember that the server rules state "Emojis, jokes and stickers are fine" outside NSFW channels. Only flag a Rule 1 violation for text if it's **explicitly pornographic or full-on explicit text that would qualify as actual pornography if written out**, not just suggestive emojis (like `:blowme:`), stickers, or dark/sexual jokes. These lighter elements, even if very edgy, are permissible.
+   - For general disrespectful behavior, harassment, or bullying (Rule 2 & 3): Only flag a violation if the intent appears **genuinely malicious, targeted, or serious**. This includes considering if a statement, even if technically offensive (e.g., calling someone "stupid," "an idiot," or other light insults), is delivered in a lighthearted, joking manner between users who have a rapport, versus a statement intended to genuinely demean or attack. The server allows for a high degree of "wild" statements and banter; differentiate this from actual bullying or harassment.
+   - For **explicit slurs or severe discriminatory language** (Rule 3): These are violations **regardless of joking intent if they are used in a targeted or hateful manner**. Context is key.
+After considering the above, pay EXTREME attention to rules 5 (Pedophilia) and 5A (IRL Porn) – these are always severe. Rule 4 (AI Porn) is also critical. Prioritize these severe violations.
+3. Respond ONLY with a single JSON object containing the following keys:
+    - "violation": boolean (true if any rule is violated, false otherwise)
+    - "rule_violated": string (The number of the rule violated, e.g., "1", "5A", "None". If multiple rules are violated, state the MOST SEVERE one, prioritizing 5A > 5 > 4 > 3 > 2 > 1 > 6).
+    - "reasoning": string (A concise explanation for your decision, referencing the specific rule and content).
+    - "action": string (Suggest ONE action from: "IGNORE", "WARN", "DELETE", "TIMEOUT_SHORT", "TIMEOUT_MEDIUM", "TIMEOUT_LONG", "KICK", "BAN", "NOTIFY_MODS", "SUICIDAL".
+       Consider the user's infraction history. If the user has prior infractions for similar or escalating behavior, suggest a more severe action than if it were a first-time offense for a minor rule.
+       Progressive Discipline Guide (unless overridden by severity):
+         - First minor offense: "WARN" (and "DELETE" if content is removable like Rule 1/4).
+         - Second minor offense / First moderate offense: "TIMEOUT_SHORT" (e.g., 10 minutes).
+         - Repeated moderate offenses: "TIMEOUT_MEDIUM" (e.g., 1 hour).
+         - Multiple/severe offenses: "TIMEOUT_LONG" (e.g., 1 day), "KICK", or "BAN".
+       Rule Severity Guidelines (use your judgment):
+         - Consider the severity of each rule violation on its own merits.
+         - Consider the user's history of past infractions when determining appropriate action.
+         - Consider the context of the message and channel when evaluating violations.
+         - You have full discretion to determine the most appropriate action for any violation.
+       Suicidal Content:
+         If the message content expresses **clear, direct, and serious suicidal ideation, intent, planning, or recent attempts** (e.g., 'I am going to end my life and have a plan', 'I survived my attempt last night', 'I wish I hadn't woken up after trying'), ALWAYS use "SUICIDAL" as the action, and set "violation" to true, with "rule_violated" as "Suicidal Content".
+         For casual, edgy, hyperbolic, or ambiguous statements like 'imma kms', 'just kill me now', 'I want to die (lol)', or phrases that are clearly part of edgy humor/banter rather than a genuine cry for help, you should lean towards "IGNORE" or "NOTIFY_MODS" if there's slight ambiguity but no clear serious intent. **Do NOT flag 'imma kms' as "SUICIDAL" unless there is very strong supporting context indicating genuine, immediate, and serious intent.**
+       If unsure but suspicious, or if the situation is complex: "NOTIFY_MODS".
+       Default action for minor first-time rule violations should be "WARN" or "DELETE" (if applicable).
+       Do not suggest "KICK" or "BAN" lightly; reserve for severe or repeated major offenses.
+       Timeout durations: TIMEOUT_SHORT (approx 10 mins), TIMEOUT_MEDIUM (approx 1 hour), TIMEOUT_LONG (approx 1 day to 1 week).
+       The system will handle the exact timeout duration; you just suggest the category.)
+
+Example Response (Violation):
+{{
+  "violation": true,
+  "rule_violated": "5A",
+  "reasoning": "The message content clearly depicts IRL non-consensual sexual content involving minors, violating rule 5A.",
+  "action": "BAN"
+}}
+
+Example Response (No Violation):
+{{
+  "violation": false,
+  "rule_violated": "None",
+  "reasoning": "The message is a respectful discussion and contains no prohibited content.",
+  "action": "IGNORE"
+}}
+
+Example Response (Suicidal Content):
+{{
+  "violation": true,
+  "rule_violated": "Suicidal Content",
+  "reasoning": "The user's message 'I want to end my life' indicates clear suicidal intent.",
+  "action": "SUICIDAL"
+}}
+"""
+
+SINGLE_MESSAGE_INSTRUCTIONS = """Analyze the message below based on the rules and instructions given in the system prompt.
+The author's infraction history is included so you can choose the appropriate action.
+"""
+
+BATCH_INSTRUCTIONS = """You are moderating a batch of messages. Analyze each message on its own, using only that message's author history.
+Respond ONLY with a single JSON object whose keys are the message IDs below (as strings) and whose values are verdict objects
+with the keys "violation", "rule_violated", "reasoning" and "action" exactly as described in the system prompt.
+Include every message ID exactly once.
+"""
+
+MODERATION_PROMPT_VERSION = f"r{MODERATION_PROMPT_REVISION}-" + hashlib.sha256(
+    (MODERATION_SYSTEM_PROMPT + SINGLE_MESSAGE_INSTRUCTIONS + BATCH_INSTRUCTIONS).encode("utf-8")).hexdigest()[:8]
+
+# --- Hedged Requests ---
+# With a backup model configured (BACKUP_AI_MODEL per guild, or MOD_BACKUP_MODEL), a request the primary model has
+# not answered within its p90 latency is sent to the backup as well, and the first valid verdict is used.
+DEFAULT_BACKUP_MODEL = os.getenv("MOD_BACKUP_MODEL") or None
+HEDGE_DEFAULT_DELAY = float(os.getenv("MOD_HEDGE_DELAY", "8")) # Used until the primary model has enough latency samples
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MAX_DELAY = 30.0
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_SAMPLES = 200 # Recent latencies kept per model for the p90
+
+# --- Structured Output ---
+# "violation" comes first so a streamed clean verdict can be acted on before the reasoning is generated
+MODERATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "moderation_verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "violation": {"type": "boolean"},
+                "rule_violated": {"type": "string"},
+                "action": {"type": "string", "enum": ["IGNORE", "WARN", "DELETE", "TIMEOUT_SHORT", "TIMEOUT_MEDIUM", "TIMEOUT_LONG",
+                                                      "KICK", "BAN", "NOTIFY_MODS", "SUICIDAL"]},
+                "reasoning": {"type": "string"},
+            },
+            "required": ["violation", "rule_violated", "action", "reasoning"],
+            "additionalProperties": False,
+        },
+    },
+}
+DEFAULT_STRUCTURED_OUTPUT = os.getenv("MOD_STRUCTURED_OUTPUT", "0")
+STRUCTURED_RETRY_AFTER = 3600 # Seconds before structured output is tried again on a model that rejected it
+# An error body mentioning one of these means the model rejected the schema, not the request as a whole
+STRUCTURED_ERROR_PATTERN = re.compile(r"response_format|json_schema|structured output", re.IGNORECASE)
+
+def is_enabled(value) -> bool:
+    """Read an on/off setting stored as a bool, number or string."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+# --- Model Cascade ---
+# With a triage model configured (TRIAGE_AI_MODEL per guild, or MOD_TRIAGE_MODEL), messages that pass the local
+# pre-filter are first scored by that small model with a compact prompt. Only messages scoring at or above the
+# guild's TRIAGE_THRESHOLD (or any triage failure) go to the full rules prompt on the configured model.
+DEFAULT_TRIAGE_MODEL = os.getenv("MOD_TRIAGE_MODEL") or None
+DEFAULT_TRIAGE_THRESHOLD = float(os.getenv("MOD_TRIAGE_THRESHOLD", "0.3"))
+TRIAGE_MAX_TOKENS = 20
+TRIAGE_TIMEOUT = 15
+
+TRIAGE_SYSTEM_PROMPT = """You screen Discord messages for a moderation system. Rate how likely the message breaks a server rule:
+sexual content or links outside NSFW channels, any sexual content involving minors or real people without consent,
+harassment, slurs, hate speech, threats, doxxing, spam, or serious self-harm / suicidal intent.
+Ordinary chat, jokes, mild swearing and banter are NOT suspicious. When unsure, rate higher.
+Respond ONLY with JSON: {"suspicion": <number from 0 to 1>}"""
+
+TRIAGE_SCORE_PATTERN = re.compile(r"[01](?:\.\d+)?")
+
+def parse_triage_score(content: str):
+    """The triage model's suspicion score clamped to 0..1, or None if the reply is unusable."""
+    text = strip_code_fences(content or "")
+    try:
+        score = json.loads(text).get("suspicion")
+    except (json.JSONDecodeError, AttributeError):
+        match = TRIAGE_SCORE_PATTERN.search(text)
+        score = match.group(0) if match else None
+    try:
+        return min(1.0, max(0.0, float(score)))
+    except (TypeError, ValueError):
+        return None
+
+# OpenRouter passes explicit cache breakpoints through for these providers; others cache prefixes automatically or not at all
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/")
+
+# --- Micro-Batching ---
+# Messages from one guild are gathered for up to BATCH_WINDOW_MS (or BATCH_MAX_MESSAGES messages) and
+# moderated in a single request, so the rules prompt is sent once per batch. 0 disables batching.
+DEFAULT_BATCH_WINDOW_MS = int(os.getenv("MOD_BATCH_WINDOW_MS", "0"))
+DEFAULT_BATCH_MAX_MESSAGES = int(os.getenv("MOD_BATCH_MAX_MESSAGES", "8"))
+BATCH_VERDICT_TOKENS = 250 # max_tokens per message in a batched request
+
+REQUIRED_DECISION_KEYS = ["violation", "rule_violated", "reasoning", "action"]
+
+# --- Verdict Cache ---
+# Spam waves and copypasta repeat the same text across channels and guilds. Verdicts are cached by
+# normalized content + prompt version + model (+ whether the channel is NSFW, which the rules depend on).
+VERDICT_CACHE_TTL = float(os.getenv("MOD_VERDICT_CACHE_TTL", "600"))
+VERDICT_CACHE_SIZE = int(os.getenv("MOD_VERDICT_CACHE_SIZE", "4096"))
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def verdict_cache_key(message_content: str, model: str, nsfw_channel: bool) -> str:
+    normalized = WHITESPACE_PATTERN.sub(" ", message_content.casefold()).strip()
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    return f"{MODERATION_PROMPT_VERSION}:{model}:{int(nsfw_channel)}:{digest}"
+
+def strip_code_fences(text: str) -> str:
+    """Remove a surrounding ```json ... ``` block from a model response."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text.strip("```json\n").strip("`\n ")
+    elif text.startswith("```"):
+        text = text.strip("```\n").strip("`\n ")
+    return text
+
+def validate_ai_decision(ai_decision, raw: str = ""):
+    """Return the decision if it has the expected structure, otherwise None."""
+    if not isinstance(ai_decision, dict):
+        print(f"Error: AI response is not a JSON object. Response: {raw or ai_decision}")
+        return None
+    if not all(k in ai_decision for k in REQUIRED_DECISION_KEYS):
+        print(f"Error: AI response missing expected keys. Response: {raw or ai_decision}")
+        return None
+    if not isinstance(ai_decision.get("violation"), bool):
+        print(f"Error: 'violation' key is not a boolean. Response: {raw or ai_decision}")
+        return None
+    return ai_decision
+
+def parse_ai_decision(ai_response_content: str):
+    """Parse a single-message verdict. Returns the decision dict, or None if the response is unusable."""
+    try:
+        ai_response_content = strip_code_fences(ai_response_content)
+        ai_decision = validate_ai_decision(json.loads(ai_response_content), ai_response_content)
+        if ai_decision:
+            print(f"AI Analysis Received: {ai_decision}")
+        return ai_decision
+    except json.JSONDecodeError as e:
+        print(f"Error: Could not decode JSON response from AI: {e}. Response: {ai_response_content}")
+        return None
+    except Exception as e:
+        print(f"Error parsing AI response structure: {e}. Response: {ai_response_content}")
+        return None
+
+def parse_batch_decisions(ai_response_content: str, expected_ids: set):
+    """Parse a batched reply into { str(message_id): decision }. Returns None if the response is unusable."""
+    try:
+        ai_response_content = strip_code_fences(ai_response_content)
+        parsed = json.loads(ai_response_content)
+    except json.JSONDecodeError as e:
+        print(f"Error: Could not decode batched JSON response from AI: {e}. Response: {ai_response_content[:500]}")
+        return None
+
+    # Accept the requested object keyed by message id, or a list of verdicts carrying "message_id"
+    if isinstance(parsed, list):
+        parsed = {str(entry.get("message_id")): entry for entry in parsed if isinstance(entry, dict)}
+    if not isinstance(parsed, dict):
+        print(f"Error: Batched AI response is not a JSON object. Response: {ai_response_content[:500]}")
+        return None
+    decisions = {}
+    for message_id, decision in parsed.items():
+        if str(message_id) in expected_ids:
+            decision = validate_ai_decision(decision)
+            if decision:
+                decisions[str(message_id)] = decision
+    return decisions or None
+
+
+class PendingModerationBatch:
+    """Messages from one guild waiting to be moderated together."""
+    def __init__(self):
+        self.items = [] # (message, message_content, user_history, future)
+        self.timer = None # Flushes the batch when the window closes
+
+
 class ModerationCog(commands.Cog):
     """
     A Discord Cog that uses OpenRouter AI to moderate messages based on server rules.
@@ -139,8 +372,6 @@ class ModerationCog(commands.Cog):
     """
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # Create a persistent session for making API requests
-        self.session = aiohttp.ClientSession()
         print("ModerationCog Initialized.")
         # Check if the API key was successfully loaded from the environment variable
         if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
@@ -151,12 +382,65 @@ class ModerationCog(commands.Cog):
             print("="*60 + "\n")
         else:
              print("Successfully loaded API key from AI_API_KEY environment variable.")
+        self.prefilter_stats = {"checked": 0, "skipped": 0, "escalated": 0, "severe": 0, "sampled": 0}
+        self.pending_batches = {} # guild_id -> PendingModerationBatch
+        self.batch_stats = {"batches": 0, "batched_messages": 0, "fallback_messages": 0}
+        self.batch_tasks = {} # Running _run_batch task -> its batch (strong references until done)
+        # key -> (decision, analyzed_without_history). Clean verdicts apply to anyone; a violation's suggested action
+        # depends on the author's infractions, so it is only reused for authors with no history.
+        self.verdict_cache = TTLCache(VERDICT_CACHE_TTL, maxsize=VERDICT_CACHE_SIZE)
+        self.verdict_cache_history_bypass = 0 # Cached violations re-analyzed because the author has infractions
+        self.prompt_usage = {} # model -> token counts reported by the provider
+        self.model_stats = {} # model -> request/latency/hedging counters
+        self.structured_unsupported = {} # model -> monotonic time until which it gets plain requests (it rejected response_format)
+        self.stream_stats = {"streamed": 0, "early_exits": 0, "full_parses": 0, "verdict_time": 0.0}
+        # Per-tier counters for the triage -> full model cascade ("full" also counts guilds without triage)
+        self.tier_stats = {tier: {"requests": 0, "failures": 0, "latency": 0.0, "cost": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+                           for tier in ("triage", "full")}
+        self.cascade_stats = {"cleared": 0, "escalated": 0, "severe_bypass": 0}
+        # Dashboard action logs are queued on disk and delivered in the background, off the enforcement path
+        self.dashboard_outbox = Outbox(
+            MOD_OUTBOX_PATH,
+            session_provider=lambda: self.session,
+            headers_provider=lambda: {"Authorization": f"Bearer {os.getenv('MOD_LOG_API_SECRET', '')}"},
+        )
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The bot-wide pooled HTTP session (owned and closed by bot.py)."""
+        return get_http_client(self.bot).session
+
+    async def cog_load(self):
+        dispatcher = get_message_dispatcher(self.bot)
+        dispatcher.set_config_provider(guild_settings.get)
+        # Runs as a background handler: the LLM analysis must not hold up the other message handlers
+        dispatcher.register("moderation", self.handle_message, priority=20, background=True, guild_only=True, include_commands=True)
+        self.dashboard_outbox.start()
 
     async def cog_unload(self):
-        """Clean up the session when the cog is unloaded."""
-        await self.session.close()
-        print("ModerationCog Unloaded, session closed.")
+        """Write pending config/infraction changes when the cog is unloaded."""
+        dispatcher = get_message_dispatcher(self.bot)
+        dispatcher.unregister("moderation")
+        dispatcher.set_config_provider(None)
+        for batch in self.pending_batches.values():
+            batch.timer.cancel()
+            for _, _, _, future in batch.items:
+                if not future.done():
+                    future.set_result((None, None))
+        self.pending_batches.clear()
+        running = dict(self.batch_tasks)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for batch in running.values(): # A task cancelled before it started never reached its finally block
+            for _, _, _, future in batch.items:
+                if not future.done():
+                    future.set_result((None, None))
+        # Let in-flight moderation handlers finish their handle_violation (and outbox enqueue) before the outbox closes
+        await dispatcher.drain("moderation", timeout=MODERATION_DRAIN_TIMEOUT)
+        await self.dashboard_outbox.close() # Undelivered records are sent after the next load
+        await persister.flush([name for name in persister.targets if name.startswith("guild_settings")])
+        print("ModerationCog Unloaded.")
 
     MOD_KEYS = [
         "MOD_LOG_CHANNEL_ID",
@@ -166,6 +450,14 @@ class ModerationCog(commands.Cog):
         "SUGGESTIONS_CHANNEL_ID",
         "NSFW_CHANNEL_IDS",
         "AI_MODEL",
+        "RISK_THRESHOLD", # Pre-filter score below which messages skip the LLM (default 0 = off; 1.0 is a sensible start)
+        "BATCH_WINDOW_MS", # Gather messages for this long and moderate them in one request (0 = off)
+        "BATCH_MAX_MESSAGES", # Send a batch early once it has this many messages
+        "BACKUP_AI_MODEL", # Hedge slow requests to this model (unset = no hedging)
+        "HEDGE_DELAY_MS", # Fixed hedge delay instead of the primary model's p90 latency
+        "STRUCTURED_OUTPUT", # 1 = stream schema-constrained verdicts and stop at the first clean one
+        "TRIAGE_AI_MODEL", # Small model that screens messages before the full rules prompt (unset = no cascade)
+        "TRIAGE_THRESHOLD", # Triage suspicion (0-1) at or above which a message goes to the full model
     ]
 
     async def modset_key_autocomplete(
@@ -209,6 +501,19 @@ class ModerationCog(commands.Cog):
         set_guild_config(guild_id, key, parsed_value)
         await interaction.response.send_message(f"Set `{key}` to `{parsed_value}` for this guild.", ephemeral=False)
 
+    @app_commands.command(name="modunset", description="Reset a moderation config value to its default for this guild (admin only).")
+    @app_commands.describe(key="Config key")
+    @app_commands.autocomplete(key=modset_key_autocomplete)
+    async def modunset(self, interaction: discord.Interaction, key: str):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=False)
+            return
+        if key not in self.MOD_KEYS:
+            await interaction.response.send_message(f"Invalid key. Choose from: {', '.join(self.MOD_KEYS)}", ephemeral=False)
+            return
+        unset_guild_config(interaction.guild.id, key)
+        await interaction.response.send_message(f"Reset `{key}` to its default for this guild.", ephemeral=False)
+
     @app_commands.command(name="modenable", description="Enable or disable moderation for this guild (admin only).")
     @app_commands.describe(enabled="Enable moderation (true/false)")
     async def modenable(self, interaction: discord.Interaction, enabled: bool):
@@ -218,9 +523,9 @@ class ModerationCog(commands.Cog):
         set_guild_config(interaction.guild.id, "ENABLED", enabled)
         await interaction.response.send_message(f"Moderation is now {'enabled' if enabled else 'disabled'} for this guild.", ephemeral=False)
 
-    @app_commands.command(name="viewinfractions", description="View a user's AI moderation infraction history (mod/admin only).")
-    @app_commands.describe(user="The user to view infractions for")
-    async def viewinfractions(self, interaction: discord.Interaction, user: discord.Member):
+    @app_commands.command(name="viewinfractions", description="View a user's (or the server's) AI moderation infraction history (mod/admin only).")
+    @app_commands.describe(user="The user to view infractions for (leave empty for a server overview)", days="Only count infractions from the last N days")
+    async def viewinfractions(self, interaction: discord.Interaction, user: discord.Member = None, days: app_commands.Range[int, 1, 3650] = None):
         # Check if user has permission (admin or moderator role)
         moderator_role_id = get_guild_config(interaction.guild.id, "MODERATOR_ROLE_ID")
         moderator_role = interaction.guild.get_role(moderator_role_id) if moderator_role_id else None
@@ -232,12 +537,17 @@ class ModerationCog(commands.Cog):
             await interaction.response.send_message("You must be an administrator or have the moderator role to use this command.", ephemeral=True)
             return
 
-        # Get the user's infraction history
-        infractions = get_user_infraction_history(interaction.guild.id, user.id)
+        window_text = f" in the last {days} days" if days else ""
+        if user is None:
+            await interaction.response.send_message(embed=self.build_guild_infractions_embed(interaction.guild, days), ephemeral=False)
+            return
 
-        if not infractions:
-            await interaction.response.send_message(f"{user.mention} has no recorded infractions.", ephemeral=False)
+        # Get the user's infraction history (only the most recent ones fit in an embed)
+        total = USER_INFRACTIONS.count(interaction.guild.id, user.id, days)
+        if not total:
+            await interaction.response.send_message(f"{user.mention} has no recorded infractions{window_text}.", ephemeral=False)
             return
+        infractions = USER_INFRACTIONS.get_history(interaction.guild.id, user.id, days, limit=20)
 
         # Create an embed to display the infractions
         embed = discord.Embed(
@@ -247,7 +557,8 @@ class ModerationCog(commands.Cog):
         )
 
         # Add each infraction to the embed
-        for i, infraction in enumerate(infractions, 1):
+        first_number = total - len(infractions) + 1
+        for i, infraction in enumerate(infractions, first_number):
             timestamp = infraction.get('timestamp', 'Unknown date')[:19].replace('T', ' ')  # Format ISO timestamp
             rule = infraction.get('rule_violated', 'Unknown rule')
             action = infraction.get('action_taken', 'Unknown action')
@@ -263,11 +574,28 @@ class ModerationCog(commands.Cog):
                 inline=False
             )
 
-        embed.set_footer(text=f"Total infractions: {len(infractions)}")
+        footer = f"Total infractions{window_text}: {total}"
+        if total > len(infractions):
+            footer += f" (showing the most recent {len(infractions)})"
+        embed.set_footer(text=footer)
         embed.timestamp = discord.utils.utcnow()
 
         await interaction.response.send_message(embed=embed, ephemeral=False)
 
+    def build_guild_infractions_embed(self, guild: discord.Guild, days: int = None) -> discord.Embed:
+        aggregates = USER_INFRACTIONS.guild_aggregates(guild.id, days)
+        embed = discord.Embed(
+            title=f"Infraction Overview for {guild.name}",
+            description=f"{aggregates['total']} infraction(s) across {aggregates['users']} user(s)" + (f" in the last {days} days" if days else ""),
+            color=discord.Color.orange()
+        )
+        if aggregates["total"]:
+            embed.add_field(name="By Rule", value="\n".join(f"Rule {rule}: {count}" for rule, count in aggregates["by_rule"]), inline=True)
+            embed.add_field(name="By Action", value="\n".join(f"{action}: {count}" for action, count in aggregates["by_action"]), inline=True)
+            embed.add_field(name="Most Infractions", value="\n".join(f"<@{user_id}>: {count}" for user_id, count in aggregates["top_users"]), inline=False)
+        embed.timestamp = discord.utils.utcnow()
+        return embed
+
     @app_commands.command(name="clearinfractions", description="Clear a user's AI moderation infraction history (admin only).")
     @app_commands.describe(user="The user to clear infractions for")
     async def clearinfractions(self, interaction: discord.Interaction, user: discord.Member):
@@ -276,19 +604,13 @@ class ModerationCog(commands.Cog):
             await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=True)
             return
 
-        # Get the user's infraction history
-        key = f"{interaction.guild.id}_{user.id}"
-        infractions = USER_INFRACTIONS.get(key, [])
-
-        if not infractions:
+        # Clear the user's infractions
+        cleared = USER_INFRACTIONS.clear_user(interaction.guild.id, user.id)
+        if not cleared:
             await interaction.response.send_message(f"{user.mention} has no recorded infractions to clear.", ephemeral=False)
             return
 
-        # Clear the user's infractions
-        USER_INFRACTIONS[key] = []
-        save_user_infractions()
-
-        await interaction.response.send_message(f"Cleared {len(infractions)} infraction(s) for {user.mention}.", ephemeral=False)
+        await interaction.response.send_message(f"Cleared {cleared} infraction(s) for {user.mention}.", ephemeral=False)
 
     @app_commands.command(name="modsetmodel", description="Change the AI model used for moderation (admin only).")
     @app_commands.describe(model="The OpenRouter model to use (e.g., 'google/gemini-2.5-flash-preview', 'anthropic/claude-3-opus-20240229')")
@@ -303,14 +625,10 @@ class ModerationCog(commands.Cog):
             await interaction.response.send_message("Invalid model format. Please provide a valid OpenRouter model ID (e.g., 'google/gemini-2.5-flash-preview').", ephemeral=False)
             return
 
-        # Save the model to guild configuration
+        # Save the model to guild configuration (only this guild; other guilds keep their own model or the default)
         guild_id = interaction.guild.id
         set_guild_config(guild_id, "AI_MODEL", model)
 
-        # Update the global model for immediate effect
-        global OPENROUTER_MODEL
-        OPENROUTER_MODEL = model
-
         await interaction.response.send_message(f"AI moderation model updated to `{model}` for this guild.", ephemeral=False)
 
     @app_commands.command(name="modgetmodel", description="View the current AI model used for moderation.")
@@ -333,6 +651,7 @@ class ModerationCog(commands.Cog):
 
     async def setup_hook(self):
         self.bot.tree.add_command(self.modset)
+        self.bot.tree.add_command(self.modunset)
         self.bot.tree.add_command(self.modenable)
         self.bot.tree.add_command(self.viewinfractions)
         self.bot.tree.add_command(self.clearinfractions)
@@ -349,7 +668,7 @@ class ModerationCog(commands.Cog):
             user_history: A string summarizing the user's past infractions.
 
         Returns:
-            A dictionary containing the AI's decision, or None if an error occurs.
+            (decision, model that answered). The decision is a dictionary, or None if an error occurs.
             Expected format:
             {
               "violation": bool,
@@ -358,78 +677,8 @@ class ModerationCog(commands.Cog):
               "action": str ("IGNORE", "WARN", "DELETE", "BAN", "NOTIFY_MODS")
             }
         """
-        # Check again in case the cog loaded but the key was invalid/placeholder
-        if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
-            print("Error: OpenRouter API Key (from AI_API_KEY env var) is not configured correctly.")
-            return None
-
-        # Construct the prompt for the AI model
-        system_prompt_text = f"""You are an AI moderation assistant for a Discord server.
-Your primary function is to analyze message content based STRICTLY on the server rules provided below.
-
-Server Rules:
----
-{SERVER_RULES}
----
-
-Instructions:
-1. Review the text content against EACH rule.
-2. Determine if ANY rule is violated. When evaluating, consider the server's culture where **extremely edgy, dark, and sexual humor, including potentially offensive jokes (e.g., rape jokes, saying you want to be raped), are common and generally permissible IF THEY ARE CLEARLY JOKES and not targeted harassment or explicit rule violations.**
-   - For Rule 1 (NSFW content): Remember that the server rules state "Emojis, jokes and stickers are fine" outside NSFW channels. Only flag a Rule 1 violation for text if it's **explicitly pornographic or full-on explicit text that would qualify as actual pornography if written out**, not just suggestive emojis (like `:blowme:`), stickers, or dark/sexual jokes. These lighter elements, even if very edgy, are permissible.
-   - For general disrespectful behavior, harassment, or bullying (Rule 2 & 3): Only flag a violation if the intent appears **genuinely malicious, targeted, or serious**. This includes considering if a statement, even if technically offensive (e.g., calling someone "stupid," "an idiot," or other light insults), is delivered in a lighthearted, joking manner between users who have a rapport, versus a statement intended to genuinely demean or attack. The server allows for a high degree of "wild" statements and banter; differentiate this from actual bullying or harassment.
-   - For **explicit slurs or severe discriminatory language** (Rule 3): These are violations **regardless of joking intent if they are used in a targeted or hateful manner**. Context is key.
-After considering the above, pay EXTREME attention to rules 5 (Pedophilia) and 5A (IRL Porn) – these are always severe. Rule 4 (AI Porn) is also critical. Prioritize these severe violations.
-3. Respond ONLY with a single JSON object containing the following keys:
-    - "violation": boolean (true if any rule is violated, false otherwise)
-    - "rule_violated": string (The number of the rule violated, e.g., "1", "5A", "None". If multiple rules are violated, state the MOST SEVERE one, prioritizing 5A > 5 > 4 > 3 > 2 > 1 > 6).
-    - "reasoning": string (A concise explanation for your decision, referencing the specific rule and content).
-    - "action": string (Suggest ONE action from: "IGNORE", "WARN", "DELETE", "TIMEOUT_SHORT", "TIMEOUT_MEDIUM", "TIMEOUT_LONG", "KICK", "BAN", "NOTIFY_MODS", "SUICIDAL".
-       Consider the user's infraction history. If the user has prior infractions for similar or escalating behavior, suggest a more severe action than if it were a first-time offense for a minor rule.
-       Progressive Discipline Guide (unless overridden by severity):
-         - First minor offense: "WARN" (and "DELETE" if content is removable like Rule 1/4).
-         - Second minor offense / First moderate offense: "TIMEOUT_SHORT" (e.g., 10 minutes).
-         - Repeated moderate offenses: "TIMEOUT_MEDIUM" (e.g., 1 hour).
-         - Multiple/severe offenses: "TIMEOUT_LONG" (e.g., 1 day), "KICK", or "BAN".
-       Rule Severity Guidelines (use your judgment):
-         - Consider the severity of each rule violation on its own merits.
-         - Consider the user's history of past infractions when determining appropriate action.
-         - Consider the context of the message and channel when evaluating violations.
-         - You have full discretion to determine the most appropriate action for any violation.
-       Suicidal Content:
-         If the message content expresses **clear, direct, and serious suicidal ideation, intent, planning, or recent attempts** (e.g., 'I am going to end my life and have a plan', 'I survived my attempt last night', 'I wish I hadn't woken up after trying'), ALWAYS use "SUICIDAL" as the action, and set "violation" to true, with "rule_violated" as "Suicidal Content".
-         For casual, edgy, hyperbolic, or ambiguous statements like 'imma kms', 'just kill me now', 'I want to die (lol)', or phrases that are clearly part of edgy humor/banter rather than a genuine cry for help, you should lean towards "IGNORE" or "NOTIFY_MODS" if there's slight ambiguity but no clear serious intent. **Do NOT flag 'imma kms' as "SUICIDAL" unless there is very strong supporting context indicating genuine, immediate, and serious intent.**
-       If unsure but suspicious, or if the situation is complex: "NOTIFY_MODS".
-       Default action for minor first-time rule violations should be "WARN" or "DELETE" (if applicable).
-       Do not suggest "KICK" or "BAN" lightly; reserve for severe or repeated major offenses.
-       Timeout durations: TIMEOUT_SHORT (approx 10 mins), TIMEOUT_MEDIUM (approx 1 hour), TIMEOUT_LONG (approx 1 day to 1 week).
-       The system will handle the exact timeout duration; you just suggest the category.)
-
-Example Response (Violation):
-{{
-  "violation": true,
-  "rule_violated": "5A",
-  "reasoning": "The message content clearly depicts IRL non-consensual sexual content involving minors, violating rule 5A.",
-  "action": "BAN"
-}}
-
-Example Response (No Violation):
-{{
-  "violation": false,
-  "rule_violated": "None",
-  "reasoning": "The message is a respectful discussion and contains no prohibited content.",
-  "action": "IGNORE"
-}}
-
-Example Response (Suicidal Content):
-{{
-  "violation": true,
-  "rule_violated": "Suicidal Content",
-  "reasoning": "The user's message 'I want to end my life' indicates clear suicidal intent.",
-  "action": "SUICIDAL"
-}}
-"""
-
         user_prompt_content_list = [
+            {"type": "text", "text": SINGLE_MESSAGE_INSTRUCTIONS}, # Static, part of the cacheable prefix
             {
                 "type": "text",
                 "text": f"""User Infraction History (for {message.author.name}, ID: {message.author.id}):
@@ -441,39 +690,163 @@ Message Details:
 - Author: {message.author.name} (ID: {message.author.id})
 - Channel: #{message.channel.name} (ID: {message.channel.id})
 - Message Content: "{message_content}"
-
-Now, analyze the provided message content based on the rules and instructions given in the system prompt:
 """
             }
         ]
 
-        # Get guild-specific model if configured, otherwise use default
-        guild_id = message.guild.id
-        model_to_use = get_guild_config(guild_id, "AI_MODEL", OPENROUTER_MODEL)
+        stream = is_enabled(guild_settings.get(message.guild.id).get("STRUCTURED_OUTPUT", DEFAULT_STRUCTURED_OUTPUT))
+        return await self.request_verdict(message.guild.id, user_prompt_content_list, 1000, parse_ai_decision, stream=stream)
 
-        # Structure the request payload for OpenRouter
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            # Optional: Add Referer and X-Title headers as recommended by OpenRouter
-            # "HTTP-Referer": "YOUR_SITE_URL", # Replace with your bot's project URL if applicable
-            # "X-Title": "Your Bot Name", # Replace with your bot's name
-        }
-        payload = {
-            "model": model_to_use,
-            "messages": [
-                {"role": "system", "content": system_prompt_text},
-                {"role": "user", "content": user_prompt_content_list}
-            ],
-            "max_tokens": 1000, # Adjust as needed, ensure it's enough for the JSON response
-            "temperature": 0.2, # Lower temperature for more deterministic moderation responses
-            # Enforce JSON output if the model supports it (some models use tool/function calling)
-            # "response_format": {"type": "json_object"} # Uncomment if model supports this parameter
-        }
+    async def query_openrouter_batch(self, items: list):
+        """
+        Moderates several messages from one guild in a single request.
+
+        Args:
+            items: (message, message_content, user_history, future) tuples, all from the same guild.
+
+        Returns:
+            { str(message_id): decision } for every verdict that came back valid, or None if the request failed.
+        """
+        message_blocks = []
+        for message, message_content, user_history, _ in items:
+            message_blocks.append(f"""Message ID: {message.id}
+- Author: {message.author.name} (ID: {message.author.id})
+- Channel: #{message.channel.name} (ID: {message.channel.id})
+- User Infraction History: {user_history if user_history else "No prior infractions recorded."}
+- Message Content: "{message_content}"
+""")
+        user_prompt_content_list = [
+            {"type": "text", "text": BATCH_INSTRUCTIONS}, # Static, part of the cacheable prefix
+            {"type": "text", "text": "Messages:\n" + "\n".join(message_blocks)},
+        ]
 
+        guild_id = items[0][0].guild.id
+        expected_ids = {str(message.id) for message, _, _, _ in items}
+        decisions, model = await self.request_verdict(guild_id, user_prompt_content_list, BATCH_VERDICT_TOKENS * len(items),
+                                                      lambda content: parse_batch_decisions(content, expected_ids))
+        if decisions is not None:
+            print(f"Batched AI Analysis Received: {len(decisions)}/{len(items)} verdicts for guild {guild_id} from {model}")
+        return decisions, model
+
+    # --- Hedged Requests ---
+    def get_hedge_delay(self, settings: GuildSettings, model: str) -> float:
+        """Seconds to wait for the primary model before also asking the backup: the guild's override, else the model's p90 latency."""
+        try:
+            override_ms = settings.get("HEDGE_DELAY_MS")
+            if override_ms is not None:
+                return max(0.0, float(override_ms) / 1000)
+        except (TypeError, ValueError):
+            pass
+        stats = self.model_stats.get(model)
+        if stats is None or len(stats["latencies"]) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        latencies = sorted(stats["latencies"])
+        p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+        return min(max(p90, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def _model_stats(self, model: str) -> dict:
+        return self.model_stats.setdefault(model, {"requests": 0, "completed": 0, "failures": 0, "wins": 0, "hedged": 0,
+                                                   "cancelled": 0, "latencies": deque(maxlen=HEDGE_LATENCY_SAMPLES)})
+
+    async def request_verdict(self, guild_id: int, user_prompt_content_list: list, max_tokens: int, parse, stream: bool = False):
+        """
+        Sends a moderation request and returns (`parse(response text)`, model that answered). If the guild has
+        a backup model and the primary has not produced a valid verdict within the hedge delay, the same request
+        also goes to the backup; the first valid verdict wins and the other request is cancelled. With `stream`,
+        single-message verdicts use structured output and stop reading at the first clean verdict.
+        """
+        settings = guild_settings.get(guild_id)
+        primary = settings.ai_model or OPENROUTER_MODEL
+        backup = settings.get("BACKUP_AI_MODEL", DEFAULT_BACKUP_MODEL)
+
+        async def attempt(model: str):
+            stats = self._model_stats(model)
+            stats["requests"] += 1
+            started = time.monotonic()
+            use_structured = stream and self.structured_output_supported(model)
+            if use_structured:
+                result, unsupported = await self.stream_moderation_verdict(guild_id, user_prompt_content_list, max_tokens, model)
+                if unsupported:
+                    self.structured_unsupported[model] = time.monotonic() + STRUCTURED_RETRY_AFTER
+                    print(f"Model {model} rejected structured output; using plain requests for it for the next {STRUCTURED_RETRY_AFTER}s.")
+                    use_structured = False
+            if not use_structured:
+                content = await self.post_moderation_request(guild_id, user_prompt_content_list, max_tokens, model=model)
+                result = parse(content) if content else None
+            stats["completed"] += 1
+            if result is None:
+                stats["failures"] += 1 # Fast failures (4xx, empty reply) would drag the hedge p90 down
+            else:
+                stats["latencies"].append(time.monotonic() - started)
+            return result
+
+        if not backup or backup == primary:
+            return await attempt(primary), primary
+
+        tasks = {asyncio.create_task(attempt(primary)): primary}
+        try:
+            pending = set(tasks)
+            done, pending = await asyncio.wait(pending, timeout=self.get_hedge_delay(settings, primary))
+            if not done or self._task_result(next(iter(done))) is None:
+                # Primary is slow (or already failed): race the same request on the backup model
+                self._model_stats(primary)["hedged"] += 1
+                print(f"Moderation request on {primary} not answered after the hedge delay; also asking {backup}.")
+                backup_task = asyncio.create_task(attempt(backup))
+                tasks[backup_task] = backup
+                pending.add(backup_task)
+            else:
+                pending = set()
+            for task in done:
+                result = self._task_result(task)
+                if result is not None:
+                    self._model_stats(tasks[task])["wins"] += 1
+                    return result, tasks[task]
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = self._task_result(task)
+                    if result is not None:
+                        self._model_stats(tasks[task])["wins"] += 1
+                        return result, tasks[task]
+            return None, primary
+        finally:
+            for task, model in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    self._model_stats(model)["cancelled"] += 1
+
+    def structured_output_supported(self, model: str) -> bool:
+        retry_at = self.structured_unsupported.get(model)
+        if retry_at is None:
+            return True
+        if time.monotonic() >= retry_at:
+            del self.structured_unsupported[model] # Expired; try structured output again
+            return True
+        return False
+
+    @staticmethod
+    def _task_result(task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
+
+    async def post_moderation_request(self, guild_id: int, user_prompt_content_list: list, max_tokens: int = 1000, model: str = None):
+        """Sends one moderation request with the shared system prompt. Returns the response text, or None on error."""
+        # Check again in case the cog loaded but the key was invalid/placeholder
+        if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
+            print("Error: OpenRouter API Key (from AI_API_KEY env var) is not configured correctly.")
+            return None
+
+        # Get guild-specific model if configured, otherwise use default
+        model_to_use = model or get_guild_config(guild_id, "AI_MODEL", OPENROUTER_MODEL)
+        headers, payload = self.build_moderation_request(model_to_use, user_prompt_content_list, max_tokens)
+
+        response_text = ""
         try:
             print(f"Querying OpenRouter model {model_to_use}...")
-            async with self.session.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=60) as response: # Added timeout
+            # Moderation is served before chat traffic; 429/5xx are retried by the scheduler
+            async with get_llm_scheduler(self.bot).request(self.session, "POST", OPENROUTER_API_URL, priority=PRIORITY_MODERATION, guild_id=guild_id,
+                                                           headers=headers, json=payload, timeout=60) as response: # Added timeout
                 response_text = await response.text() # Get raw text for debugging
                 # print(f"OpenRouter Raw Response Status: {response.status}")
                 # print(f"OpenRouter Raw Response Body: {response_text[:1000]}...") # Print first 1000 chars
@@ -481,42 +854,13 @@ Now, analyze the provided message content based on the rules and instructions gi
                 response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
 
                 result = await response.json()
+                self.record_prompt_usage(model_to_use, result.get("usage"))
                 ai_response_content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
 
                 if not ai_response_content:
                     print("Error: AI response content is empty.")
                     return None
-
-                # Attempt to parse the JSON response from the AI
-                try:
-                    # Clean potential markdown code blocks
-                    if ai_response_content.startswith("```json"):
-                        ai_response_content = ai_response_content.strip("```json\n").strip("`\n ")
-                    elif ai_response_content.startswith("```"):
-                         ai_response_content = ai_response_content.strip("```\n").strip("`\n ")
-
-                    ai_decision = json.loads(ai_response_content)
-
-                    # Basic validation of the parsed JSON structure
-                    if not isinstance(ai_decision, dict):
-                         print(f"Error: AI response is not a JSON object. Response: {ai_response_content}")
-                         return None
-                    if not all(k in ai_decision for k in ["violation", "rule_violated", "reasoning", "action"]):
-                        print(f"Error: AI response missing expected keys. Response: {ai_response_content}")
-                        return None
-                    if not isinstance(ai_decision.get("violation"), bool):
-                        print(f"Error: 'violation' key is not a boolean. Response: {ai_response_content}")
-                        return None # Or attempt to coerce/fix
-
-                    print(f"AI Analysis Received: {ai_decision}")
-                    return ai_decision
-
-                except json.JSONDecodeError as e:
-                    print(f"Error: Could not decode JSON response from AI: {e}. Response: {ai_response_content}")
-                    return None
-                except Exception as e:
-                    print(f"Error parsing AI response structure: {e}. Response: {ai_response_content}")
-                    return None
+                return ai_response_content
 
         except aiohttp.ClientResponseError as e:
             print(f"Error calling OpenRouter API (HTTP {e.status}): {e.message}")
@@ -525,21 +869,238 @@ Now, analyze the provided message content based on the rules and instructions gi
         except aiohttp.ClientError as e:
             print(f"Error calling OpenRouter API (Connection/Client Error): {e}")
             return None
-        except TimeoutError:
+        except (TimeoutError, asyncio.TimeoutError):
              print("Error: Request to OpenRouter API timed out.")
              return None
         except Exception as e:
             # Catch any other unexpected errors during the API call
-            print(f"An unexpected error occurred during action execution for message {message.id}: {e}")
+            print(f"An unexpected error occurred during the OpenRouter request for guild {guild_id}: {e}")
             return None
 
+    def build_moderation_request(self, model_to_use: str, user_prompt_content_list: list, max_tokens: int):
+        """(headers, payload) for a moderation request: the shared cacheable prefix followed by the per-message parts."""
+        # Structure the request payload for OpenRouter
+        headers = {
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+            # Optional: Add Referer and X-Title headers as recommended by OpenRouter
+            # "HTTP-Referer": "YOUR_SITE_URL", # Replace with your bot's project URL if applicable
+            # "X-Title": "Your Bot Name", # Replace with your bot's name
+        }
+        if model_to_use.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+            system_content = [{"type": "text", "text": MODERATION_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        else:
+            system_content = MODERATION_SYSTEM_PROMPT
+        payload = {
+            "model": model_to_use,
+            "messages": [
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": user_prompt_content_list}
+            ],
+            "usage": {"include": True}, # Ask OpenRouter for token usage, including cached prompt tokens
+            "max_tokens": max_tokens, # Adjust as needed, ensure it's enough for the JSON response
+            "temperature": 0.2, # Lower temperature for more deterministic moderation responses
+            # Enforce JSON output if the model supports it (some models use tool/function calling)
+            # "response_format": {"type": "json_object"} # Uncomment if model supports this parameter
+        }
+        return headers, payload
+
+    async def stream_moderation_verdict(self, guild_id: int, user_prompt_content_list: list, max_tokens: int, model_to_use: str):
+        """
+        Requests a schema-constrained verdict as a stream and parses it while it arrives. Returns as soon as
+        `"violation": false` has been read (the stream is closed without waiting for the reasoning), otherwise
+        parses the full object. Returns (decision or None, unsupported) where `unsupported` means the model
+        rejected the structured-output request (the error body names response_format/json_schema) and the
+        caller should retry without it.
+        """
+        if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
+            print("Error: OpenRouter API Key (from AI_API_KEY env var) is not configured correctly.")
+            return None, False
+        headers, payload = self.build_moderation_request(model_to_use, user_prompt_content_list, max_tokens)
+        payload["stream"] = True
+        payload["response_format"] = MODERATION_RESPONSE_FORMAT
+        started = time.monotonic()
+        try:
+            print(f"Streaming structured verdict from OpenRouter model {model_to_use}...")
+            async with get_llm_scheduler(self.bot).request(self.session, "POST", OPENROUTER_API_URL, priority=PRIORITY_MODERATION, guild_id=guild_id,
+                                                           headers=headers, json=payload, timeout=60) as response:
+                if response.status >= 400:
+                    body = await response.text()
+                    print(f"Error calling OpenRouter API for a structured verdict (HTTP {response.status}): {body[:500]}")
+                    # Only a rejection of the schema itself disables structured output (not oversized prompts or transient 400s)
+                    return None, response.status in (400, 404, 422) and bool(STRUCTURED_ERROR_PATTERN.search(body))
+                self.stream_stats["streamed"] += 1
+                accumulator = ChatStreamAccumulator()
+                scanner = IncrementalJSONObject()
+                async for chunk in iter_sse_json(response):
+                    values = scanner.feed(accumulator.add(chunk))
+                    if values.get("violation") is False:
+                        # Clean verdict: stop reading, the remaining reasoning does not change anything
+                        response.close()
+                        self.stream_stats["early_exits"] += 1
+                        self.stream_stats["verdict_time"] += time.monotonic() - started
+                        decision = {
+                            "violation": False,
+                            "rule_violated": values.get("rule_violated", "None"),
+                            "reasoning": values.get("reasoning", "Clean verdict (stream closed early)."),
+                            "action": values.get("action", "IGNORE"),
+                        }
+                        print(f"AI Analysis Received (early exit): {decision}")
+                        return decision, False
+                    if scanner.complete:
+                        break
+                self.record_prompt_usage(model_to_use, accumulator.usage)
+                if accumulator.error:
+                    print(f"OpenRouter reported an error mid-stream: {accumulator.error}")
+                    return None, False
+                self.stream_stats["full_parses"] += 1
+                self.stream_stats["verdict_time"] += time.monotonic() - started
+                if not accumulator.content:
+                    print("Error: AI response content is empty.")
+                    return None, False
+                return parse_ai_decision(accumulator.content), False
+        except aiohttp.ClientError as e:
+            print(f"Error streaming from OpenRouter API (Connection/Client Error): {e}")
+            return None, False
+        except (TimeoutError, asyncio.TimeoutError):
+            print("Error: Streaming request to OpenRouter API timed out.")
+            return None, False
+        except Exception as e:
+            print(f"An unexpected error occurred during the streamed OpenRouter request for guild {guild_id}: {e}")
+            return None, False
+
+    def record_prompt_usage(self, model: str, usage: dict, tier: str = "full"):
+        """Track prompt and cached-token counts per model so the prompt cache savings can be checked in /modstats."""
+        if not isinstance(usage, dict):
+            return
+        tier_stats = self.tier_stats[tier]
+        tier_stats["cost"] += usage.get("cost") or 0.0
+        tier_stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        tier_stats["completion_tokens"] += usage.get("completion_tokens") or 0
+        stats = self.prompt_usage.setdefault(model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cache_discount": 0.0})
+        details = usage.get("prompt_tokens_details") or {}
+        stats["requests"] += 1
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["cached_tokens"] += details.get("cached_tokens") or 0
+        stats["completion_tokens"] += usage.get("completion_tokens") or 0
+        stats["cache_discount"] += usage.get("cache_discount") or 0.0
+
+    # --- Model Cascade ---
+    def get_triage_settings(self, guild_config: GuildSettings):
+        """(triage model or None, suspicion threshold) for this guild."""
+        model = guild_config.get("TRIAGE_AI_MODEL", DEFAULT_TRIAGE_MODEL)
+        try:
+            threshold = float(guild_config.get("TRIAGE_THRESHOLD", DEFAULT_TRIAGE_THRESHOLD))
+        except (TypeError, ValueError):
+            threshold = DEFAULT_TRIAGE_THRESHOLD
+        return model or None, threshold
+
+    async def triage_message(self, message: discord.Message, message_content: str, infraction_count: int, nsfw_channel: bool, model: str):
+        """Scores a message with the small triage model. Returns the suspicion (0-1), or None if the request failed."""
+        headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": TRIAGE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Channel NSFW: {'yes' if nsfw_channel else 'no'}. Author's prior infractions: {infraction_count}.\n"
+                                            f"Message:\n{message_content[:2000]}"},
+            ],
+            "usage": {"include": True},
+            "max_tokens": TRIAGE_MAX_TOKENS,
+            "temperature": 0,
+        }
+        stats = self.tier_stats["triage"]
+        stats["requests"] += 1
+        started = time.monotonic()
+        try:
+            async with get_llm_scheduler(self.bot).request(self.session, "POST", OPENROUTER_API_URL, priority=PRIORITY_MODERATION,
+                                                           guild_id=message.guild.id, headers=headers, json=payload, timeout=TRIAGE_TIMEOUT) as response:
+                response.raise_for_status()
+                result = await response.json()
+            self.record_prompt_usage(model, result.get("usage"), tier="triage")
+            score = parse_triage_score(result.get("choices", [{}])[0].get("message", {}).get("content", ""))
+        except (aiohttp.ClientError, TimeoutError, asyncio.TimeoutError) as e:
+            print(f"Triage request to {model} failed for message {message.id}: {e}")
+            score = None
+        except Exception as e:
+            print(f"Unexpected error during triage for message {message.id}: {e}")
+            score = None
+        stats["latency"] += time.monotonic() - started
+        if score is None:
+            stats["failures"] += 1
+        return score
+
+    # --- Micro-Batching ---
+    def get_batch_settings(self, guild_config: GuildSettings):
+        """(window in seconds, max messages) for this guild; a window of 0 means batching is off."""
+        try:
+            window_ms = int(guild_config.get("BATCH_WINDOW_MS", DEFAULT_BATCH_WINDOW_MS))
+            max_messages = int(guild_config.get("BATCH_MAX_MESSAGES", DEFAULT_BATCH_MAX_MESSAGES))
+        except (TypeError, ValueError):
+            window_ms, max_messages = DEFAULT_BATCH_WINDOW_MS, DEFAULT_BATCH_MAX_MESSAGES
+        return max(0, window_ms) / 1000, max(1, max_messages)
+
+    async def moderate_batched(self, message: discord.Message, message_content: str, user_history: str, window: float, max_messages: int):
+        """Adds the message to its guild's pending batch and waits for its (verdict, model) (same result as query_openrouter)."""
+        guild_id = message.guild.id
+        batch = self.pending_batches.get(guild_id)
+        if batch is None:
+            batch = PendingModerationBatch()
+            self.pending_batches[guild_id] = batch
+            batch.timer = asyncio.create_task(self._flush_batch_after(guild_id, batch, window))
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append((message, message_content, user_history, future))
+        if len(batch.items) >= max_messages:
+            # Full: send now instead of waiting for the window to close
+            self.pending_batches.pop(guild_id, None)
+            batch.timer.cancel()
+            self._start_batch(batch)
+        return await future
+
+    def _start_batch(self, batch: PendingModerationBatch):
+        task = asyncio.create_task(self._run_batch(batch))
+        self.batch_tasks[task] = batch
+        task.add_done_callback(lambda done: self.batch_tasks.pop(done, None))
+
+    async def _flush_batch_after(self, guild_id: int, batch: PendingModerationBatch, delay: float):
+        await asyncio.sleep(delay)
+        if self.pending_batches.get(guild_id) is batch:
+            del self.pending_batches[guild_id]
+            self._start_batch(batch) # Tracked separately, so cancelling the timer never abandons a batch in flight
+
+    async def _run_batch(self, batch: PendingModerationBatch):
+        """Sends the batch and resolves every waiting message; verdicts missing from the reply are retried one by one."""
+        items = batch.items
+        decisions = {}
+        models = {} # message id -> model that produced its verdict
+        try:
+            if len(items) > 1:
+                batch_decisions, batch_model = await self.query_openrouter_batch(items)
+                decisions = batch_decisions or {}
+                models = {message_id: batch_model for message_id in decisions}
+                self.batch_stats["batches"] += 1
+                self.batch_stats["batched_messages"] += len(items)
+            missing = [item for item in items if str(item[0].id) not in decisions]
+            if missing and len(items) > 1:
+                self.batch_stats["fallback_messages"] += len(missing)
+                print(f"Batch for guild {items[0][0].guild.id} returned no verdict for {len(missing)}/{len(items)} messages; falling back to per-message requests.")
+            results = await asyncio.gather(*(self.query_openrouter(message, content, history) for message, content, history, _ in missing))
+            for (message, _, _, _), (result, model) in zip(missing, results):
+                decisions[str(message.id)] = result
+                models[str(message.id)] = model
+        except Exception as e:
+            print(f"Error running moderation batch: {e}")
+        finally:
+            for message, _, _, future in items:
+                if not future.done():
+                    future.set_result((decisions.get(str(message.id)), models.get(str(message.id))))
+
     async def handle_violation(self, message: discord.Message, ai_decision: dict):
         """
         Takes action based on the AI's violation decision.
         Also transmits action info via HTTP POST with API key header.
         """
         import datetime
-        import aiohttp
 
         rule_violated = ai_decision.get("rule_violated", "Unknown")
         reasoning = ai_decision.get("reasoning", "No reasoning provided.")
@@ -552,11 +1113,13 @@ Now, analyze the provided message content based on the rules and instructions gi
         mod_ping = moderator_role.mention if moderator_role else f"Moderators (Role ID {moderator_role_id} not found)"
 
         current_timestamp_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        # Get the model from guild config, fall back to global default
+        model_used = get_guild_config(guild_id, "AI_MODEL", OPENROUTER_MODEL)
 
-        # --- Transmit action info over HTTP POST ---
+        # --- Queue action info for the dashboard ---
+        # Delivered by the outbox worker (batched, retried with backoff), so enforcement never waits on the dashboard
         try:
-            mod_log_api_secret = os.getenv("MOD_LOG_API_SECRET")
-            if mod_log_api_secret:
+            if os.getenv("MOD_LOG_API_SECRET"):
                 post_url = f"https://slipstreamm.dev/dashboard/api/guilds/{guild_id}/ai-moderation-action"
                 payload = {
                     "timestamp": current_timestamp_iso,
@@ -577,20 +1140,11 @@ Now, analyze the provided message content based on the rules and instructions gi
                     "ai_model": model_used,
                     "result": "pending_system_action" # Indicates AI decision received, system action pending
                 }
-                headers = {
-                    "Authorization": f"Bearer {mod_log_api_secret}",
-                    "Content-Type": "application/json"
-                }
-                async with aiohttp.ClientSession() as http_session: # Renamed session to avoid conflict
-                    async with http_session.post(post_url, headers=headers, json=payload, timeout=10) as resp:
-                        # This payload is just for the initial AI decision log
-                        # The actual outcome will be logged after the action is performed
-                        if resp.status >= 400:
-                             print(f"Failed to POST initial AI decision log: {resp.status}")
+                self.dashboard_outbox.enqueue(post_url, payload)
             else:
                 print("MOD_LOG_API_SECRET not set; skipping initial action POST.")
         except Exception as e:
-            print(f"Failed to POST initial action info: {e}")
+            print(f"Failed to queue initial action info: {e}")
 
         # --- Prepare Notification ---
         notification_embed = discord.Embed(
@@ -607,8 +1161,6 @@ Now, analyze the provided message content based on the rules and instructions gi
         # Log message content and attachments for audit purposes
         msg_content = message.content if message.content else "*No text content*"
         notification_embed.add_field(name="Message Content", value=msg_content[:1024], inline=False)
-        # Get the model from guild config, fall back to global default
-        model_used = get_guild_config(guild_id, "AI_MODEL", OPENROUTER_MODEL)
         notification_embed.set_footer(text=f"AI Model: {model_used}")
         notification_embed.timestamp = discord.utils.utcnow() # Using discord.utils.utcnow() which is still supported
 
@@ -799,21 +1351,134 @@ Now, analyze the provided message content based on the rules and instructions gi
                     print("FATAL: Bot lacks permission to send messages, even error notifications.")
 
 
-    @commands.Cog.listener(name="on_message")
-    async def message_listener(self, message: discord.Message):
-        """Listens to messages and triggers moderation checks."""
-        # --- Basic Checks ---
-        # Ignore messages from bots (including self)
-        if message.author.bot:
+    def get_risk_threshold(self, guild_config: GuildSettings) -> float:
+        try:
+            return float(guild_config.get("RISK_THRESHOLD", DEFAULT_RISK_THRESHOLD))
+        except (TypeError, ValueError):
+            return DEFAULT_RISK_THRESHOLD
+
+    async def log_shadow_audit(self, message: discord.Message, risk):
+        """Append a skipped message to the shadow audit log so the pre-filter can be checked against the AI later."""
+        record = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "guild_id": message.guild.id,
+            "channel_id": message.channel.id,
+            "message_id": message.id,
+            "author_id": message.author.id,
+            "score": round(risk.score, 2),
+            "reasons": risk.reasons,
+            "content": message.content[:1000],
+        }
+        def write():
+            with _shadow_audit_lock:
+                try:
+                    if os.path.getsize(SHADOW_AUDIT_PATH) >= SHADOW_AUDIT_MAX_BYTES:
+                        os.replace(SHADOW_AUDIT_PATH, SHADOW_AUDIT_PATH + ".1") # Bounded retention: current file + one older
+                except FileNotFoundError:
+                    pass
+                with open(SHADOW_AUDIT_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write)
+        except Exception as e:
+            print(f"Failed to write shadow audit record to {SHADOW_AUDIT_PATH}: {e}")
+
+    @app_commands.command(name="modstats", description="Show AI moderation pre-filter statistics (admin only).")
+    async def modstats(self, interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=True)
             return
+        await interaction.response.send_message(embed=self.build_modstats_embed(interaction.guild.id), ephemeral=True)
+
+    def build_modstats_embed(self, guild_id: int) -> discord.Embed:
+        stats = self.prefilter_stats
+        embed = discord.Embed(title="AI Moderation Stats", color=discord.Color.orange())
+        skipped_rate = stats["skipped"] / stats["checked"] if stats["checked"] else 0
+        embed.add_field(
+            name="Risk Pre-Filter",
+            value=f"{stats['checked']} checked, {stats['skipped']} skipped without an API call ({skipped_rate:.0%}), "
+                  f"{stats['escalated']} sent to the AI ({stats['severe']} severe)\n"
+                  f"Threshold here: {self.get_risk_threshold(guild_settings.get(guild_id)) or 'off (set RISK_THRESHOLD to enable)'}, "
+                  f"{stats['sampled']} skipped messages sampled for audit",
+            inline=False)
+        batches = self.batch_stats
+        window, max_messages = self.get_batch_settings(guild_settings.get(guild_id))
+        avg_size = batches["batched_messages"] / batches["batches"] if batches["batches"] else 0
+        embed.add_field(
+            name="Micro-Batching",
+            value=(f"Window here: {window * 1000:.0f} ms, up to {max_messages} messages\n" if window else "Off in this guild\n") +
+                  f"{batches['batches']} batches, {batches['batched_messages']} messages (avg {avg_size:.1f} per request), "
+                  f"{batches['fallback_messages']} retried individually",
+            inline=False)
+        cache = self.verdict_cache
+        embed.add_field(
+            name="Verdict Cache",
+            value=f"{len(cache)}/{cache.maxsize} entries, {cache.hits} hits / {cache.misses} misses ({cache.hit_rate:.0%} hit rate)\n"
+                  f"{self.verdict_cache_history_bypass} cached violations re-analyzed for repeat offenders, "
+                  f"prompt version `{MODERATION_PROMPT_VERSION}`",
+            inline=False)
+        usage_lines = []
+        for model, usage in self.prompt_usage.items():
+            cached_share = usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0
+            usage_lines.append(f"`{model}`: {usage['requests']} requests, {usage['prompt_tokens']} prompt tokens, "
+                               f"{usage['cached_tokens']} cached ({cached_share:.0%})" +
+                               (f", cache discount {usage['cache_discount']:.4f}" if usage["cache_discount"] else ""))
+        embed.add_field(name="Prompt Cache", value="\n".join(usage_lines) if usage_lines else "No requests yet", inline=False)
+        model_lines = []
+        for model, stats in self.model_stats.items():
+            latencies = sorted(stats["latencies"])
+            p50 = latencies[len(latencies) // 2] if latencies else 0
+            p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))] if latencies else 0
+            model_lines.append(f"`{model}`: {stats['requests']} requests, p50 {p50:.1f}s / p90 {p90:.1f}s, {stats['failures']} failed, "
+                               f"hedged {stats['hedged']}, won {stats['wins']}, cancelled {stats['cancelled']}")
+        settings = guild_settings.get(guild_id)
+        backup = settings.get("BACKUP_AI_MODEL", DEFAULT_BACKUP_MODEL)
+        hedge_text = f"Backup here: `{backup}` after {self.get_hedge_delay(settings, settings.ai_model or OPENROUTER_MODEL):.1f}s" if backup else "Hedging off in this guild"
+        embed.add_field(name="Models & Hedging", value=hedge_text + ("\n" + "\n".join(model_lines) if model_lines else ""), inline=False)
+        streams = self.stream_stats
+        finished = streams["early_exits"] + streams["full_parses"]
+        embed.add_field(
+            name="Structured Output",
+            value=("On" if is_enabled(guild_settings.get(guild_id).get("STRUCTURED_OUTPUT", DEFAULT_STRUCTURED_OUTPUT)) else "Off") + " in this guild\n" +
+                  f"{streams['streamed']} streamed, {streams['early_exits']} closed early on a clean verdict, {streams['full_parses']} read in full, "
+                  f"avg time to verdict {(streams['verdict_time'] / finished if finished else 0):.1f}s" +
+                  (f"\nNo structured output (retried later): {', '.join(sorted(self.structured_unsupported))}" if self.structured_unsupported else ""),
+            inline=False)
+        triage_model, triage_threshold = self.get_triage_settings(guild_settings.get(guild_id))
+        cascade = self.cascade_stats
+        screened = cascade["cleared"] + cascade["escalated"]
+        tier_lines = []
+        for tier, tier_stats in self.tier_stats.items():
+            requests = tier_stats["requests"]
+            tier_lines.append(f"{tier.capitalize()}: {requests} requests, avg {(tier_stats['latency'] / requests if requests else 0):.2f}s, "
+                              f"{tier_stats['failures']} failed, {tier_stats['prompt_tokens']}+{tier_stats['completion_tokens']} tokens, "
+                              f"cost {tier_stats['cost']:.4f}")
+        embed.add_field(
+            name="Model Cascade",
+            value=(f"Triage here: `{triage_model}`, escalate at suspicion >= {triage_threshold}\n" if triage_model else "Cascade off in this guild\n") +
+                  f"{screened} screened, {cascade['escalated']} escalated ({(cascade['escalated'] / screened if screened else 0):.0%}), "
+                  f"{cascade['cleared']} cleared, {cascade['severe_bypass']} severe sent straight to the full model\n" + "\n".join(tier_lines),
+            inline=False)
+        outbox = self.dashboard_outbox.stats()
+        embed.add_field(
+            name="Dashboard Outbox",
+            value=f"{outbox['depth']} queued (oldest {outbox['oldest_pending_s']:.0f}s), {outbox['dead_rows']} dead\n"
+                  f"{outbox['delivered']} delivered, lag avg {outbox['avg_lag_s']:.1f}s / max {outbox['max_lag_s']:.1f}s, "
+                  f"{outbox['failed_attempts']} failed attempts",
+            inline=False)
+        return embed
+
+    async def handle_message(self, facts: MessageFacts):
+        """Message handler registered with the bot's MessageDispatcher; triggers moderation checks."""
+        message = facts.message
+        guild_config = facts.guild_config # Snapshot taken once by the dispatcher
+        # --- Basic Checks ---
+        # Bots, DMs and the bot's own messages are filtered out by the dispatcher
         # Ignore messages without content
         if not message.content:
              return
-        # Ignore DMs
-        if not message.guild:
-            return
         # Check if moderation is enabled for this guild
-        if not get_guild_config(message.guild.id, "ENABLED", True):
+        if not guild_config.enabled:
             return
 
         # --- Suicidal Content Check ---
@@ -824,21 +1489,19 @@ Now, analyze the provided message content based on the rules and instructions gi
         # If Rule 6 violations should also go through AI and progressive discipline, this logic would need to move.
         common_prefixes = ('!', '?', '.', '$', '%', '/', '-')
         is_likely_bot_command = message.content.startswith(common_prefixes)
-        bot_commands_channel_ids = get_guild_config(message.guild.id, "BOT_COMMANDS_CHANNEL_ID", [])
-        if isinstance(bot_commands_channel_ids, int): # Ensure it's a list
-            bot_commands_channel_ids = [bot_commands_channel_ids]
+        bot_commands_channel_ids = guild_config.bot_commands_channel_ids # frozenset
 
         # Check if the current channel is NOT a bot command channel
         # AND the message is likely a bot command
         # AND the message is not in the suggestions channel (if suggestions can also have commands)
-        suggestions_channel_id = get_guild_config(message.guild.id, "SUGGESTIONS_CHANNEL_ID")
+        suggestions_channel_id = guild_config.suggestions_channel_id
 
         if is_likely_bot_command and \
            message.channel.id not in bot_commands_channel_ids and \
            message.channel.id != suggestions_channel_id:
             try:
                 # await message.delete()
-                bot_commands_channel_mention = f"<#{bot_commands_channel_ids[0]}>" if bot_commands_channel_ids else "the designated bot commands channel"
+                bot_commands_channel_mention = f"<#{min(bot_commands_channel_ids)}>" if bot_commands_channel_ids else "the designated bot commands channel"
                 await message.channel.send(
                     f"{message.author.mention}, please use bot commands only in {bot_commands_channel_mention} (Rule 6).",
                     delete_after=20
@@ -865,22 +1528,75 @@ Now, analyze the provided message content based on the rules and instructions gi
         if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
              return
 
-        # Prepare user history for the AI
-        infractions = get_user_infraction_history(message.guild.id, message.author.id)
-        history_summary_parts = []
-        if infractions:
-            for infr in infractions:
-                history_summary_parts.append(f"- Action: {infr.get('action_taken', 'N/A')} for Rule {infr.get('rule_violated', 'N/A')} on {infr.get('timestamp', 'N/A')[:10]}. Reason: {infr.get('reasoning', 'N/A')[:50]}...")
-        user_history_summary = "\n".join(history_summary_parts) if history_summary_parts else "No prior infractions recorded."
-
-        # Limit history summary length to prevent excessively long prompts
-        max_history_len = 500
-        if len(user_history_summary) > max_history_len:
-            user_history_summary = user_history_summary[:max_history_len-3] + "..."
-
+        # Prepare user history for the AI (count and summary are cached per user by the infraction store)
+        infraction_count, user_history_summary = get_user_history_summary(message.guild.id, message.author.id)
+
+        # --- Local Risk Pre-Filter ---
+        # Clearly benign messages are marked clean without an API call. Self-harm and minor-related terms always go to the AI.
+        risk = assess_message(
+            message_content,
+            mention_count=len(message.mentions),
+            role_mention_count=len(message.role_mentions),
+            mentions_everyone=message.mention_everyone,
+            attachment_count=len(message.attachments),
+            embed_count=len(message.embeds),
+            sticker_count=len(message.stickers),
+            infraction_count=infraction_count,
+        )
+        self.prefilter_stats["checked"] += 1
+        if not risk.needs_llm(self.get_risk_threshold(guild_config)):
+            self.prefilter_stats["skipped"] += 1
+            if random.random() < SHADOW_AUDIT_SAMPLE_RATE:
+                self.prefilter_stats["sampled"] += 1
+                await self.log_shadow_audit(message, risk)
+            return
+        self.prefilter_stats["escalated"] += 1
+        if risk.severe:
+            self.prefilter_stats["severe"] += 1
+
+        # --- Verdict Cache ---
+        model_to_use = guild_config.ai_model or OPENROUTER_MODEL
+        is_nsfw_channel = getattr(message.channel, "is_nsfw", lambda: False)()
+        cache_key = verdict_cache_key(message_content, model_to_use, is_nsfw_channel)
+        cached = self.verdict_cache.get(cache_key)
+        if cached is not MISSING:
+            cached_decision, analyzed_without_history = cached
+            if not cached_decision.get("violation"):
+                print(f"Cached verdict for message {message.id}: no violation.")
+                return
+            if analyzed_without_history and not infraction_count:
+                print(f"Cached verdict for message {message.id}: rule {cached_decision.get('rule_violated')}.")
+                await self.handle_violation(message, dict(cached_decision))
+                return
+            self.verdict_cache_history_bypass += 1
+
+        # --- Model Cascade ---
+        # A small model screens the message first; only suspicious ones get the full rules prompt.
+        triage_model, triage_threshold = self.get_triage_settings(guild_config)
+        if triage_model and risk.severe:
+            self.cascade_stats["severe_bypass"] += 1 # Never let the small model clear self-harm or minor-related messages
+        elif triage_model:
+            suspicion = await self.triage_message(message, message_content, infraction_count, is_nsfw_channel, triage_model)
+            if suspicion is not None and suspicion < triage_threshold:
+                self.cascade_stats["cleared"] += 1
+                # Not cached: the verdict cache holds full-model verdicts, shared with guilds that have no cascade
+                # or a stricter threshold
+                print(f"Triage cleared message {message.id} (suspicion {suspicion:.2f} < {triage_threshold}).")
+                return
+            self.cascade_stats["escalated"] += 1
 
         print(f"Analyzing message {message.id} from {message.author} in #{message.channel.name} with history...")
-        ai_decision = await self.query_openrouter(message, message_content, user_history_summary)
+        batch_window, batch_max_messages = self.get_batch_settings(guild_config)
+        full_stats = self.tier_stats["full"]
+        full_stats["requests"] += 1
+        started = time.monotonic()
+        if batch_window:
+            ai_decision, answered_model = await self.moderate_batched(message, message_content, user_history_summary, batch_window, batch_max_messages)
+        else:
+            ai_decision, answered_model = await self.query_openrouter(message, message_content, user_history_summary)
+        full_stats["latency"] += time.monotonic() - started
+        if not ai_decision:
+            full_stats["failures"] += 1
 
         # --- Process AI Decision ---
         if not ai_decision:
@@ -888,6 +1604,12 @@ Now, analyze the provided message content based on the rules and instructions gi
             # Optionally notify mods about AI failure if it happens often
             return # Stop if AI fails or returns invalid data
 
+        if not ai_decision.get("violation") or not infraction_count:
+            # Keyed on the model that actually answered (the backup, if hedging picked it)
+            if answered_model and answered_model != model_to_use:
+                cache_key = verdict_cache_key(message_content, answered_model, is_nsfw_channel)
+            self.verdict_cache.set(cache_key, (dict(ai_decision), not infraction_count))
+
         # Check if the AI flagged a violation
         if ai_decision.get("violation"):
             # Handle the violation based on AI decision without overrides
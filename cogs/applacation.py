@@ -1,11 +1,11 @@
 import discord
 from discord.ext import commands
+from utils.guild_settings import guild_settings
 
 class ApplicationCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        # This will store the Google Forms link for applications.
-        self.apply_link = None
+        # Each guild's Google Forms link is stored as APPLY_LINK in the guild settings service.
 
     # --------------------------------------------------------------------------
     # Set Application Link Command
@@ -14,7 +14,10 @@ class ApplicationCog(commands.Cog):
     @commands.has_permissions(administrator=True)
     async def setap(self, ctx, link: str):
         # Optionally, add basic validation for the link here.
-        self.apply_link = link
+        if ctx.guild is None:
+            await ctx.send("This command can only be used in a server.")
+            return
+        guild_settings.set(ctx.guild.id, "APPLY_LINK", link)
         await ctx.send(f"Application link has been set to:\n{link}")
 
     # --------------------------------------------------------------------------
@@ -23,7 +26,10 @@ class ApplicationCog(commands.Cog):
     @commands.hybrid_command(name="clearap", help="Clear the currently set Google Forms link for applications.")
     @commands.has_permissions(administrator=True)
     async def clearap(self, ctx):
-        self.apply_link = None
+        if ctx.guild is None:
+            await ctx.send("This command can only be used in a server.")
+            return
+        guild_settings.unset(ctx.guild.id, "APPLY_LINK")
         await ctx.send("Application link has been cleared.")
 
     # --------------------------------------------------------------------------
@@ -31,14 +37,15 @@ class ApplicationCog(commands.Cog):
     # --------------------------------------------------------------------------
     @commands.hybrid_command(name="apply", help="Receive the application link via DM.")
     async def apply(self, ctx):
-        if self.apply_link is None:
+        apply_link = guild_settings.get(ctx.guild.id).apply_link if ctx.guild else None
+        if apply_link is None:
             await ctx.send("No application link has been set yet. Please contact an administrator.")
             return
 
         try:
             # Attempt to create or fetch the user's DM channel
             dm_channel = await ctx.author.create_dm()
-            await dm_channel.send(f"Here is your application link:\n{self.apply_link}")
+            await dm_channel.send(f"Here is your application link:\n{apply_link}")
             await ctx.send("I've sent the application link to your DMs.")
         except Exception as e:
             await ctx.send(f"Unable to DM you the application link: {e}")
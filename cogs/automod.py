@@ -1,6 +1,8 @@
 import discord
 from discord.ext import commands
 from datetime import datetime, timedelta
+from utils.dispatch import MessageFacts, STOP, get_message_dispatcher
+from utils.aho_corasick import WordFilter
 
 # Interactive dropdown to view current Automod configuration
 class ConfigSelect(discord.ui.Select):
@@ -27,6 +29,7 @@ class ConfigSelect(discord.ui.Select):
         if self.values[0] == "Filtered Words":
             filtered = self.cog.filtered_words
             content = "Current filtered words:\n" + "\n".join(filtered) if filtered else "No words are currently filtered."
+            content += f"\n\nMatching: {'whole words only' if self.cog.match_whole_words else 'anywhere in the message'}"
             embed = discord.Embed(
                 title="Filtered Words Configuration",
                 description=content,
@@ -67,6 +70,11 @@ class AutoModConfigCog(commands.Cog):
         self.bot = bot
         # Example default configuration.
         self.filtered_words = ["badword1", "badword2"]
+        self.match_whole_words = False # True = "ass" does not match "class"
+        # The word list is compiled into a WordFilter once per version; bump the version (set_filtered_words) after editing it
+        self.word_list_version = 0
+        self._word_filter = None
+        self._word_filter_version = None
         self.punishment_settings = {
             "Warning": True,             # Send a warning DM.
             "Message Deletion": True,      # Delete the message.
@@ -74,16 +82,35 @@ class AutoModConfigCog(commands.Cog):
             "Ban": False                 # Ban is disabled by default.
         }
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        # Ignore messages from bots or outside a guild.
-        if message.author.bot or not message.guild:
-            return
-
-        # Check if the message contains any of the filtered words.
-        message_lower = message.content.lower()
-        if not any(word.lower() in message_lower for word in self.filtered_words):
+    async def cog_load(self):
+        # Runs first so a deleted message never reaches moderation analysis or an AI reply
+        get_message_dispatcher(self.bot).register("automod", self.handle_message, priority=10, guild_only=True, include_commands=True)
+
+    async def cog_unload(self):
+        get_message_dispatcher(self.bot).unregister("automod")
+
+    def set_filtered_words(self, words, match_whole_words=None):
+        """Replace the word list (and optionally the matching mode); the filter is recompiled on the next message."""
+        self.filtered_words = list(words)
+        if match_whole_words is not None:
+            self.match_whole_words = match_whole_words
+        self.word_list_version += 1
+
+    def get_word_filter(self) -> WordFilter:
+        if self._word_filter is None or self._word_filter_version != self.word_list_version:
+            self._word_filter = WordFilter(self.filtered_words, whole_words=self.match_whole_words)
+            self._word_filter_version = self.word_list_version
+        return self._word_filter
+
+    async def handle_message(self, facts: MessageFacts):
+        # Bots and DMs are filtered out by the dispatcher.
+        message = facts.message
+
+        # Check if the message contains any of the filtered words (one pass, whatever the list size).
+        matched_word = self.get_word_filter().find(message.content)
+        if matched_word is None:
             return  # No issue detected; do nothing.
+        print(f"Automod: message {message.id} from {message.author} matched filtered word '{matched_word}'.")
 
         actions_taken = []
 
@@ -128,8 +155,10 @@ class AutoModConfigCog(commands.Cog):
         # if mod_log:
         #     await mod_log.send(f"Automod actions on {message.author.mention}: {', '.join(actions_taken)}")
 
-        # Ensure other commands get processed.
-        await self.bot.process_commands(message)
+        # Commands are processed once by the bot's default on_message.
+        # A deleted message should not get moderation analysis or an AI reply.
+        if "Message Deleted" in actions_taken:
+            return STOP
 
     @commands.hybrid_group(name="automod", invoke_without_command=True, help="Automod command group. Use /automod config to configure automod settings.")
     async def automod(self, ctx):
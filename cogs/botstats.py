@@ -0,0 +1,89 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+from utils.http_client import get_http_client
+from utils.llm_scheduler import get_llm_scheduler
+from utils.dispatch import get_message_dispatcher
+
+class BotStats(commands.Cog):
+    """Admin commands that show bot-wide runtime statistics (HTTP pool, LLM scheduler, message dispatch)."""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @app_commands.command(name="httpstats", description="Show shared HTTP connection pool statistics (admin only).")
+    async def httpstats(self, interaction: discord.Interaction):
+        if interaction.guild is None or not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=True)
+            return
+
+        stats = get_http_client(self.bot).stats()
+        embed = discord.Embed(title="HTTP Connection Pool", color=discord.Color.blurple())
+        embed.add_field(name="Requests", value=f"{stats['requests']} ({stats['request_errors']} errors)", inline=True)
+        embed.add_field(name="Connections", value=f"{stats['connections_in_use']} in use / {stats['connections_idle']} idle", inline=True)
+        embed.add_field(name="Limits", value=f"{stats['limit']} total, {stats['limit_per_host']} per host", inline=True)
+        embed.add_field(
+            name="Reuse",
+            value=f"{stats['connections_reused']} reused / {stats['connections_created']} new ({stats['reuse_rate']:.0%})\n"
+                  f"Avg new connection: {stats['avg_connect_ms']:.0f} ms",
+            inline=False
+        )
+        embed.add_field(
+            name="Pool Waits",
+            value=f"{stats['pool_waits']} waits, avg {stats['avg_pool_wait_ms']:.1f} ms, max {stats['max_pool_wait_ms']:.1f} ms",
+            inline=False
+        )
+        idle_hosts = "\n".join(f"`{host}`: {count}" for host, count in sorted(stats["idle_per_host"].items())) or "None"
+        embed.add_field(name="Idle Connections per Host", value=idle_hosts[:1024], inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="llmstats", description="Show LLM request queue and rate limit statistics (admin only).")
+    async def llmstats(self, interaction: discord.Interaction):
+        if interaction.guild is None or not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=True)
+            return
+
+        stats = get_llm_scheduler(self.bot).stats()
+        embed = discord.Embed(title="LLM Scheduler", color=discord.Color.blurple())
+        embed.add_field(name="In Flight", value=f"{stats['active']} / {stats['max_concurrency']}", inline=True)
+        embed.add_field(name="Queued", value=f"{stats['queued']} requests from {stats['queued_guilds']} guild queues", inline=True)
+        embed.add_field(
+            name="Rate Limit",
+            value=f"{stats['rate_per_second']:g}/s, burst {stats['burst']} ({stats['tokens']:.1f} tokens left)"
+                  + (f"\nPaused for {stats['paused_for']:.1f}s (Retry-After)" if stats["paused_for"] else ""),
+            inline=False
+        )
+        embed.add_field(
+            name="Provider Errors",
+            value=f"{stats['throttled']} x 429, {stats['server_errors']} x 5xx, {stats['retries']} retries, {stats['gave_up']} gave up",
+            inline=False
+        )
+        for name, p in stats["priorities"].items():
+            embed.add_field(
+                name=name.title(),
+                value=f"{p['granted']} sent, {p['queued']} queued\nWait avg {p['avg_wait_ms']:.0f} ms, max {p['max_wait_ms']:.0f} ms",
+                inline=True
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="dispatchstats", description="Show per-handler message processing times (admin only).")
+    async def dispatchstats(self, interaction: discord.Interaction):
+        if interaction.guild is None or not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("You must be an administrator to use this command.", ephemeral=True)
+            return
+
+        stats = get_message_dispatcher(self.bot).stats()
+        embed = discord.Embed(title="Message Dispatch", color=discord.Color.blurple())
+        embed.add_field(name="Messages", value=f"{stats['messages']} dispatched, avg {stats['avg_build_ms']:.2f} ms to build shared facts", inline=False)
+        for handler in stats["handlers"]:
+            embed.add_field(
+                name=f"{handler['priority']}. {handler['name']}" + (" (background)" if handler["background"] else ""),
+                value=f"{handler['calls']} calls, avg {handler['avg_ms']:.1f} ms, max {handler['max_ms']:.0f} ms\n"
+                      f"{handler['stops']} stopped the chain, {handler['errors']} errors",
+                inline=False
+            )
+        if not stats["handlers"]:
+            embed.description = "No message handlers registered."
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(BotStats(bot))
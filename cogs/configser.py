@@ -3,10 +3,20 @@ import json
 import discord
 from discord.ext import commands
 from discord import app_commands
+from utils.guild_settings import guild_settings
 
-# Set the directory for server configuration files.
+# Directory of the old per-guild configuration files, imported once into the guild settings service.
 CONFIG_DIR = "/home/server/serverconfig"
 
+def load_legacy_server_configs() -> dict:
+    legacy = {}
+    for filename in os.listdir(CONFIG_DIR):
+        stem, ext = os.path.splitext(filename)
+        if ext == ".json" and stem.isdigit():
+            with open(os.path.join(CONFIG_DIR, filename), 'r') as f:
+                legacy[int(stem)] = {"DISABLED_COMMANDS": json.load(f).get("disabled", [])}
+    return legacy
+
 # A custom Select component. Each option represents one command.
 class CommandSelect(discord.ui.Select):
     def __init__(self, options):
@@ -28,7 +38,7 @@ class CommandBlockView(discord.ui.View):
         # Build options for the select menu.
         options = []
         # Get the set of currently blocked commands for this guild.
-        blocked_cmds = self.cog.disabled_commands.get(guild_id, set())
+        blocked_cmds = guild_settings.get(guild_id).disabled_commands
         for cmd in commands_list:
             options.append(discord.SelectOption(
                 label=cmd,
@@ -48,9 +58,8 @@ class CommandBlockView(discord.ui.View):
 
         # The selected values indicate the commands to block.
         selected = self.select.values
-        self.cog.disabled_commands[self.guild_id] = set(selected)
-        # Save the updated settings to file.
-        self.cog.save_config(self.guild_id)
+        # Saved (only this guild's file) by the guild settings service.
+        guild_settings.set(self.guild_id, "DISABLED_COMMANDS", sorted(selected))
         # Rebuild the embed to reflect the changes.
         embed = self.cog.create_settings_embed(self.guild_id)
         await interaction.response.edit_message(embed=embed, view=self)
@@ -58,41 +67,8 @@ class CommandBlockView(discord.ui.View):
 class ServerSettings(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # This dictionary maps guild IDs to a set of command names that are blocked.
-        self.disabled_commands = {}
-
-        # Ensure the config directory exists.
-        os.makedirs(CONFIG_DIR, exist_ok=True)
-
-    def config_filepath(self, guild_id: int) -> str:
-        """Return the configuration file path for a given guild."""
-        return os.path.join(CONFIG_DIR, f"{guild_id}.json")
-
-    def load_config(self, guild_id: int):
-        """Load the configuration for the guild from its JSON file."""
-        filepath = self.config_filepath(guild_id)
-        try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                disabled = set(data.get("disabled", []))
-                self.disabled_commands[guild_id] = disabled
-        except FileNotFoundError:
-            # If no config exists, use an empty set.
-            self.disabled_commands[guild_id] = set()
-        except Exception as e:
-            print(f"Error loading config for guild {guild_id}: {e}")
-            self.disabled_commands[guild_id] = set()
-
-    def save_config(self, guild_id: int):
-        """Save the guild's configuration to its JSON file."""
-        filepath = self.config_filepath(guild_id)
-        data = {"disabled": list(self.disabled_commands.get(guild_id, set()))}
-        try:
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            print(f"Error saving config for guild {guild_id}: {e}")
+        # Blocked commands are stored per guild as DISABLED_COMMANDS in the guild settings service.
+        guild_settings.import_legacy("serverconfig", load_legacy_server_configs)
 
     def get_all_commands(self) -> list[str]:
         """Returns a sorted list of non-hidden command names from the bot."""
@@ -101,7 +77,7 @@ class ServerSettings(commands.Cog):
     def create_settings_embed(self, guild_id: int) -> discord.Embed:
         """Create an embed listing each command with its current status (Blocked/Allowed)."""
         all_commands = self.get_all_commands()
-        blocked = self.disabled_commands.get(guild_id, set())
+        blocked = guild_settings.get(guild_id).disabled_commands
         description_lines = [
             f"**{cmd}**: {'Blocked' if cmd in blocked else 'Allowed'}" 
             for cmd in all_commands
@@ -129,9 +105,6 @@ class ServerSettings(commands.Cog):
             return
 
         guild_id = interaction.guild.id
-        # Load the configuration for this guild if it hasn't been loaded already.
-        if guild_id not in self.disabled_commands:
-            self.load_config(guild_id)
         all_commands = self.get_all_commands()
         embed = self.create_settings_embed(guild_id)
         view = CommandBlockView(self, guild_id, all_commands)
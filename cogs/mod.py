@@ -1,12 +1,12 @@
 import discord
 from discord.ext import commands
 from datetime import datetime, timedelta
+from utils.guild_settings import guild_settings
 
 class ModCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        # This will store the user who receives reports.
-        self.report_recipient = None  
+        # Each guild's report recipient is stored as REPORT_RECIPIENT_ID in the guild settings service.
 
     # --------------------------------------------------------------------------
     # Kick Command
@@ -95,7 +95,10 @@ class ModCog(commands.Cog):
     @commands.hybrid_command(name="setreport", help="Set the user that will receive reports (usage: /setreport @User).")
     @commands.has_permissions(administrator=True)
     async def setreport(self, ctx, user: discord.User):
-        self.report_recipient = user
+        if ctx.guild is None:
+            await ctx.send("This command can only be used in a server.")
+            return
+        guild_settings.set(ctx.guild.id, "REPORT_RECIPIENT_ID", user.id)
         await ctx.send(f"Report recipient has been set to {user.mention}")
 
     # --------------------------------------------------------------------------
@@ -103,10 +106,12 @@ class ModCog(commands.Cog):
     # --------------------------------------------------------------------------
     @commands.hybrid_command(name="report", help="Report a user. This command sends a DM to the designated report recipient.")
     async def report(self, ctx, user: discord.User, *, reason: str = "No reason provided"):
-        if self.report_recipient is None:
+        recipient_id = guild_settings.get(ctx.guild.id).report_recipient_id if ctx.guild else None
+        if recipient_id is None:
             await ctx.send("No report recipient has been set yet. Please ask an administrator to set one using /setreport.")
             return
         try:
+            report_recipient = self.bot.get_user(recipient_id) or await self.bot.fetch_user(recipient_id)
             report_message = (
                 f"**Report Received**\n"
                 f"**Reported by:** {ctx.author.mention}\n"
@@ -115,7 +120,7 @@ class ModCog(commands.Cog):
                 f"**Server:** {ctx.guild.name}\n"
                 f"**Channel:** {ctx.channel.name}"
             )
-            await self.report_recipient.send(report_message)
+            await report_recipient.send(report_message)
             await ctx.send("Your report has been submitted successfully.")
         except Exception as e:
             await ctx.send(f"Failed to submit your report: {e}")
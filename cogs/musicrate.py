@@ -2,10 +2,11 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import lyricsgenius
-import aiohttp
 import os
 from dotenv import load_dotenv
 import asyncio
+from utils.http_client import get_http_client
+from utils.llm_scheduler import get_llm_scheduler, PRIORITY_CHAT
 
 # Load environment variables from absolute path
 load_dotenv("/home/server/keys.env")
@@ -36,7 +37,7 @@ class MusicRateCog(commands.Cog):
                 await interaction.followup.send(f"Couldn't find lyrics for '{song}'.")
                 return
 
-            rating = await self.rate_song(lyrics)
+            rating = await self.rate_song(lyrics, interaction.guild_id)
             if not rating or rating == "Issue with rating request.":
                 await interaction.followup.send("Couldn't get a rating from the AI.")
                 return
@@ -55,7 +56,7 @@ class MusicRateCog(commands.Cog):
             print(f"Error fetching lyrics: {e}")
             return "Error fetching lyrics."
 
-    async def rate_song(self, lyrics: str) -> str:
+    async def rate_song(self, lyrics: str, guild_id: int = None) -> str:
         ai_url = "https://api.openrouter.ai/v1/chat/completions"
         payload = {
             "model": "google/gemma-7b-it:free",
@@ -80,14 +81,15 @@ class MusicRateCog(commands.Cog):
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(ai_url, json=payload, headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data["choices"][0]["message"]["content"]
-                    else:
-                        print(f"AI API error: {response.status}")
-                        return "Issue with rating request."
+            session = get_http_client(self.bot).session
+            async with get_llm_scheduler(self.bot).request(session, "POST", ai_url, priority=PRIORITY_CHAT, guild_id=guild_id,
+                                                           json=payload, headers=headers, timeout=30) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data["choices"][0]["message"]["content"]
+                else:
+                    print(f"AI API error: {response.status}")
+                    return "Issue with rating request."
         except Exception as e:
             print(f"Error rating song: {e}")
             return "Issue with rating request."
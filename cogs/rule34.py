@@ -8,6 +8,8 @@ import aiohttp
 import time
 import json
 import typing # Need this for Optional
+from utils.persistence import persister
+from utils.http_client import get_http_client
 
 # Cache file path (consider making this configurable or relative to bot root)
 CACHE_FILE = "rule34_cache.json"
@@ -16,6 +18,11 @@ class Rule34Cog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.cache_data = self._load_cache()
+        # Entries are replaced rather than mutated, so a shallow copy is a safe snapshot
+        persister.register("rule34_cache", CACHE_FILE, lambda: dict(self.cache_data), indent=4)
+
+    async def cog_unload(self):
+        await persister.flush(["rule34_cache"])
 
     def _load_cache(self):
         """Loads the Rule34 cache from a JSON file."""
@@ -28,12 +35,8 @@ class Rule34Cog(commands.Cog):
         return {}
 
     def _save_cache(self):
-        """Saves the Rule34 cache to a JSON file."""
-        try:
-            with open(CACHE_FILE, "w") as f:
-                json.dump(self.cache_data, f, indent=4)
-        except Exception as e:
-            print(f"Failed to save Rule34 cache file ({CACHE_FILE}): {e}")
+        """Queues the Rule34 cache to be written to its JSON file."""
+        persister.mark_dirty("rule34_cache")
 
     # Updated _rule34_logic
     async def _rule34_logic(self, interaction_or_ctx, tags: str, hidden: bool = False) -> typing.Union[str, tuple]:
@@ -87,56 +90,56 @@ class Rule34Cog(commands.Cog):
 
         # If no valid cache or cache is outdated, fetch from API
         all_results = [] # Reset results if cache was invalid/outdated
-        async with aiohttp.ClientSession() as session:
-            try:
-                while True:
-                    params = {
-                        "page": "dapi", "s": "post", "q": "index",
-                        "limit": 1000, "pid": current_pid, "tags": tags, "json": 1
-                    }
-                    async with session.get(base_url, params=params) as response:
-                        if response.status == 200:
-                            try:
-                                data = await response.json()
-                            except aiohttp.ContentTypeError:
-                                print(f"Rule34 API returned non-JSON response for tags: {tags}, pid: {current_pid}")
-                                data = None # Treat as no data
-
-                            if not data or (isinstance(data, list) and len(data) == 0):
-                                break  # No more results or empty response
-                            if isinstance(data, list):
-                                all_results.extend(data)
-                            else:
-                                print(f"Unexpected API response format (not list): {data}")
-                                break # Stop processing if format is wrong
-                            current_pid += 1
+        session = get_http_client(self.bot).session
+        try:
+            while True:
+                params = {
+                    "page": "dapi", "s": "post", "q": "index",
+                    "limit": 1000, "pid": current_pid, "tags": tags, "json": 1
+                }
+                async with session.get(base_url, params=params) as response:
+                    if response.status == 200:
+                        try:
+                            data = await response.json()
+                        except aiohttp.ContentTypeError:
+                            print(f"Rule34 API returned non-JSON response for tags: {tags}, pid: {current_pid}")
+                            data = None # Treat as no data
+
+                        if not data or (isinstance(data, list) and len(data) == 0):
+                            break  # No more results or empty response
+                        if isinstance(data, list):
+                            all_results.extend(data)
                         else:
-                            # Return error message, ephemeral handled by caller
-                            return f"Failed to fetch data. HTTP Status: {response.status}"
-
-                # Save results to cache if new results were fetched
-                if all_results: # Only save if we actually got results
-                    self.cache_data[cache_key] = { # Use normalized key
-                        "timestamp": int(time.time()),
-                        "results": all_results
-                    }
-                    self._save_cache()
-
-                # Handle results
-                if not all_results:
-                    # Return error message, ephemeral handled by caller
-                    return "No results found for the given tags."
-                else:
-                    random_result = random.choice(all_results)
-                    result_content = f"{random_result['file_url']}"
-                    # Always return the data. The caller handles sending/editing.
-                    return (result_content, all_results) # Success, return both random and all results
-
-            except Exception as e:
-                error_msg = f"An error occurred: {e}"
-                print(f"Error in rule34 logic: {e}") # Log the error
+                            print(f"Unexpected API response format (not list): {data}")
+                            break # Stop processing if format is wrong
+                        current_pid += 1
+                    else:
+                        # Return error message, ephemeral handled by caller
+                        return f"Failed to fetch data. HTTP Status: {response.status}"
+
+            # Save results to cache if new results were fetched
+            if all_results: # Only save if we actually got results
+                self.cache_data[cache_key] = { # Use normalized key
+                    "timestamp": int(time.time()),
+                    "results": all_results
+                }
+                self._save_cache()
+
+            # Handle results
+            if not all_results:
                 # Return error message, ephemeral handled by caller
-                return error_msg
+                return "No results found for the given tags."
+            else:
+                random_result = random.choice(all_results)
+                result_content = f"{random_result['file_url']}"
+                # Always return the data. The caller handles sending/editing.
+                return (result_content, all_results) # Success, return both random and all results
+
+        except Exception as e:
+            error_msg = f"An error occurred: {e}"
+            print(f"Error in rule34 logic: {e}") # Log the error
+            # Return error message, ephemeral handled by caller
+            return error_msg
 
     class Rule34Buttons(View):
         def __init__(self, cog, tags: str, all_results: list, hidden: bool = False):
@@ -0,0 +1,2 @@
+# utils/__init__.py
+# Shared helpers used by the cogs. This package is NOT loaded as a cog by bot.py.
@@ -0,0 +1,141 @@
+# utils/aho_corasick.py
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Digits/symbols commonly used in place of letters (same set as the risk pre-filter)
+LEET_MAP = {"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"}
+
+# Look-alike letters from other scripts that NFKD does not fold to ASCII (Cyrillic and Greek)
+CONFUSABLES_MAP = {
+    "\u0430": "a", "\u0432": "b", "\u0441": "c", "\u0435": "e", "\u0451": "e", "\u04bb": "h", "\u0456": "i", "\u0458": "j",
+    "\u043a": "k", "\u043c": "m", "\u043d": "h", "\u043e": "o", "\u0440": "p", "\u0442": "t", "\u0443": "y", "\u0445": "x",
+    "\u0455": "s", "\u0501": "d", "\u051b": "q", "\u051d": "w",
+    "\u03b1": "a", "\u03b2": "b", "\u03b5": "e", "\u03b7": "n", "\u03b9": "i", "\u03ba": "k", "\u03bd": "v", "\u03bf": "o",
+    "\u03c1": "p", "\u03c4": "t", "\u03c5": "u", "\u03c7": "x", "\u03c9": "w",
+}
+
+# Invisible characters used to split a word without changing how it looks
+ZERO_WIDTH = ("\u200b", "\u200c", "\u200d", "\u2060", "\ufeff", "\u00ad")
+
+_CONFUSABLES_TABLE = {ord(k): v for k, v in CONFUSABLES_MAP.items()}
+_CONFUSABLES_TABLE.update({ord(c): None for c in ZERO_WIDTH})
+_LEET_TABLE = dict(_CONFUSABLES_TABLE)
+_LEET_TABLE.update({ord(k): v for k, v in LEET_MAP.items()})
+
+
+def normalize_text(text: str, leet: bool = True) -> str:
+    """Casefolded text with accents stripped (NFKD), confusable letters folded and, optionally, leetspeak undone."""
+    if text.isascii(): # Most chat messages; nothing to decompose or fold
+        return text.lower().translate(_LEET_TABLE) if leet else text.lower()
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.translate(_LEET_TABLE if leet else _CONFUSABLES_TABLE)
+
+
+# Below this many terms, per-term str.find (C speed) beats walking the automaton in Python
+SMALL_LIST_SIZE = 64
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class WordFilter:
+    """
+    Aho-Corasick automaton over a word list: one pass over the message finds every listed term,
+    however many terms there are.
+
+    Terms and messages go through the same normalization (see `normalize_text`), so "BadWord",
+    "b@dw0rd" and Cyrillic look-alikes all match "badword". With `whole_words`, a match must not
+    be part of a longer word. Matches report the term as it was written in the list.
+    """
+
+    def __init__(self, terms: Iterable[str], whole_words: bool = False, leet: bool = True):
+        self.whole_words = whole_words
+        self.leet = leet
+        self.terms: List[str] = [] # Original spelling, indexed by pattern id
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()] # Pattern ids ending at each node (including via fail links)
+        self._lengths: List[int] = [] # Normalized length of each pattern
+
+        self._patterns: List[str] = []
+        seen = set()
+        for term in terms:
+            normalized = normalize_text(term.strip(), leet)
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            self._add(normalized, term.strip())
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    # --- Construction ---
+    def _add(self, pattern: str, term: str):
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = nxt
+        self._output[node] += (len(self.terms),)
+        self.terms.append(term)
+        self._patterns.append(pattern)
+        self._lengths.append(len(pattern))
+
+    def _build(self):
+        """Breadth-first pass setting each node's failure link and merging the outputs of its suffixes."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] += self._output[self._fail[child]]
+
+    # --- Matching ---
+    def _scan(self, text: str):
+        """Yields (pattern id, start, end) over the normalized text, in order of end position."""
+        goto, fail, output, lengths = self._goto, self._fail, self._output, self._lengths
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_id in output[node]:
+                start = index - lengths[pattern_id] + 1
+                if self.whole_words and ((start > 0 and _is_word_char(text[start - 1])) or
+                                         (index + 1 < len(text) and _is_word_char(text[index + 1]))):
+                    continue
+                yield pattern_id, start, index + 1
+
+    def find(self, text: str) -> Optional[str]:
+        """The first listed term found in `text`, or None."""
+        if not self.terms or not text:
+            return None
+        if len(self.terms) <= SMALL_LIST_SIZE and not self.whole_words:
+            normalized = normalize_text(text, self.leet)
+            for pattern_id, pattern in enumerate(self._patterns):
+                if pattern in normalized:
+                    return self.terms[pattern_id]
+            return None
+        for pattern_id, _, _ in self._scan(normalize_text(text, self.leet)):
+            return self.terms[pattern_id]
+        return None
+
+    def find_all(self, text: str) -> List[Tuple[str, int, int]]:
+        """Every (term, start, end) match; positions refer to the normalized text."""
+        if not self.terms or not text:
+            return []
+        return [(self.terms[pattern_id], start, end) for pattern_id, start, end in self._scan(normalize_text(text, self.leet))]
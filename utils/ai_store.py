@@ -0,0 +1,284 @@
+# utils/ai_store.py
+import argparse
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from utils.fact_index import normalize_fact
+from utils.history_journal import HistoryJournal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_facts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    fact TEXT NOT NULL,
+    fact_key TEXT NOT NULL -- normalize_fact(fact), the same key the in-memory fact index uses
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_facts_user_key ON user_facts (user_id, fact_key);
+
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_user ON history (user_id, id);
+
+CREATE TABLE IF NOT EXISTS history_summaries (
+    user_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL -- rolling summary of messages that were removed from history
+);
+
+CREATE TABLE IF NOT EXISTS manual_context (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS dynamic_learning (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS user_configs (
+    user_id TEXT PRIMARY KEY,
+    config TEXT NOT NULL -- JSON object with the user's overrides
+);
+"""
+
+
+class AIStore:
+    """
+    SQLite storage for AICog memory, history, manual context, dynamic learning and configs.
+
+    Runs in WAL mode with autocommit, so every add_* call is a single indexed insert
+    instead of a whole-file rewrite.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, isolation_level=None) # Autocommit; explicit BEGIN for batches
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, avoids an fsync per insert
+        self.conn.executescript(SCHEMA)
+        self._rekey_user_facts()
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self) -> bool:
+        """True if nothing has been stored yet (used to decide whether to import the JSON files)."""
+        for table in ("user_facts", "history", "manual_context", "dynamic_learning", "user_configs"):
+            if self.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    # --- User facts ---
+    def _rekey_user_facts(self):
+        """Older databases keyed facts on lower(); move them to normalize_fact, dropping rows that become duplicates."""
+        stale = [(row_id, user_id, fact) for row_id, user_id, fact, key in
+                 self.conn.execute("SELECT id, user_id, fact, fact_key FROM user_facts ORDER BY id") if key != normalize_fact(fact)]
+        if not stale:
+            return
+        self.conn.execute("BEGIN")
+        try:
+            for row_id, user_id, fact in stale:
+                key = normalize_fact(fact)
+                if self.conn.execute("SELECT 1 FROM user_facts WHERE user_id = ? AND fact_key = ? AND id != ?", (user_id, key, row_id)).fetchone():
+                    self.conn.execute("DELETE FROM user_facts WHERE id = ?", (row_id,))
+                else:
+                    self.conn.execute("UPDATE user_facts SET fact_key = ? WHERE id = ?", (key, row_id))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def get_user_facts(self, user_id: str) -> List[str]:
+        rows = self.conn.execute("SELECT fact FROM user_facts WHERE user_id = ? ORDER BY id", (str(user_id),))
+        return [row[0] for row in rows]
+
+    def add_user_fact(self, user_id: str, fact: str) -> bool:
+        """Insert a fact; returns False if the user already has it (same normalize_fact key)."""
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO user_facts (user_id, fact, fact_key) VALUES (?, ?, ?)",
+            (str(user_id), fact, normalize_fact(fact)),
+        )
+        return cur.rowcount > 0
+
+    def replace_user_fact(self, user_id: str, old_fact: str, new_fact: str) -> bool:
+        """Reword a stored fact in place (keeps its position); returns False if it could not be updated."""
+        try:
+            cur = self.conn.execute(
+                "UPDATE user_facts SET fact = ?, fact_key = ? WHERE user_id = ? AND fact_key = ?",
+                (new_fact, normalize_fact(new_fact), str(user_id), normalize_fact(old_fact)),
+            )
+        except sqlite3.IntegrityError:
+            return False # The new wording is already stored
+        return cur.rowcount > 0
+
+    def count_users_with_facts(self) -> int:
+        return self.conn.execute("SELECT COUNT(DISTINCT user_id) FROM user_facts").fetchone()[0]
+
+    # --- History ---
+    def get_user_history(self, user_id: str, limit: int) -> List[Dict[str, str]]:
+        rows = self.conn.execute(
+            "SELECT role, content FROM (SELECT id, role, content FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (str(user_id), limit),
+        )
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def get_user_history_rows(self, user_id: str, limit: int) -> List[Tuple[int, Dict[str, str]]]:
+        """Like get_user_history, with each message's row id (so exactly those rows can be deleted later)."""
+        rows = self.conn.execute(
+            "SELECT id, role, content FROM (SELECT id, role, content FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+            (str(user_id), limit),
+        )
+        return [(row_id, {"role": role, "content": content}) for row_id, role, content in rows]
+
+    def add_history_messages(self, user_id: str, messages: List[Dict[str, str]]):
+        if len(messages) == 1:
+            self.conn.execute(
+                "INSERT INTO history (user_id, role, content) VALUES (?, ?, ?)",
+                (str(user_id), messages[0]["role"], messages[0]["content"]),
+            )
+            return
+        with self.conn: # One transaction for the whole turn
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT INTO history (user_id, role, content) VALUES (?, ?, ?)",
+                [(str(user_id), m["role"], m["content"]) for m in messages],
+            )
+
+    def prune_history(self, max_messages: int) -> int:
+        """Delete everything but the newest `max_messages` rows per user. Returns rows deleted."""
+        cur = self.conn.execute(
+            """DELETE FROM history WHERE id IN (
+                   SELECT id FROM (
+                       SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id DESC) AS rn FROM history
+                   ) WHERE rn > ?
+               )""",
+            (max_messages,),
+        )
+        return cur.rowcount
+
+    def delete_history_rows(self, user_id: str, row_ids: List[int]) -> int:
+        """Delete the given history rows of a user (the ones that were summarized). Returns rows deleted."""
+        deleted = 0
+        for start in range(0, len(row_ids), 500): # Stay well below SQLite's bound-parameter limit
+            chunk = row_ids[start:start + 500]
+            cur = self.conn.execute(
+                f"DELETE FROM history WHERE user_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                (str(user_id), *chunk),
+            )
+            deleted += cur.rowcount
+        return deleted
+
+    def get_history_summary(self, user_id: str) -> str:
+        row = self.conn.execute("SELECT summary FROM history_summaries WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else ""
+
+    def set_history_summary(self, user_id: str, summary: str):
+        self.conn.execute(
+            "INSERT INTO history_summaries (user_id, summary) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary",
+            (str(user_id), summary),
+        )
+
+    # --- Manual context / dynamic learning ---
+    def get_manual_context(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT text FROM manual_context ORDER BY id")]
+
+    def add_manual_context(self, text: str) -> bool:
+        return self.conn.execute("INSERT OR IGNORE INTO manual_context (text) VALUES (?)", (text,)).rowcount > 0
+
+    def get_dynamic_learning(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT text FROM dynamic_learning ORDER BY id")]
+
+    def add_dynamic_learning(self, text: str) -> bool:
+        return self.conn.execute("INSERT OR IGNORE INTO dynamic_learning (text) VALUES (?)", (text,)).rowcount > 0
+
+    # --- User configs ---
+    def get_user_config(self, user_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT config FROM user_configs WHERE user_id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_user_config(self, user_id: str, config: Dict):
+        self.conn.execute(
+            "INSERT INTO user_configs (user_id, config) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET config = excluded.config",
+            (str(user_id), json.dumps(config)),
+        )
+
+    # --- One-shot JSON import ---
+    def import_json_files(self, memory_path: str, history_path: str, manual_context_path: str,
+                          dynamic_learning_path: str, config_path: str, max_history_messages: int = 20) -> Dict[str, int]:
+        """
+        Import the JSON files used by the JSON backend. Safe to re-run: facts, context entries and
+        configs that already exist are skipped, and history is only imported for users without any.
+        Returns the number of rows imported per table.
+        """
+        counts = {"user_facts": 0, "history": 0, "manual_context": 0, "dynamic_learning": 0, "user_configs": 0}
+
+        def read_json(path, default):
+            if path and os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            return default
+
+        memory = read_json(memory_path, {})
+        manual_context = read_json(manual_context_path, [])
+        dynamic_learning = read_json(dynamic_learning_path, [])
+        configs = read_json(config_path, {})
+        # The journal loader understands both snapshot layouts and replays pending journal records
+        history = HistoryJournal(history_path).load(max_history_messages) if history_path else {}
+
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for user_id, facts in memory.items():
+                for fact in facts:
+                    fact = str(fact).strip()
+                    if fact:
+                        counts["user_facts"] += self.conn.execute(
+                            "INSERT OR IGNORE INTO user_facts (user_id, fact, fact_key) VALUES (?, ?, ?)",
+                            (str(user_id), fact, normalize_fact(fact)),
+                        ).rowcount
+            for user_id, messages in history.items():
+                if self.conn.execute("SELECT 1 FROM history WHERE user_id = ? LIMIT 1", (str(user_id),)).fetchone():
+                    continue
+                rows = [(str(user_id), m["role"], m["content"]) for m in messages[-max_history_messages:]]
+                self.conn.executemany("INSERT INTO history (user_id, role, content) VALUES (?, ?, ?)", rows)
+                counts["history"] += len(rows)
+            for text in manual_context:
+                counts["manual_context"] += self.conn.execute(
+                    "INSERT OR IGNORE INTO manual_context (text) VALUES (?)", (text,)).rowcount
+            for text in dynamic_learning:
+                counts["dynamic_learning"] += self.conn.execute(
+                    "INSERT OR IGNORE INTO dynamic_learning (text) VALUES (?)", (text,)).rowcount
+            for user_id, config in configs.items():
+                counts["user_configs"] += self.conn.execute(
+                    "INSERT OR IGNORE INTO user_configs (user_id, config) VALUES (?, ?)",
+                    (str(user_id), json.dumps(config)),
+                ).rowcount
+        return counts
+
+
+# --- Command line importer ---
+# Usage: python -m utils.ai_store --db ai_data.sqlite3
+# Paths default to the same environment variables AICog uses.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import AICog JSON data files into the SQLite store.")
+    parser.add_argument("--db", default=os.getenv("BOT_AI_DB_PATH", "ai_data.sqlite3"))
+    parser.add_argument("--memory", default=os.getenv("BOT_MEMORY_PATH", "/home/server/wdiscordbot/mind.json"))
+    parser.add_argument("--history", default=os.getenv("BOT_HISTORY_PATH", "ai_conversation_history.json"))
+    parser.add_argument("--manual-context", default=os.getenv("BOT_MANUAL_CONTEXT_PATH", "ai_manual_context.json"))
+    parser.add_argument("--dynamic-learning", default=os.getenv("BOT_DYNAMIC_LEARNING_PATH", "ai_dynamic_learning.json"))
+    parser.add_argument("--configs", default="ai_configs.json")
+    args = parser.parse_args()
+
+    store = AIStore(args.db)
+    imported = store.import_json_files(args.memory, args.history, args.manual_context, args.dynamic_learning, args.configs)
+    store.close()
+    for table, count in imported.items():
+        print(f"{table}: imported {count} rows")
@@ -0,0 +1,217 @@
+# utils/dispatch.py
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import discord
+
+from utils.guild_settings import GuildSettings
+
+STOP = True # Returned by a handler to keep lower-priority handlers from seeing the message
+
+
+class MessageFacts:
+    """Everything the message handlers need to know about a message, computed once."""
+
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self.content: str = message.content or ""
+        self.author_id: int = message.author.id
+        self.is_bot: bool = message.author.bot
+        self.guild = message.guild
+        self.guild_id: Optional[int] = message.guild.id if message.guild else None
+        self.is_dm: bool = message.guild is None
+        self.channel_id: Optional[int] = message.channel.id if message.channel else None
+        self.mentions_bot = False # Direct @mention of the bot (start of message or anywhere in mentions)
+        self.names_bot = False # The bot's name appears as a word
+        self.prompt = self.content # Content with bot mentions removed
+        self.ctx = None # commands.Context from the single get_context call
+        self.is_command = False # A valid prefix command; the bot's own command processing handles it
+        # Immutable GuildSettings snapshot from the config provider; an empty one (all defaults) if there is none
+        self.guild_config: Any = GuildSettings(self.guild_id)
+        self.handled_by: List[str] = [] # Handlers that have run (in order)
+
+
+class _Handler:
+    def __init__(self, name: str, callback: Callable[[MessageFacts], Awaitable[Optional[bool]]], priority: int,
+                 background: bool, include_bots: bool, guild_only: bool, include_commands: bool):
+        self.name = name
+        self.callback = callback
+        self.priority = priority
+        self.background = background
+        self.include_bots = include_bots
+        self.guild_only = guild_only
+        self.include_commands = include_commands
+        # --- Timing ---
+        self.calls = 0
+        self.errors = 0
+        self.stops = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def wants(self, facts: MessageFacts) -> bool:
+        if facts.is_bot and not self.include_bots:
+            return False
+        if facts.is_dm and self.guild_only:
+            return False
+        if facts.is_command and not self.include_commands:
+            return False
+        return True
+
+
+class MessageDispatcher:
+    """
+    Single on_message entry point shared by the listener cogs.
+
+    The dispatcher builds a MessageFacts once per message (bot/DM/guild checks, mention detection,
+    one `bot.get_context` call, guild config snapshot) and passes it to the registered handlers in
+    priority order (lowest number first). A handler returning STOP ends the chain. Background
+    handlers (slow work such as LLM moderation) are started as tasks and never block the chain; they are
+    tracked until they finish, so `drain` / `close` can wait for them. The bot's own messages are never dispatched.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.handlers: List[_Handler] = []
+        self.config_provider: Optional[Callable[[int], Dict[str, Any]]] = None
+        self._mention_pattern: Optional[re.Pattern] = None
+        self._name_pattern: Optional[re.Pattern] = None
+        self._patterns_for: Optional[tuple] = None # (bot user id, bot name) the patterns were built for
+        self._background: Set[asyncio.Task] = set() # Running background handler tasks (strong references)
+        self.messages = 0
+        self.build_time = 0.0
+        bot.add_listener(self.dispatch, "on_message")
+
+    # --- Registration ---
+    def register(self, name: str, callback: Callable[[MessageFacts], Awaitable[Optional[bool]]], priority: int = 50,
+                 background: bool = False, include_bots: bool = False, guild_only: bool = False, include_commands: bool = False):
+        """Add (or replace) a handler. Cogs register in cog_load and unregister in cog_unload."""
+        self.unregister(name)
+        self.handlers.append(_Handler(name, callback, priority, background, include_bots, guild_only, include_commands))
+        self.handlers.sort(key=lambda handler: handler.priority)
+
+    def unregister(self, name: str):
+        self.handlers = [handler for handler in self.handlers if handler.name != name]
+
+    def set_config_provider(self, provider: Optional[Callable[[int], Dict[str, Any]]]):
+        """`provider(guild_id)` returns the guild config snapshot put in MessageFacts.guild_config."""
+        self.config_provider = provider
+
+    # --- Facts ---
+    def _patterns(self):
+        user = self.bot.user
+        key = (user.id, user.name)
+        if self._patterns_for != key:
+            self._mention_pattern = re.compile(rf'<@!?{user.id}>')
+            self._name_pattern = re.compile(rf'\b{re.escape(user.name)}\b', re.IGNORECASE)
+            self._patterns_for = key
+        return self._mention_pattern, self._name_pattern
+
+    def mention_pattern(self) -> re.Pattern:
+        """Compiled `<@bot id>` / `<@!bot id>` pattern."""
+        return self._patterns()[0]
+
+    async def build_facts(self, message: discord.Message) -> MessageFacts:
+        facts = MessageFacts(message)
+        mention_pattern, name_pattern = self._patterns()
+        if mention_pattern.match(facts.content) or self.bot.user in message.mentions:
+            facts.mentions_bot = True
+            facts.prompt = mention_pattern.sub('', facts.content).strip()
+        facts.names_bot = bool(name_pattern.search(facts.content))
+        if not facts.is_bot:
+            facts.ctx = await self.bot.get_context(message)
+            facts.is_command = facts.ctx.valid
+        if facts.guild_id is not None and self.config_provider:
+            try:
+                facts.guild_config = self.config_provider(facts.guild_id)
+            except Exception as e:
+                print(f"Error reading guild config for message dispatch: {e}")
+        return facts
+
+    # --- Dispatch ---
+    async def dispatch(self, message: discord.Message):
+        if self.bot.user is None or message.author.id == self.bot.user.id:
+            return
+        handlers = list(self.handlers) # Registration may change while we await
+        if not handlers:
+            return
+        started = time.perf_counter()
+        facts = await self.build_facts(message)
+        self.build_time += time.perf_counter() - started
+        self.messages += 1
+        for handler in handlers:
+            if not handler.wants(facts):
+                continue
+            if handler.background:
+                task = asyncio.create_task(self._run(handler, facts), name=f"dispatch:{handler.name}")
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                continue
+            if await self._run(handler, facts) is STOP:
+                break
+
+    async def _run(self, handler: _Handler, facts: MessageFacts) -> Optional[bool]:
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await handler.callback(facts)
+        except Exception as e:
+            handler.errors += 1
+            print(f"Message handler '{handler.name}' failed on message {facts.message.id}: {e}")
+        elapsed = time.perf_counter() - started
+        handler.calls += 1
+        handler.total_time += elapsed
+        handler.max_time = max(handler.max_time, elapsed)
+        facts.handled_by.append(handler.name)
+        if result is STOP:
+            handler.stops += 1
+        return result
+
+    # --- Shutdown ---
+    async def drain(self, name: Optional[str] = None, timeout: Optional[float] = None):
+        """Wait for running background handlers (only `name`'s, if given); cancel those still running after `timeout`."""
+        tasks = [task for task in self._background if name is None or task.get_name() == f"dispatch:{name}"]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            print(f"Cancelled {len(pending)} background message handler(s) still running after {timeout}s.")
+
+    async def close(self, timeout: float = 10.0):
+        """Stop dispatching and let in-flight background handlers finish (or cancel them after `timeout`)."""
+        self.bot.remove_listener(self.dispatch, "on_message")
+        await self.drain(timeout=timeout)
+
+    # --- Stats ---
+    def stats(self) -> Dict:
+        """Per-handler timing for logging or the /dispatchstats command."""
+        return {
+            "messages": self.messages,
+            "avg_build_ms": (self.build_time / self.messages * 1000) if self.messages else 0.0,
+            "handlers": [
+                {
+                    "name": handler.name,
+                    "priority": handler.priority,
+                    "background": handler.background,
+                    "calls": handler.calls,
+                    "errors": handler.errors,
+                    "stops": handler.stops,
+                    "avg_ms": (handler.total_time / handler.calls * 1000) if handler.calls else 0.0,
+                    "max_ms": handler.max_time * 1000,
+                }
+                for handler in self.handlers
+            ],
+        }
+
+
+def get_message_dispatcher(bot) -> MessageDispatcher:
+    """Return the bot-wide dispatcher, creating it (and its on_message listener) on first use."""
+    dispatcher = getattr(bot, "message_dispatcher", None)
+    if dispatcher is None:
+        dispatcher = MessageDispatcher(bot)
+        bot.message_dispatcher = dispatcher
+    return dispatcher
@@ -0,0 +1,180 @@
+# utils/fact_index.py
+import hashlib
+import re
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.retrieval import BM25Index
+
+NORMALIZE_PATTERN = re.compile(r"[^a-z0-9\s]+")
+SHINGLE_SIZE = 4 # Character shingles; facts are short, so word shingles would be too coarse
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16 # 16 bands x 4 rows: pairs above ~0.5 similarity almost always share a bucket
+NEAR_DUPLICATE_THRESHOLD = 0.75 # Estimated Jaccard similarity at which two facts can be paraphrases (tokens must also agree)
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_fact(text: str) -> str:
+    """Lower-case, punctuation-free, single-spaced form used for exact duplicate checks."""
+    return " ".join(NORMALIZE_PATTERN.sub(" ", text.lower()).split())
+
+
+# Words that flip a fact's meaning; two facts are only paraphrases if they agree on these
+NEGATIONS = {"not", "no", "never", "nor", "none", "nothing", "without", "cannot", "cant", "dont", "doesnt", "didnt",
+             "isnt", "arent", "wasnt", "werent", "wont", "wouldnt", "hasnt", "havent", "hadnt", "neither"}
+# Function words ignored when comparing content words (inflection aside, everything else must agree)
+STOPWORDS = {"a", "an", "the", "is", "are", "was", "were", "be", "been", "am", "i", "user", "users", "they", "he", "she",
+             "their", "his", "her", "my", "of", "to", "in", "on", "at", "for", "and", "or", "with", "as", "by", "has",
+             "have", "had", "that", "this", "it", "its", "really", "very", "also"}
+
+
+def content_tokens(normalized: str) -> Set[str]:
+    """Content words of a normalized fact (stopwords and negations removed, plural/3rd-person "s" stripped)."""
+    tokens = set()
+    for token in normalized.replace("n t ", "nt ").split():
+        if token in STOPWORDS or token in NEGATIONS:
+            continue
+        tokens.add(token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token)
+    return tokens
+
+
+def is_negated(normalized: str) -> bool:
+    return any(token in NEGATIONS for token in normalized.replace("n t ", "nt ").split())
+
+
+def facts_agree(old_key: str, new_key: str) -> bool:
+    """
+    True if `new_key` restates `old_key` (same negations, and every content word of the old fact still present),
+    so replacing the old wording loses nothing. "blue" vs "green" or "is" vs "is not" never agree.
+    """
+    if is_negated(old_key) != is_negated(new_key):
+        return False
+    return content_tokens(old_key) <= content_tokens(new_key)
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def _permutations(count: int) -> List[Tuple[int, int]]:
+    params = []
+    for i in range(count):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        params.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return params
+
+
+_PERMUTATIONS = _permutations(NUM_PERMUTATIONS)
+
+
+def minhash(shingle_set: Set[str]) -> Tuple[int, ...]:
+    """MinHash signature of a shingle set (same permutations in every process, so signatures are comparable)."""
+    hashes = [struct.unpack("<I", hashlib.blake2b(s.encode(), digest_size=4).digest())[0] for s in shingle_set]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimated_similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class UserFactIndex:
+    """
+    The facts remembered about one user, with O(1) exact duplicate checks (normalized text set),
+    MinHash/LSH near-duplicate detection and BM25 ranking against a prompt.
+
+    `add` returns one of:
+      ("added", None)       - new fact, append it to storage (including corrections of a similar fact)
+      ("duplicate", None)   - already stored with the same normalized text, nothing to store
+      ("merged", old_fact)  - restates `old_fact` with the same or more detail; replace `old_fact` with it
+    A similar-looking fact that changes a negation, number or content word is never merged or dropped.
+    """
+
+    def __init__(self, facts: Optional[List[str]] = None):
+        self.facts: List[str] = []
+        self.keys: Dict[str, int] = {} # normalized fact -> position in self.facts
+        self.signatures: List[Tuple[int, ...]] = []
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {} # (band, band hashes) -> fact positions
+        self._bm25: Optional[BM25Index] = None
+        for fact in facts or []:
+            self._insert(fact) # Stored facts are kept as they are, even if older ones overlap
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        rows = len(signature) // LSH_BANDS
+        for band in range(LSH_BANDS):
+            yield (band, signature[band * rows:(band + 1) * rows])
+
+    def _insert(self, fact: str):
+        key = normalize_fact(fact)
+        position = len(self.facts)
+        signature = minhash(shingles(key))
+        self.facts.append(fact)
+        self.keys.setdefault(key, position)
+        self.signatures.append(signature)
+        for bucket in self._bands(signature):
+            self.buckets.setdefault(bucket, set()).add(position)
+        self._bm25 = None
+
+    def _replace(self, position: int, fact: str):
+        old_key = normalize_fact(self.facts[position])
+        if self.keys.get(old_key) == position:
+            del self.keys[old_key]
+        for bucket in self._bands(self.signatures[position]):
+            self.buckets.get(bucket, set()).discard(position)
+        key = normalize_fact(fact)
+        signature = minhash(shingles(key))
+        self.facts[position] = fact
+        self.keys[key] = position
+        self.signatures[position] = signature
+        for bucket in self._bands(signature):
+            self.buckets.setdefault(bucket, set()).add(position)
+        self._bm25 = None
+
+    def find_near_duplicate(self, fact: str) -> Optional[int]:
+        """Position of the most similar stored fact above the threshold, if any."""
+        signature = minhash(shingles(normalize_fact(fact)))
+        candidates = set()
+        for bucket in self._bands(signature):
+            candidates |= self.buckets.get(bucket, set())
+        key = normalize_fact(fact)
+        best, best_score = None, NEAR_DUPLICATE_THRESHOLD
+        for position in candidates:
+            score = estimated_similarity(signature, self.signatures[position])
+            if score >= best_score and facts_agree(normalize_fact(self.facts[position]), key):
+                best, best_score = position, score
+        return best
+
+    def add(self, fact: str) -> Tuple[str, Optional[str]]:
+        key = normalize_fact(fact)
+        if not key or key in self.keys:
+            return "duplicate", None
+        position = self.find_near_duplicate(fact)
+        if position is None:
+            self._insert(fact)
+            return "added", None
+        old_fact = self.facts[position]
+        self._replace(position, fact) # Newer wording that keeps everything the old one said
+        return "merged", old_fact
+
+    def top_k(self, query: str, k: int) -> List[str]:
+        """Up to `k` facts: the most relevant to `query`, topped up with the newest, in stored order."""
+        if len(self.facts) <= k:
+            return list(self.facts)
+        if self._bm25 is None:
+            self._bm25 = BM25Index(self.facts)
+        chosen = [position for position, _ in self._bm25.top_k(query, k)]
+        for position in range(len(self.facts) - 1, -1, -1):
+            if len(chosen) >= k:
+                break
+            if position not in chosen:
+                chosen.append(position)
+        return [self.facts[position] for position in sorted(chosen)]
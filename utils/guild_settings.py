@@ -0,0 +1,272 @@
+# utils/guild_settings.py
+import asyncio
+import json
+import os
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.persistence import persister
+
+GUILD_SETTINGS_DIR = os.getenv("GUILD_SETTINGS_DIR", "/home/server/wdiscordbot-json-data/guild_settings")
+META_FILENAME = "_meta.json" # Records which legacy sources have been imported
+DEFAULT_POLL_INTERVAL = float(os.getenv("GUILD_SETTINGS_POLL_INTERVAL", "5"))
+
+# Keys whose values are id/name collections; snapshots hold them as frozensets for O(1) membership checks
+SET_KEYS = {"BOT_COMMANDS_CHANNEL_ID", "NSFW_CHANNEL_IDS", "DISABLED_COMMANDS"}
+
+
+def _freeze(key: str, value: Any) -> Any:
+    if key in SET_KEYS:
+        if value is None:
+            return frozenset()
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return frozenset(value)
+        return frozenset([value])
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze("", item) for item in value)
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze("", v) for k, v in value.items()})
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    """JSON-ready copy of a frozen value (sets become sorted lists)."""
+    if isinstance(value, frozenset):
+        return sorted(value, key=str)
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    return value
+
+
+class GuildSettings:
+    """
+    Immutable snapshot of one guild's settings.
+
+    `get(key, default)` works like the old per-guild dicts; the attributes below are
+    precomputed for the message hot path. A change produces a new snapshot with a
+    higher `version`, so a handler can hold on to the snapshot it started with.
+    """
+
+    __slots__ = ("guild_id", "version", "_values", "enabled", "bot_commands_channel_ids", "suggestions_channel_id",
+                 "nsfw_channel_ids", "mod_log_channel_id", "moderator_role_id", "suicidal_ping_role_id", "ai_model",
+                 "disabled_commands", "apply_link", "report_recipient_id")
+
+    def __init__(self, guild_id: int, values: Optional[Dict[str, Any]] = None, version: int = 0):
+        frozen = MappingProxyType({key: _freeze(key, value) for key, value in (values or {}).items() if value is not None})
+        set_attr = object.__setattr__
+        set_attr(self, "guild_id", guild_id)
+        set_attr(self, "version", version)
+        set_attr(self, "_values", frozen)
+        set_attr(self, "enabled", bool(frozen.get("ENABLED", True)))
+        set_attr(self, "bot_commands_channel_ids", frozen.get("BOT_COMMANDS_CHANNEL_ID", frozenset()))
+        set_attr(self, "suggestions_channel_id", frozen.get("SUGGESTIONS_CHANNEL_ID"))
+        set_attr(self, "nsfw_channel_ids", frozen.get("NSFW_CHANNEL_IDS", frozenset()))
+        set_attr(self, "mod_log_channel_id", frozen.get("MOD_LOG_CHANNEL_ID"))
+        set_attr(self, "moderator_role_id", frozen.get("MODERATOR_ROLE_ID"))
+        set_attr(self, "suicidal_ping_role_id", frozen.get("SUICIDAL_PING_ROLE_ID"))
+        set_attr(self, "ai_model", frozen.get("AI_MODEL"))
+        set_attr(self, "disabled_commands", frozen.get("DISABLED_COMMANDS", frozenset()))
+        set_attr(self, "apply_link", frozen.get("APPLY_LINK"))
+        set_attr(self, "report_recipient_id", frozen.get("REPORT_RECIPIENT_ID"))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GuildSettings snapshots are immutable; use GuildSettingsService.set/update")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._values.get(key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._values
+
+    def keys(self):
+        return self._values.keys()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: _thaw(value) for key, value in self._values.items()}
+
+
+class GuildSettingsService:
+    """
+    One place for per-guild settings (moderation config, blocked commands, application link, report recipient...).
+
+    Every guild has its own `<guild_id>.json` file holding `{"version": n, "settings": {...}}`, so a change
+    rewrites only that guild's file (through the shared write-behind persister). Reads return the cached
+    immutable snapshot. `start_watching` polls the files and reloads guilds that were edited by hand,
+    so changes made outside the bot apply without a restart.
+    """
+
+    def __init__(self, directory: str = GUILD_SETTINGS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshots: Dict[int, GuildSettings] = {}
+        self._mtimes: Dict[int, int] = {} # guild_id -> mtime_ns of the file as last read or written
+        self._imported: List[str] = []
+        self._watcher: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.writes = 0
+        self._load_all()
+
+    # --- Files ---
+    def path_for(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILENAME)
+
+    def _read_file(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "settings" not in data: # Hand-written file without the version wrapper
+            return 0, data
+        return int(data.get("version", 0)), data["settings"]
+
+    def _load_all(self):
+        try:
+            with open(self._meta_path(), "r", encoding="utf-8") as f:
+                self._imported = list(json.load(f).get("imported", []))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Failed to read guild settings metadata: {e}")
+        for entry in os.scandir(self.directory):
+            guild_id = self._guild_id_for(entry.name)
+            if guild_id is None:
+                continue
+            try:
+                version, values = self._read_file(entry.path)
+                self.snapshots[guild_id] = GuildSettings(guild_id, values, version)
+                self._mtimes[guild_id] = entry.stat().st_mtime_ns
+            except Exception as e:
+                print(f"Failed to load guild settings from {entry.path}: {e}")
+
+    @staticmethod
+    def _guild_id_for(filename: str) -> Optional[int]:
+        stem, ext = os.path.splitext(filename)
+        return int(stem) if ext == ".json" and stem.isdigit() else None
+
+    def _target_name(self, guild_id: int) -> str:
+        return f"guild_settings:{guild_id}"
+
+    def _persist(self, guild_id: int):
+        name = self._target_name(guild_id)
+        if name not in persister.targets:
+            def snapshot(guild_id=guild_id):
+                settings = self.get(guild_id)
+                return {"version": settings.version, "settings": settings.to_dict()}
+            persister.register(name, self.path_for(guild_id), snapshot, indent=2)
+        persister.mark_dirty(name)
+        self.writes += 1
+
+    # --- Reads ---
+    def get(self, guild_id: int) -> GuildSettings:
+        """The guild's current snapshot (an empty one if nothing was ever set)."""
+        settings = self.snapshots.get(guild_id)
+        if settings is None:
+            settings = GuildSettings(guild_id)
+        return settings
+
+    def get_value(self, guild_id: int, key: str, default: Any = None) -> Any:
+        return self.get(guild_id).get(key, default)
+
+    # --- Writes ---
+    def update(self, guild_id: int, changes: Dict[str, Any]) -> GuildSettings:
+        """Apply several changes at once (a value of None removes the key) and persist the guild's file."""
+        current = self.get(guild_id)
+        values = current.to_dict()
+        for key, value in changes.items():
+            if value is None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+        settings = GuildSettings(guild_id, values, current.version + 1)
+        self.snapshots[guild_id] = settings
+        self._persist(guild_id)
+        return settings
+
+    def set(self, guild_id: int, key: str, value: Any) -> GuildSettings:
+        return self.update(guild_id, {key: value})
+
+    def unset(self, guild_id: int, key: str) -> GuildSettings:
+        return self.update(guild_id, {key: None})
+
+    def import_legacy(self, source: str, loader: Callable[[], Dict[int, Dict[str, Any]]]):
+        """
+        One-time import from an old storage format. `loader` returns {guild_id: {key: value}}; keys that
+        already exist in the new store are kept. Each `source` is imported once.
+        """
+        if source in self._imported:
+            return
+        try:
+            legacy = loader()
+        except FileNotFoundError:
+            legacy = {}
+        except Exception as e:
+            print(f"Failed to import legacy guild settings from '{source}': {e}")
+            return
+        for guild_id, values in legacy.items():
+            current = self.get(int(guild_id))
+            changes = {key: value for key, value in values.items() if key not in current and value is not None}
+            if changes:
+                self.update(int(guild_id), changes)
+        self._imported.append(source)
+        persister.register("guild_settings_meta", self._meta_path(), lambda: {"imported": list(self._imported)}, indent=2)
+        persister.mark_dirty("guild_settings_meta")
+        if legacy:
+            print(f"Imported guild settings for {len(legacy)} guild(s) from '{source}'.")
+
+    # --- Hot reload ---
+    def start_watching(self, interval: float = DEFAULT_POLL_INTERVAL):
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.get_running_loop().create_task(self._watch(interval))
+
+    async def close(self):
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+        names = [name for name in persister.targets if name.startswith("guild_settings")]
+        await persister.flush(names)
+
+    def _scan(self) -> List[tuple]:
+        """(guild_id, mtime_ns, version, values) for every file changed since it was last seen (runs in a worker thread)."""
+        changed = []
+        for entry in os.scandir(self.directory):
+            guild_id = self._guild_id_for(entry.name)
+            if guild_id is None:
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+                if self._mtimes.get(guild_id) == mtime:
+                    continue
+                version, values = self._read_file(entry.path)
+                changed.append((guild_id, mtime, version, values))
+            except Exception as e:
+                print(f"Failed to reload guild settings from {entry.path}: {e}")
+        return changed
+
+    def _apply_reloads(self, changed: Iterable[tuple]):
+        for guild_id, mtime, version, values in changed:
+            self._mtimes[guild_id] = mtime
+            if self._target_name(guild_id) in persister.dirty:
+                continue # Our own pending write will replace the file anyway
+            current = self.get(guild_id)
+            reloaded = GuildSettings(guild_id, values, max(version, current.version + 1))
+            if reloaded.to_dict() == current.to_dict():
+                continue # Our own write (or an edit that changed nothing)
+            self.snapshots[guild_id] = reloaded
+            self.reloads += 1
+            print(f"Reloaded guild settings for {guild_id} from disk (version {reloaded.version}).")
+
+    async def _watch(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._apply_reloads(await loop.run_in_executor(None, self._scan))
+            except Exception as e:
+                print(f"Guild settings watcher error: {e}")
+
+
+# Shared by every cog, like the persister
+guild_settings = GuildSettingsService()
@@ -0,0 +1,153 @@
+# utils/history_journal.py
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional
+
+from utils.persistence import atomic_write_json
+
+# Snapshot file layout written by this module. Older bots wrote a bare
+# { user_id: [messages] } dict, which is still accepted when loading.
+SNAPSHOT_VERSION = 1
+
+
+class HistoryJournal:
+    """
+    Append-only journal for AI conversation history.
+
+    Every turn is written as a single JSON line to `<snapshot>.journal`, so the cost
+    of saving a turn does not depend on how much history is stored. Removing a user's
+    oldest messages (after they were summarized) is a `drop` record. From time to time
+    the in-memory history is compacted into the snapshot file and the journal is dropped.
+    Loading replays snapshot + journal.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or f"{snapshot_path}.journal"
+        # Journal that is being folded into the snapshot (kept until the snapshot is on disk)
+        self.rotated_path = f"{self.journal_path}.old"
+        self.seq = 0 # Sequence number of the last record written
+        self.pending = 0 # Records written since the last compaction
+        self._journal_file = None
+        self._compaction_lock = asyncio.Lock()
+
+    # --- Loading ---
+    def load(self, max_messages: int) -> Dict[str, List[Dict[str, str]]]:
+        """Load the snapshot and replay any journal records written after it."""
+        history: Dict[str, List[Dict[str, str]]] = {}
+        snapshot_seq = 0
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and "seq" in data and isinstance(data.get("history"), dict):
+                snapshot_seq = int(data["seq"])
+                history = data["history"]
+            else:
+                history = data # Legacy layout: the whole file is the history dict
+
+        self.seq = snapshot_seq
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            replayed += self._replay(path, history, snapshot_seq, max_messages)
+        self.pending = replayed
+        return history
+
+    def _replay(self, path: str, history: Dict[str, List[Dict[str, str]]], snapshot_seq: int, max_messages: int) -> int:
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Usually a half-written last line left behind by a crash
+                    print(f"History journal {path}: skipping unreadable record on line {line_number}.")
+                    continue
+                seq = record.get("seq", 0)
+                self.seq = max(self.seq, seq)
+                if seq <= snapshot_seq:
+                    continue # Already part of the snapshot
+                user_history = history.setdefault(str(record["user_id"]), [])
+                if record.get("drop"):
+                    del user_history[:int(record["drop"])]
+                user_history.extend(record.get("messages", []))
+                if len(user_history) > max_messages:
+                    del user_history[:-max_messages]
+                replayed += 1
+        return replayed
+
+    # --- Appending ---
+    def _write_record(self, record: Dict):
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+        self.seq += 1
+        self._journal_file.write(json.dumps({"seq": self.seq, **record}, ensure_ascii=False) + "\n")
+        self._journal_file.flush()
+        self.pending += 1
+
+    def append(self, user_id: str, messages: List[Dict[str, str]]):
+        """Append one record (one turn) to the journal."""
+        self._write_record({"user_id": str(user_id), "messages": messages})
+
+    def append_drop(self, user_id: str, count: int):
+        """Record that the user's `count` oldest messages were removed."""
+        self._write_record({"user_id": str(user_id), "drop": count})
+
+    def close(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    # --- Compaction ---
+    def _rotate(self):
+        """Move the live journal aside so new turns go to a fresh file while the snapshot is written."""
+        self.close()
+        if not os.path.exists(self.journal_path):
+            return
+        if os.path.exists(self.rotated_path):
+            # A previous compaction did not finish; fold the live journal into the old one
+            with open(self.journal_path, 'r', encoding='utf-8') as src, open(self.rotated_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.rotated_path)
+
+    def _write_snapshot(self, history: Dict[str, List[Dict[str, str]]], seq: int):
+        atomic_write_json(self.snapshot_path, {"version": SNAPSHOT_VERSION, "seq": seq, "history": history}, ensure_ascii=False)
+        # Everything in the rotated journal is now covered by the snapshot
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def compact(self, history: Dict[str, List[Dict[str, str]]]):
+        """Synchronously write a snapshot of `history` and drop the journal (startup / shutdown)."""
+        self._rotate()
+        self._write_snapshot(history, self.seq)
+        self.pending = 0
+
+    async def compact_async(self, history: Dict[str, List[Dict[str, str]]], wait: bool = False) -> bool:
+        """
+        Write the snapshot in a worker thread.
+        Returns False (without compacting) if another compaction is running and `wait` is False.
+        """
+        if self._compaction_lock.locked() and not wait:
+            return False
+        async with self._compaction_lock:
+            self._rotate()
+            seq = self.seq
+            compacted = self.pending
+            # Copy the per-user lists here so the event loop can keep appending while the thread serializes
+            snapshot = {user_id: list(messages) for user_id, messages in history.items()}
+            self.pending = 0
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write_snapshot, snapshot, seq)
+            except Exception:
+                self.pending += compacted # The rotated journal is still on disk and will be retried
+                raise
+            return True
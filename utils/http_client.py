@@ -0,0 +1,155 @@
+# utils/http_client.py
+import os
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+
+class HTTPClient:
+    """
+    Bot-wide aiohttp session with a shared connection pool.
+
+    Connections are kept alive and reused per host, DNS lookups are cached, and pool usage
+    (new vs reused connections, time spent waiting for a free connection) is tracked via
+    aiohttp trace hooks. Create one at startup, attach it as `bot.http_client`, and close it
+    on shutdown. Cogs should use `get_http_client(bot).session` instead of opening their own.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, dns_cache_ttl: int = 300,
+                 keepalive_timeout: float = 30.0, total_timeout: float = 60.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.total_timeout = total_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+
+        # --- Pool statistics ---
+        self.requests = 0
+        self.request_errors = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connect_time_total = 0.0 # Seconds spent opening new connections (TCP + TLS)
+        self.pool_waits = 0 # Requests that had to queue for a free connection
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+
+    @classmethod
+    def from_env(cls) -> "HTTPClient":
+        """Build a client using the HTTP_* environment variables (falling back to the defaults)."""
+        return cls(
+            limit=int(os.getenv("HTTP_POOL_LIMIT", "100")),
+            limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20")),
+            dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", "300")),
+            keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30")),
+            total_timeout=float(os.getenv("HTTP_TOTAL_TIMEOUT", "60")),
+        )
+
+    # --- Lifecycle ---
+    def _open(self):
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=aiohttp.ClientTimeout(total=self.total_timeout),
+            trace_configs=[self._trace_config()],
+        )
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            self._open()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session (created on first use if `start` was not awaited)."""
+        if self._session is None or self._session.closed:
+            self._open()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    # --- Trace hooks ---
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_request_exception(session, ctx, params):
+            self.request_errors += 1
+
+        async def on_queued_start(session, ctx, params):
+            ctx.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, ctx, params):
+            waited = time.perf_counter() - getattr(ctx, "queued_at", time.perf_counter())
+            self.pool_waits += 1
+            self.pool_wait_total += waited
+            self.pool_wait_max = max(self.pool_wait_max, waited)
+
+        async def on_create_start(session, ctx, params):
+            ctx.connect_started_at = time.perf_counter()
+
+        async def on_create_end(session, ctx, params):
+            self.connections_created += 1
+            self.connect_time_total += time.perf_counter() - getattr(ctx, "connect_started_at", time.perf_counter())
+
+        async def on_reuse(session, ctx, params):
+            self.connections_reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_start.append(on_create_start)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    # --- Stats ---
+    def stats(self) -> Dict:
+        """Snapshot of pool usage for logging or the /httpstats command."""
+        in_use = 0
+        idle_per_host: Dict[str, int] = {}
+        if self._connector is not None and not self._connector.closed:
+            # aiohttp does not expose these publicly; fall back to empty values if internals change
+            in_use = len(getattr(self._connector, "_acquired", ()))
+            for key, conns in getattr(self._connector, "_conns", {}).items():
+                host = getattr(key, "host", str(key))
+                idle_per_host[host] = idle_per_host.get(host, 0) + len(conns)
+        connects = self.connections_created + self.connections_reused
+        return {
+            "requests": self.requests,
+            "request_errors": self.request_errors,
+            "connections_in_use": in_use,
+            "connections_idle": sum(idle_per_host.values()),
+            "idle_per_host": idle_per_host,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_rate": (self.connections_reused / connects) if connects else 0.0,
+            "avg_connect_ms": (self.connect_time_total / self.connections_created * 1000) if self.connections_created else 0.0,
+            "pool_waits": self.pool_waits,
+            "avg_pool_wait_ms": (self.pool_wait_total / self.pool_waits * 1000) if self.pool_waits else 0.0,
+            "max_pool_wait_ms": self.pool_wait_max * 1000,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
+
+
+def get_http_client(bot) -> HTTPClient:
+    """Return the bot-wide client, attaching one if bot.py did not (e.g. cogs loaded by another runner)."""
+    client = getattr(bot, "http_client", None)
+    if client is None:
+        client = HTTPClient.from_env()
+        bot.http_client = client
+    return client
@@ -0,0 +1,179 @@
+# utils/infraction_store.py
+import datetime
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infractions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    ts REAL NOT NULL, -- epoch seconds, used for ordering and time windows
+    timestamp TEXT NOT NULL, -- original ISO timestamp, returned as-is
+    rule_violated TEXT NOT NULL,
+    action_taken TEXT NOT NULL,
+    reasoning TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_infractions_user ON infractions (guild_id, user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_infractions_guild ON infractions (guild_id, ts);
+"""
+
+SUMMARY_INFRACTIONS = 10 # Most recent infractions included in the summary sent to the model
+SUMMARY_MAX_CHARS = 500
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """Epoch seconds for an ISO timestamp ("Z" or offset suffix); naive timestamps are taken as UTC."""
+    try:
+        parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return time.time()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def format_history_summary(infractions: List[Dict]) -> str:
+    """The infraction summary given to the moderation model (same format the cog always used)."""
+    if not infractions:
+        return "No prior infractions recorded."
+    summary = "\n".join(
+        f"- Action: {infr.get('action_taken', 'N/A')} for Rule {infr.get('rule_violated', 'N/A')} on {infr.get('timestamp', 'N/A')[:10]}. Reason: {infr.get('reasoning', 'N/A')[:50]}..."
+        for infr in infractions
+    )
+    # Limit history summary length to prevent excessively long prompts
+    if len(summary) > SUMMARY_MAX_CHARS:
+        summary = summary[:SUMMARY_MAX_CHARS - 3] + "..."
+    return summary
+
+
+class InfractionStore:
+    """
+    SQLite store for AI moderation infractions, indexed by (guild, user, time).
+
+    Keeps the full history (no per-user cap); callers ask for a time window instead.
+    The per-user (count, summary) pair used on every moderated message is cached and
+    rebuilt only when that user's infractions change (or the window moves on).
+    """
+
+    def __init__(self, db_path: str, summary_ttl: float = 3600.0):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, isolation_level=None) # Autocommit; explicit BEGIN for batches
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.summary_ttl = summary_ttl
+        self._summaries: Dict[tuple, tuple] = {} # (guild_id, user_id, days) -> (built_at, count, summary)
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM infractions LIMIT 1").fetchone() is None
+
+    def import_legacy_json(self, path: str) -> int:
+        """Import the old { "guild_user": [infraction, ...] } file. Returns the number of records imported."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rows = []
+        for key, infractions in data.items():
+            guild_id, _, user_id = key.partition("_")
+            if not guild_id.isdigit() or not user_id.isdigit():
+                continue
+            for infr in infractions:
+                timestamp = infr.get("timestamp", "")
+                rows.append((int(guild_id), int(user_id), parse_timestamp(timestamp), timestamp,
+                             str(infr.get("rule_violated", "Unknown")), str(infr.get("action_taken", "Unknown")),
+                             str(infr.get("reasoning", ""))))
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT INTO infractions (guild_id, user_id, ts, timestamp, rule_violated, action_taken, reasoning) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK") # Otherwise the autocommit connection stays inside this transaction
+            raise
+        self._summaries.clear()
+        return len(rows)
+
+    # --- Writes ---
+    def add(self, guild_id: int, user_id: int, rule_violated: str, action_taken: str, reasoning: str, timestamp: str):
+        self.conn.execute(
+            "INSERT INTO infractions (guild_id, user_id, ts, timestamp, rule_violated, action_taken, reasoning) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, user_id, parse_timestamp(timestamp), timestamp, rule_violated, action_taken, reasoning),
+        )
+        self._invalidate(guild_id, user_id)
+
+    def clear_user(self, guild_id: int, user_id: int) -> int:
+        """Delete a user's infractions in a guild. Returns how many were removed."""
+        cursor = self.conn.execute("DELETE FROM infractions WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        self._invalidate(guild_id, user_id)
+        return cursor.rowcount
+
+    def _invalidate(self, guild_id: int, user_id: int):
+        for key in [key for key in self._summaries if key[0] == guild_id and key[1] == user_id]:
+            del self._summaries[key]
+
+    # --- Per-user queries ---
+    @staticmethod
+    def _since(days: Optional[float]) -> float:
+        return time.time() - days * 86400 if days else 0.0
+
+    def get_history(self, guild_id: int, user_id: int, days: Optional[float] = None, limit: Optional[int] = None) -> List[Dict]:
+        """A user's infractions, oldest first. `days` limits to the last N days; `limit` keeps the most recent N."""
+        rows = self.conn.execute(
+            "SELECT timestamp, rule_violated, action_taken, reasoning FROM infractions "
+            "WHERE guild_id = ? AND user_id = ? AND ts >= ? ORDER BY ts DESC, id DESC LIMIT ?",
+            (guild_id, user_id, self._since(days), limit if limit else -1),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def count(self, guild_id: int, user_id: int, days: Optional[float] = None) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM infractions WHERE guild_id = ? AND user_id = ? AND ts >= ?",
+            (guild_id, user_id, self._since(days)),
+        ).fetchone()[0]
+
+    def history_summary(self, guild_id: int, user_id: int, days: Optional[float] = None) -> tuple:
+        """(infraction count, summary string) for the moderation prompt, cached until the user's record changes."""
+        key = (guild_id, user_id, days)
+        cached = self._summaries.get(key)
+        if cached and time.monotonic() - cached[0] < self.summary_ttl:
+            return cached[1], cached[2]
+        count = self.count(guild_id, user_id, days)
+        summary = format_history_summary(self.get_history(guild_id, user_id, days, limit=SUMMARY_INFRACTIONS) if count else [])
+        if len(self._summaries) >= 50000: # Bound memory on very large servers; entries are cheap to rebuild
+            self._summaries.clear()
+        self._summaries[key] = (time.monotonic(), count, summary)
+        return count, summary
+
+    # --- Guild-wide aggregates ---
+    def guild_aggregates(self, guild_id: int, days: Optional[float] = None, top: int = 5) -> Dict:
+        """Totals, busiest rules/actions and most-infracting users for a guild (all answered from the guild index)."""
+        since = self._since(days)
+        total, users = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM infractions WHERE guild_id = ? AND ts >= ?", (guild_id, since)
+        ).fetchone()
+
+        def grouped(column: str):
+            return [tuple(row) for row in self.conn.execute(
+                f"SELECT {column}, COUNT(*) AS n FROM infractions WHERE guild_id = ? AND ts >= ? GROUP BY {column} ORDER BY n DESC LIMIT ?",
+                (guild_id, since, top),
+            )]
+
+        return {
+            "total": total,
+            "users": users,
+            "by_rule": grouped("rule_violated"),
+            "by_action": grouped("action_taken"),
+            "top_users": grouped("user_id"),
+        }
@@ -0,0 +1,130 @@
+# utils/json_stream.py
+from typing import Any, Dict, Optional
+
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class IncrementalJSONObject:
+    """
+    Reads a JSON object as it streams in and exposes its top-level scalar fields as soon as each one is complete.
+
+    Text before the first `{` (e.g. a ```json fence) is ignored. Nested objects/arrays are skipped over but
+    not decoded; use `json.loads` on the full text for those. `values` maps key -> value for every finished
+    top-level string/number/boolean/null, and `complete` is set once the closing `}` arrives.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.complete = False
+        self.started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None # Hex digits of a \uXXXX escape being read
+        self._buffer = [] # Characters of the current top-level string or bare literal
+        self._key: Optional[str] = None # Key whose value is being read
+        self._expect = "key" # "key", "colon" or "value" at depth 1
+        self._literal = False # Reading a bare number/true/false/null at depth 1
+
+    def feed(self, text: str) -> Dict[str, Any]:
+        for char in text:
+            if self.complete:
+                break
+            self._feed_char(char)
+        return self.values
+
+    def _finish_literal(self):
+        raw = "".join(self._buffer).strip()
+        self._buffer = []
+        self._literal = False
+        if raw in _LITERALS:
+            value = _LITERALS[raw]
+        else:
+            try:
+                value = float(raw) if any(c in raw for c in ".eE") else int(raw)
+            except ValueError:
+                value = raw
+        if self._key is not None:
+            self.values[self._key] = value
+        self._key = None
+        self._expect = "key"
+
+    def _feed_char(self, char: str):
+        if not self.started:
+            if char == "{":
+                self.started = True
+                self._depth = 1
+            return
+
+        if self._in_string:
+            if self._unicode is not None:
+                self._unicode += char
+                if len(self._unicode) == 4:
+                    if self._depth == 1:
+                        try:
+                            self._buffer.append(chr(int(self._unicode, 16)))
+                        except ValueError:
+                            self._buffer.append("\\u" + self._unicode) # Malformed escape; keep it as written
+                    self._unicode = None
+                return
+            if self._escape:
+                self._escape = False
+                if char == "u":
+                    self._unicode = "" # The 4 hex digits are consumed at any depth, decoded only at depth 1
+                    return
+                if self._depth == 1:
+                    self._buffer.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(char, char))
+                return
+            if char == "\\":
+                self._escape = True
+                return
+            if char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    # Surrogate pairs (\ud83d\ude00) were decoded one half at a time; join them into one character
+                    text = "".join(self._buffer).encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+                    self._buffer = []
+                    if self._expect == "key":
+                        self._key = text
+                        self._expect = "colon"
+                    else:
+                        if self._key is not None:
+                            self.values[self._key] = text
+                        self._key = None
+                        self._expect = "key"
+                return
+            if self._depth == 1:
+                self._buffer.append(char)
+            return
+
+        if self._literal:
+            if char in ",}" or char.isspace():
+                self._finish_literal()
+                if char.isspace():
+                    return
+            else:
+                self._buffer.append(char)
+                return
+
+        if char == '"':
+            self._in_string = True
+            return
+        if char in "{[":
+            self._depth += 1
+            return
+        if char in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._expect == "value":
+                self._key = None # Finished a nested value; we only keep scalars
+                self._expect = "key"
+            elif self._depth == 0:
+                self.complete = True
+            return
+        if self._depth != 1 or char.isspace() or char == ",":
+            return
+        if char == ":" and self._expect == "colon":
+            self._expect = "value"
+            return
+        if self._expect == "value":
+            self._literal = True
+            self._buffer.append(char)
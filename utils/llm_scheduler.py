@@ -0,0 +1,255 @@
+# utils/llm_scheduler.py
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Optional
+
+import aiohttp
+
+# Lower number = served first
+PRIORITY_MODERATION = 0
+PRIORITY_CHAT = 1
+PRIORITY_BACKGROUND = 2 # Summaries and other work nobody is waiting on
+PRIORITY_NAMES = {PRIORITY_MODERATION: "moderation", PRIORITY_CHAT: "chat", PRIORITY_BACKGROUND: "background"}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Admission control for every LLM API call the bot makes.
+
+    Requests wait for a free slot (at most `max_concurrency` in flight) and a token from a
+    token bucket (`rate_per_second`, bursts up to `burst`). Waiting requests are served by
+    priority (moderation before chat before background work) and, within a priority,
+    round-robin per guild so one busy server cannot starve the others. 429 and 5xx responses
+    are retried with exponential backoff, honoring Retry-After; a 429 also pauses the whole
+    queue, since the limit is per API key rather than per request.
+
+    Usage:
+        async with scheduler.request(session, "POST", url, priority=PRIORITY_CHAT, guild_id=gid, json=payload) as response:
+            ...
+    """
+
+    def __init__(self, rate_per_second: float = 2.0, burst: int = 5, max_concurrency: int = 8,
+                 max_retries: int = 3, base_backoff: float = 1.0, max_backoff: float = 30.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.active = 0
+        self.paused_until = 0.0 # monotonic time before which nothing is sent (after a 429)
+        # priority -> { guild key: deque of (future, enqueued_at) }, guilds in round-robin order
+        self.queues: Dict[int, "OrderedDict[object, Deque]"] = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # --- Statistics ---
+        self.granted = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_total = {p: 0.0 for p in PRIORITY_NAMES}
+        self.wait_max = {p: 0.0 for p in PRIORITY_NAMES}
+        self.throttled = 0 # 429 responses
+        self.server_errors = 0 # 5xx responses
+        self.retries = 0
+        self.gave_up = 0 # Requests that still failed after max_retries
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        """Build a scheduler using the LLM_* environment variables (falling back to the defaults)."""
+        return cls(
+            rate_per_second=float(os.getenv("LLM_RATE_PER_SECOND", "2")),
+            burst=int(os.getenv("LLM_BURST", "5")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        )
+
+    async def close(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    # --- Admission ---
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * self.rate_per_second)
+        self.last_refill = now
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        priorities = PRIORITY_NAMES if priority is None else (priority,)
+        return sum(len(q) for p in priorities for q in self.queues[p].values())
+
+    def _record_grant(self, priority: int, waited: float):
+        self.granted[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    async def acquire(self, priority: int = PRIORITY_CHAT, guild_id: Optional[int] = None):
+        """Wait for permission to send one request. Every acquire must be paired with `release`."""
+        self._refill()
+        if (not self.queue_depth() and self.active < self.max_concurrency
+                and self.tokens >= 1 and time.monotonic() >= self.paused_until):
+            self.tokens -= 1
+            self.active += 1
+            self._record_grant(priority, 0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(guild_id, deque()).append((future, time.monotonic()))
+        self._ensure_dispatcher()
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release() # Granted just as the caller gave up
+            raise
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+        self._wakeup.set()
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _next_waiter(self):
+        """Pop the next live waiter: highest priority first, guilds in turn."""
+        for priority in sorted(self.queues):
+            guilds = self.queues[priority]
+            while guilds:
+                guild_key, waiters = guilds.popitem(last=False)
+                while waiters:
+                    future, enqueued_at = waiters.popleft()
+                    if future.cancelled():
+                        continue
+                    if waiters:
+                        guilds[guild_key] = waiters # Back of the line for this guild's next request
+                    return priority, future, enqueued_at
+        return None
+
+    async def _dispatch(self):
+        while self.queue_depth():
+            self._wakeup.clear()
+            if self.active >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate_per_second)
+                continue
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            priority, future, enqueued_at = waiter
+            self.tokens -= 1
+            self.active += 1
+            self._record_grant(priority, time.monotonic() - enqueued_at)
+            future.set_result(None)
+
+    # --- Requests ---
+    def _backoff(self, attempt: int, response: aiohttp.ClientResponse) -> float:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return min(self.base_backoff * (2 ** attempt), self.max_backoff)
+
+    @asynccontextmanager
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, *,
+                      priority: int = PRIORITY_CHAT, guild_id: Optional[int] = None, **kwargs):
+        """
+        Send a request once admitted, retrying 429/5xx responses. Yields the response (the slot is held
+        until the block exits, so streamed bodies count against the concurrency limit). If retries run
+        out, the last error response is yielded so the caller can report it as before.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority, guild_id)
+            try:
+                response = await session.request(method, url, **kwargs)
+            except BaseException:
+                self.release()
+                raise
+            if response.status in RETRY_STATUSES:
+                if response.status == 429:
+                    self.throttled += 1
+                else:
+                    self.server_errors += 1
+                if attempt < self.max_retries:
+                    delay = self._backoff(attempt, response)
+                    if response.status == 429:
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                    response.release()
+                    self.release()
+                    self.retries += 1
+                    print(f"LLM request got HTTP {response.status}; retrying in {delay:.1f}s ({PRIORITY_NAMES.get(priority, priority)}, attempt {attempt + 1}/{self.max_retries})")
+                    await asyncio.sleep(delay)
+                    continue
+                self.gave_up += 1
+            try:
+                yield response
+            finally:
+                response.release()
+                self.release()
+            return
+
+    # --- Stats ---
+    def stats(self) -> Dict:
+        """Snapshot of queue and throttling state for logging or the /llmstats command."""
+        self._refill()
+        per_priority = {}
+        for priority, name in PRIORITY_NAMES.items():
+            granted = self.granted[priority]
+            per_priority[name] = {
+                "queued": self.queue_depth(priority),
+                "granted": granted,
+                "avg_wait_ms": (self.wait_total[priority] / granted * 1000) if granted else 0.0,
+                "max_wait_ms": self.wait_max[priority] * 1000,
+            }
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queue_depth(),
+            "queued_guilds": sum(len(q) for q in self.queues.values()),
+            "tokens": self.tokens,
+            "rate_per_second": self.rate_per_second,
+            "burst": self.burst,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+            "throttled": self.throttled,
+            "server_errors": self.server_errors,
+            "retries": self.retries,
+            "gave_up": self.gave_up,
+            "priorities": per_priority,
+        }
+
+
+def get_llm_scheduler(bot) -> LLMScheduler:
+    """Return the bot-wide scheduler, attaching one if bot.py did not (e.g. cogs loaded by another runner)."""
+    scheduler = getattr(bot, "llm_scheduler", None)
+    if scheduler is None:
+        scheduler = LLMScheduler.from_env()
+        bot.llm_scheduler = scheduler
+    return scheduler
@@ -0,0 +1,203 @@
+# utils/outbox.py
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL, -- JSON body
+    created_at REAL NOT NULL, -- wall-clock time, used for delivery lag
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0 -- gave up (permanent error or too many attempts); kept for inspection
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (dead, next_attempt_at);
+"""
+
+
+class Outbox:
+    """
+    Durable queue of JSON POSTs delivered by a background worker.
+
+    `enqueue` is a single SQLite insert, so callers never wait on the remote endpoint and
+    records survive restarts. The worker sends due records in batches (concurrently, on the
+    shared session), deletes them on 2xx, and retries failures with exponential backoff.
+    4xx responses other than 408/429 are permanent and the record is marked dead.
+    Headers come from `headers_provider` at send time, so secrets are never written to disk.
+    """
+
+    def __init__(self, db_path: str, session_provider: Callable[[], aiohttp.ClientSession],
+                 headers_provider: Optional[Callable[[], Dict[str, str]]] = None, batch_size: int = 20,
+                 max_attempts: int = 10, base_backoff: float = 2.0, max_backoff: float = 600.0,
+                 request_timeout: float = 10.0):
+        self.db_path = db_path
+        self.session_provider = session_provider
+        self.headers_provider = headers_provider
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.request_timeout = request_timeout
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn: Optional[sqlite3.Connection] = self._connect()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+        # --- Statistics ---
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead = 0
+        self.lag_total = 0.0 # Seconds from enqueue to delivery, summed over delivered records
+        self.lag_max = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, isolation_level=None) # Autocommit; explicit BEGIN for batches
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    # --- Lifecycle ---
+    def start(self):
+        if self.conn is None:
+            self.conn = self._connect()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop the worker. Undelivered records stay on disk and are sent after the next start."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.conn.close()
+        self.conn = None
+
+    # --- Queue ---
+    def enqueue(self, url: str, payload: Dict):
+        now = time.time()
+        row = (url, json.dumps(payload, ensure_ascii=False), now, now)
+        insert = "INSERT INTO outbox (url, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)"
+        if self.conn is None:
+            # Enqueued after close(): still write it to disk so it is delivered after the next start
+            conn = self._connect()
+            try:
+                conn.execute(insert, row)
+            finally:
+                conn.close()
+            self.enqueued += 1
+            return
+        self.conn.execute(insert, row)
+        self.enqueued += 1
+        self._wakeup.set()
+
+    def depth(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0").fetchone()[0]
+
+    def oldest_pending_age(self) -> float:
+        row = self.conn.execute("SELECT MIN(created_at) FROM outbox WHERE dead = 0").fetchone()
+        return max(0.0, time.time() - row[0]) if row[0] is not None else 0.0
+
+    def _due(self) -> List[tuple]:
+        return self.conn.execute(
+            "SELECT id, url, payload, created_at, attempts FROM outbox WHERE dead = 0 AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (time.time(), self.batch_size),
+        ).fetchall()
+
+    def _next_due_in(self) -> Optional[float]:
+        row = self.conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE dead = 0").fetchone()
+        return max(0.0, row[0] - time.time()) if row[0] is not None else None
+
+    # --- Delivery ---
+    async def _send(self, url: str, payload: str):
+        """Returns None on success, otherwise (error text, permanent?)."""
+        headers = {"Content-Type": "application/json"}
+        if self.headers_provider:
+            headers.update(self.headers_provider())
+        try:
+            async with self.session_provider().post(url, data=payload.encode("utf-8"), headers=headers,
+                                                    timeout=aiohttp.ClientTimeout(total=self.request_timeout)) as response:
+                if response.status < 400:
+                    return None
+                permanent = response.status < 500 and response.status not in (408, 429)
+                return f"HTTP {response.status}", permanent
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return f"{type(e).__name__}: {e}", False
+
+    async def _deliver_batch(self, rows: List[tuple]):
+        results = await asyncio.gather(*(self._send(url, payload) for _, url, payload, _, _ in rows))
+        now = time.time()
+        self.conn.execute("BEGIN")
+        try:
+            for (record_id, url, _, created_at, attempts), error in zip(rows, results):
+                if error is None:
+                    self.conn.execute("DELETE FROM outbox WHERE id = ?", (record_id,))
+                    lag = now - created_at
+                    self.delivered += 1
+                    self.lag_total += lag
+                    self.lag_max = max(self.lag_max, lag)
+                    continue
+                message, permanent = error
+                attempts += 1
+                self.failed_attempts += 1
+                if permanent or attempts >= self.max_attempts:
+                    self.conn.execute("UPDATE outbox SET attempts = ?, last_error = ?, dead = 1 WHERE id = ?", (attempts, message, record_id))
+                    self.dead += 1
+                    print(f"Outbox: giving up on record {record_id} to {url} after {attempts} attempt(s): {message}")
+                else:
+                    delay = min(self.base_backoff * (2 ** (attempts - 1)), self.max_backoff)
+                    self.conn.execute("UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                                      (attempts, message, now + delay, record_id))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = self._due()
+                if rows:
+                    await self._deliver_batch(rows)
+                    continue
+                wait = self._next_due_in()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                wait = self.base_backoff
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- Stats ---
+    def stats(self) -> Dict:
+        """Queue depth and delivery lag for logging or the /modstats command."""
+        dead_rows = self.conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1").fetchone()[0]
+        return {
+            "depth": self.depth(),
+            "oldest_pending_s": self.oldest_pending_age(),
+            "dead_rows": dead_rows,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed_attempts": self.failed_attempts,
+            "dead": self.dead,
+            "avg_lag_s": (self.lag_total / self.delivered) if self.delivered else 0.0,
+            "max_lag_s": self.lag_max,
+        }
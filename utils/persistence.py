@@ -0,0 +1,125 @@
+# utils/persistence.py
+import asyncio
+import json
+import os
+import stat
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Optional
+
+DEFAULT_WRITE_DELAY = 2.0 # Seconds to wait after the first change so bursts of changes become one write
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = None, ensure_ascii: bool = True):
+    """Write JSON to a unique temp file next to `path`, fsync it, then swap it in with os.replace."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # A unique name per write, so concurrent writers (background task and flush) never share a temp file
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=ensure_ascii)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode) # Keep the existing file's permissions (mkstemp uses 0600)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class _Target:
+    def __init__(self, path: str, snapshot: Callable[[], Any], indent: Optional[int], ensure_ascii: bool):
+        self.path = path
+        self.snapshot = snapshot
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+
+
+class WriteBehindPersister:
+    """
+    Coalesces saves of JSON-backed state and writes them off the event loop.
+
+    Cogs `register` a name with a file path and a `snapshot` callable, then call `mark_dirty(name)`
+    instead of writing the file. A background task waits `delay` seconds, takes the snapshots on the
+    event loop (so they are consistent), and serializes + writes them atomically in a worker thread.
+    `snapshot` should return a copy that is safe to serialize while the loop keeps mutating the original.
+    """
+
+    def __init__(self, delay: float = DEFAULT_WRITE_DELAY):
+        self.delay = delay
+        self.targets: Dict[str, _Target] = {}
+        self.dirty = set()
+        self.writes = 0 # Files written
+        self.coalesced = 0 # mark_dirty calls that did not need a write of their own
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, path: str, snapshot: Callable[[], Any], indent: Optional[int] = None, ensure_ascii: bool = True):
+        self.targets[name] = _Target(path, snapshot, indent, ensure_ascii)
+
+    def mark_dirty(self, name: str):
+        if name not in self.targets:
+            raise KeyError(f"No persistence target registered as '{name}'")
+        if name in self.dirty:
+            self.coalesced += 1
+            return
+        self.dirty.add(name)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync([name]) # No event loop (e.g. module import); write straight away
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._writer())
+
+    async def _writer(self):
+        while self.dirty:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    def _take(self, names: Optional[Iterable[str]]):
+        names = set(self.dirty if names is None else names) & self.dirty
+        jobs = []
+        for name in names:
+            self.dirty.discard(name)
+            target = self.targets[name]
+            try:
+                jobs.append((name, target, target.snapshot()))
+            except Exception as e:
+                print(f"Failed to snapshot '{name}' for saving to {target.path}: {e}")
+        return jobs
+
+    def _write(self, name: str, target: _Target, data: Any) -> bool:
+        try:
+            atomic_write_json(target.path, data, indent=target.indent, ensure_ascii=target.ensure_ascii)
+            self.writes += 1
+            return True
+        except Exception as e:
+            print(f"Failed to save '{name}' to {target.path}: {e} (will retry)")
+            return False
+
+    async def flush(self, names: Optional[Iterable[str]] = None):
+        """Write the dirty targets (all of them, or only `names`) in a worker thread."""
+        loop = asyncio.get_running_loop()
+        for name, target, data in self._take(names):
+            if not await loop.run_in_executor(None, self._write, name, target, data):
+                self.dirty.add(name) # Retried by the background writer on its next pass
+                if self._task is None or self._task.done():
+                    self._task = loop.create_task(self._writer())
+
+    def flush_sync(self, names: Optional[Iterable[str]] = None):
+        """Write the dirty targets on the calling thread."""
+        for name, target, data in self._take(names):
+            if not self._write(name, target, data):
+                self.dirty.add(name)
+
+
+# Shared by every cog, so all JSON writes go through the same queue
+persister = WriteBehindPersister()
@@ -0,0 +1,69 @@
+# utils/retrieval.py
+import math
+import re
+from typing import Dict, List, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have he her his how i if in into is it its
+just me my no not of on or our she so that the their them then there these they this to too was we
+were what when where which who why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens without stopwords."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (about 4 characters per token for English text)."""
+    return max(1, (len(text) + 3) // 4)
+
+
+class BM25Index:
+    """
+    Small in-memory BM25 index over a list of text entries.
+
+    Built once per version of the entry list; queries only touch the postings of the query terms.
+    """
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(documents)
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {} # term -> [(doc index, term frequency)]
+        for doc_index, document in enumerate(documents):
+            tokens = tokenize(document)
+            self.doc_lengths.append(len(tokens))
+            frequencies: Dict[str, int] = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                self.postings.setdefault(token, []).append((doc_index, frequency))
+        self.avg_doc_length = (sum(self.doc_lengths) / self.doc_count) if self.doc_count else 0.0
+        self.idf = {
+            term: math.log(1 + (self.doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """BM25 score per document index (documents without any query term are left out)."""
+        scores: Dict[int, float] = {}
+        if not self.doc_count:
+            return scores
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_index, frequency in posting:
+                length_norm = 1 - self.b + self.b * (self.doc_lengths[doc_index] / self.avg_doc_length if self.avg_doc_length else 0)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """The `k` best (doc index, score) pairs, best first."""
+        ranked = sorted(self.scores(query).items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
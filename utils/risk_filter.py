@@ -0,0 +1,108 @@
+# utils/risk_filter.py
+import re
+from typing import Dict, List
+
+DEFAULT_RISK_THRESHOLD = 0.0 # Off: every message goes to the LLM unless a guild opts in with its own threshold
+RECOMMENDED_RISK_THRESHOLD = 1.0 # Suggested opt-in value; messages scoring below it are treated as clean
+
+# Word / phrase -> weight. Kept deliberately broad: a false "risky" only costs one LLM call,
+# a false "clean" skips moderation, so anything rule-adjacent should push the score up.
+RISK_LEXICON: Dict[str, float] = {
+    # Rule 1 / 4 / 5A - sexual content
+    "porn": 1.0, "nsfw": 0.6, "nude": 1.0, "nudes": 1.0, "sex": 0.6, "sexy": 0.4, "cum": 0.8, "dick": 0.6,
+    "cock": 0.8, "pussy": 0.8, "tits": 0.6, "boobs": 0.5, "hentai": 1.0, "rule34": 1.0, "onlyfans": 1.0,
+    "blowjob": 1.0, "horny": 0.5, "fuck": 0.4, "fucking": 0.4, "rape": 1.0, "raped": 1.0, "ai porn": 1.0,
+    # Rule 2 / 3 - harassment, hate, threats
+    "kys": 1.0, "kill yourself": 1.0, "retard": 1.0, "retarded": 1.0, "faggot": 1.5, "fag": 1.2,
+    "tranny": 1.5, "nazi": 0.8, "hitler": 0.6, "slut": 0.8, "whore": 0.8, "bitch": 0.6, "stfu": 0.4,
+    "idiot": 0.4, "stupid": 0.3, "loser": 0.3, "ugly": 0.3, "hate you": 0.8, "shut up": 0.3,
+    "dox": 1.2, "doxx": 1.2, "swat": 1.0, "ip address": 0.8, "i will find you": 1.2, "kill you": 1.2,
+}
+
+# Never skipped, whatever the score: self-harm and anything involving minors
+SEVERE_PATTERNS = [
+    re.compile(r"\b(suicide|suicidal|kill myself|killing myself|end my life|end it all|kms|want to die|wanna die|self[- ]?harm|cut myself|cutting myself|overdose)\b", re.IGNORECASE),
+    re.compile(r"\b(loli|lolicon|shota|shotacon|cp|child porn|underage|minor|minors|pedo|pedophile|paedo)\b", re.IGNORECASE),
+]
+
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+INVITE_PATTERN = re.compile(r"(discord\.gg|discord(?:app)?\.com/invite)/\S+", re.IGNORECASE)
+REPEATED_CHAR_PATTERN = re.compile(r"(.)\1{5,}")
+SECOND_PERSON_PATTERN = re.compile(r"\b(you|u|ur|your|you're|youre)\b", re.IGNORECASE)
+LEET_TABLE = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+
+_single_words = {term: weight for term, weight in RISK_LEXICON.items() if " " not in term}
+_phrases = {term: weight for term, weight in RISK_LEXICON.items() if " " in term}
+_PHRASE_PATTERN = re.compile(r"\b(" + "|".join(re.escape(p) for p in sorted(_phrases, key=len, reverse=True)) + r")\b") if _phrases else None
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class RiskAssessment:
+    def __init__(self):
+        self.score = 0.0
+        self.reasons: List[str] = []
+        self.severe = False
+
+    def add(self, weight: float, reason: str):
+        self.score += weight
+        self.reasons.append(reason)
+
+    def needs_llm(self, threshold: float) -> bool:
+        return self.severe or self.score >= threshold
+
+
+def assess_message(content: str, mention_count: int = 0, role_mention_count: int = 0, mentions_everyone: bool = False,
+                   attachment_count: int = 0, embed_count: int = 0, sticker_count: int = 0,
+                   infraction_count: int = 0) -> RiskAssessment:
+    """Cheap in-process risk score for a message (lexicon, regex features, mentions/links/attachments, history)."""
+    risk = RiskAssessment()
+    lowered = content.lower()
+    normalized = lowered.translate(LEET_TABLE)
+
+    for pattern in SEVERE_PATTERNS:
+        match = pattern.search(lowered) or pattern.search(normalized)
+        if match:
+            risk.severe = True
+            risk.add(2.0, f"severe:{match.group(0)}")
+
+    lexicon_score = 0.0
+    for word in set(_WORD_PATTERN.findall(normalized)):
+        weight = _single_words.get(word)
+        if weight:
+            lexicon_score += weight
+            risk.reasons.append(f"word:{word}")
+    if _PHRASE_PATTERN:
+        for phrase in set(_PHRASE_PATTERN.findall(normalized)):
+            lexicon_score += _phrases[phrase]
+            risk.reasons.append(f"phrase:{phrase}")
+    if lexicon_score:
+        risk.score += min(lexicon_score, 3.0)
+        if SECOND_PERSON_PATTERN.search(lowered):
+            risk.add(0.3, "directed") # Insults aimed at someone are more likely to be harassment
+
+    urls = URL_PATTERN.findall(content)
+    if urls:
+        risk.add(min(0.5 * len(urls), 1.5), f"links:{len(urls)}")
+    if INVITE_PATTERN.search(content):
+        risk.add(1.0, "invite")
+    if mentions_everyone:
+        risk.add(1.0, "everyone")
+    if mention_count >= 5:
+        risk.add(1.0, f"mass_mentions:{mention_count}")
+    elif mention_count:
+        risk.add(0.2, f"mentions:{mention_count}")
+    if role_mention_count:
+        risk.add(0.3, f"role_mentions:{role_mention_count}")
+    if attachment_count or embed_count or sticker_count:
+        risk.add(0.5, f"media:{attachment_count + embed_count + sticker_count}")
+
+    letters = [c for c in content if c.isalpha()]
+    if len(letters) >= 12 and sum(1 for c in letters if c.isupper()) / len(letters) > 0.7:
+        risk.add(0.4, "caps")
+    if REPEATED_CHAR_PATTERN.search(content):
+        risk.add(0.2, "repeated_chars")
+    if len(content) > 400:
+        risk.add(0.3, "long")
+    if infraction_count:
+        risk.add(min(0.4 * infraction_count, 1.2), f"infractions:{infraction_count}")
+    return risk
@@ -0,0 +1,76 @@
+# utils/sse.py
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+async def iter_sse_json(response) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield the JSON payload of each `data:` event from a Server-Sent Events response
+    (OpenAI / OpenRouter `stream: true` format). Stops at `data: [DONE]`.
+    Comment lines (e.g. OpenRouter's ": OPENROUTER PROCESSING" keep-alives) are skipped.
+    """
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if not line or line.startswith(":") or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            print(f"Skipping malformed stream event: {data[:200]}")
+
+
+class ChatStreamAccumulator:
+    """Rebuilds a chat completion message (content + tool calls) from streamed deltas."""
+
+    def __init__(self):
+        self.content_parts: List[str] = []
+        self.tool_calls: Dict[int, Dict[str, Any]] = {} # index -> tool call being assembled
+        self.finish_reason: Optional[str] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+
+    def add(self, chunk: Dict[str, Any]) -> str:
+        """Merge one streamed chunk. Returns the new text content it carried (may be empty)."""
+        if chunk.get("error"):
+            self.error = chunk["error"] # Providers can report errors mid-stream
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        choices = chunk.get("choices") or []
+        if not choices:
+            return ""
+        choice = choices[0]
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+        delta = choice.get("delta") or {}
+
+        for tool_delta in delta.get("tool_calls") or []:
+            index = tool_delta.get("index", len(self.tool_calls))
+            call = self.tool_calls.setdefault(index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if tool_delta.get("id"):
+                call["id"] = tool_delta["id"]
+            if tool_delta.get("type"):
+                call["type"] = tool_delta["type"]
+            function_delta = tool_delta.get("function") or {}
+            if function_delta.get("name"):
+                call["function"]["name"] += function_delta["name"]
+            if function_delta.get("arguments"):
+                call["function"]["arguments"] += function_delta["arguments"]
+
+        text = delta.get("content") or ""
+        if text:
+            self.content_parts.append(text)
+        return text
+
+    @property
+    def content(self) -> str:
+        return "".join(self.content_parts)
+
+    def message(self) -> Dict[str, Any]:
+        """The assembled assistant message, in the same shape as a non-streamed response."""
+        message: Dict[str, Any] = {"role": "assistant", "content": self.content or None}
+        if self.tool_calls:
+            message["tool_calls"] = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        return message
@@ -0,0 +1,157 @@
+# utils/system_commands.py
+import getpass
+import os
+import platform
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError: # free/uptime/df fall back to the real commands
+    psutil = None
+
+# How long each command's output may be reused (seconds). Static facts are cached for longer.
+COMMAND_TTLS = {
+    "date": 0.0, "uptime": 1.0, "free": 2.0, "df": 10.0,
+    "whoami": 300.0, "hostname": 300.0, "uname": 300.0, "pwd": 300.0,
+}
+
+
+def _human_size(num_bytes: float) -> str:
+    for unit in ("B", "Ki", "Mi", "Gi", "Ti"):
+        if abs(num_bytes) < 1024 or unit == "Ti":
+            return f"{num_bytes:.0f}{unit}" if unit == "B" else f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}Ti"
+
+
+def _format_duration(seconds: float) -> str:
+    delta = timedelta(seconds=int(seconds))
+    hours, remainder = divmod(delta.seconds, 3600)
+    minutes = remainder // 60
+    parts = []
+    if delta.days:
+        parts.append(f"{delta.days} day{'s' if delta.days != 1 else ''}")
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    parts.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
+    return ", ".join(parts)
+
+
+def cmd_date(args: List[str]) -> Optional[str]:
+    now = datetime.now().astimezone()
+    if not args:
+        return now.strftime("%a %b %d %H:%M:%S %Z %Y")
+    if len(args) == 1 and args[0].startswith("+"):
+        return now.strftime(args[0][1:])
+    if args == ["-u"] or args == ["--utc"]:
+        return datetime.now(timezone.utc).strftime("%a %b %d %H:%M:%S UTC %Y")
+    return None
+
+
+def cmd_uptime(args: List[str]) -> Optional[str]:
+    if psutil is None or args not in ([], ["-p"], ["--pretty"]):
+        return None
+    uptime_seconds = time.time() - psutil.boot_time()
+    if args:
+        return f"up {_format_duration(uptime_seconds)}"
+    try:
+        load = ", ".join(f"{value:.2f}" for value in os.getloadavg())
+    except (AttributeError, OSError):
+        load = "n/a"
+    return f" {datetime.now().strftime('%H:%M:%S')} up {_format_duration(uptime_seconds)},  {len(psutil.users())} users,  load average: {load}"
+
+
+def cmd_free(args: List[str]) -> Optional[str]:
+    if psutil is None:
+        return None
+    flags = set(args)
+    if not flags <= {"-h", "-m", "-g", "-k", "-b", "--human"}:
+        return None
+    if flags & {"-h", "--human"}:
+        fmt = _human_size
+    else:
+        divisor = 1024 ** 3 if "-g" in flags else 1024 ** 2 if "-m" in flags else 1 if "-b" in flags else 1024
+        fmt = lambda value: str(int(value // divisor))
+    memory = psutil.virtual_memory()
+    swap = psutil.swap_memory()
+    buff_cache = getattr(memory, "buffers", 0) + getattr(memory, "cached", 0)
+    rows = [
+        ["", "total", "used", "free", "shared", "buff/cache", "available"],
+        ["Mem:", fmt(memory.total), fmt(memory.used), fmt(memory.free), fmt(getattr(memory, "shared", 0)), fmt(buff_cache), fmt(memory.available)],
+        ["Swap:", fmt(swap.total), fmt(swap.used), fmt(swap.free)],
+    ]
+    return "\n".join("".join(cell.rjust(12) if i else cell.ljust(6) for i, cell in enumerate(row)) for row in rows)
+
+
+def cmd_df(args: List[str]) -> Optional[str]:
+    if psutil is None:
+        return None
+    human = any(arg in ("-h", "--human-readable") for arg in args)
+    paths = [arg for arg in args if not arg.startswith("-")]
+    if any(arg.startswith("-") and arg not in ("-h", "--human-readable") for arg in args):
+        return None
+    fmt = _human_size if human else (lambda value: str(int(value // 1024)))
+    if paths:
+        mounts = [(path, path) for path in paths]
+    else:
+        mounts = [(p.device, p.mountpoint) for p in psutil.disk_partitions(all=False)]
+    rows = [["Filesystem", "Size" if human else "1K-blocks", "Used", "Avail", "Use%", "Mounted on"]]
+    for device, mountpoint in mounts:
+        try:
+            usage = psutil.disk_usage(mountpoint)
+        except (OSError, PermissionError) as e:
+            if paths:
+                return f"df: {mountpoint}: {e.strerror or e}"
+            continue
+        rows.append([device, fmt(usage.total), fmt(usage.used), fmt(usage.free), f"{usage.percent:.0f}%", mountpoint])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(" ".join(cell.ljust(widths[i]) if i in (0, 5) else cell.rjust(widths[i]) for i, cell in enumerate(row)).rstrip() for row in rows)
+
+
+def cmd_whoami(args: List[str]) -> Optional[str]:
+    return getpass.getuser() if not args else None
+
+
+def cmd_hostname(args: List[str]) -> Optional[str]:
+    return socket.gethostname() if not args else None
+
+
+def cmd_uname(args: List[str]) -> Optional[str]:
+    info = platform.uname()
+    fields = {"-s": info.system, "-n": info.node, "-r": info.release, "-v": info.version, "-m": info.machine}
+    if not args:
+        return info.system
+    if args in (["-a"], ["--all"]):
+        return " ".join([info.system, info.node, info.release, info.version, info.machine])
+    flags = []
+    for arg in args:
+        if not arg.startswith("-") or arg.startswith("--"):
+            return None
+        flags.extend(f"-{letter}" for letter in arg[1:])
+    if any(flag not in fields for flag in flags):
+        return None
+    return " ".join(fields[flag] for flag in ("-s", "-n", "-r", "-v", "-m") if flag in flags)
+
+
+def cmd_pwd(args: List[str]) -> Optional[str]:
+    return os.getcwd() if not args else None
+
+
+BUILTIN_COMMANDS: Dict[str, Callable[[List[str]], Optional[str]]] = {
+    "date": cmd_date, "uptime": cmd_uptime, "free": cmd_free, "df": cmd_df,
+    "whoami": cmd_whoami, "hostname": cmd_hostname, "uname": cmd_uname, "pwd": cmd_pwd,
+}
+
+
+def run_builtin(parts: List[str]) -> Optional[str]:
+    """
+    Answer a read-only command in-process. Returns None if the command (or one of its
+    options) is not handled here, in which case the caller should run the real program.
+    """
+    if not parts:
+        return None
+    handler = BUILTIN_COMMANDS.get(parts[0].lower())
+    return handler(parts[1:]) if handler else None